@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""测试webhook_server的投递日志worker、依赖环境切换和部署目标配置（不需要GitHub和真实部署目录）"""
+
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp(prefix='webhook_test_')
+os.environ.update({
+    'GITHUB_WEBHOOK_SECRET': 'test-secret',
+    'LOG_FILE': os.path.join(TMP_DIR, 'webhook.log'),
+    'DELIVERY_DB': os.path.join(TMP_DIR, 'deliveries.db'),
+    'DEPLOY_PATH': os.path.join(TMP_DIR, 'app'),
+    'DEPLOY_BRANCH': 'main',
+    'DEPS_ENV_KEEP': '2',
+})
+os.environ.pop('WEBHOOK_CONFIG', None)
+os.environ.pop('DEPLOY_REPOSITORY', None)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import webhook_server
+
+
+def sign(data):
+    return 'sha256=' + hmac.new(b'test-secret', data, hashlib.sha256).hexdigest()
+
+
+def delivery_status(delivery_id):
+    with webhook_server._delivery_db() as conn:
+        row = conn.execute("SELECT status, message FROM deliveries WHERE delivery_id = ?", (delivery_id,)).fetchone()
+    return (row['status'], row['message']) if row else (None, None)
+
+
+def wait_for_status(delivery_id, statuses=('done', 'failed', 'ignored', 'superseded'), timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, message = delivery_status(delivery_id)
+        if status in statuses:
+            return status, message
+        webhook_server._delivery_wakeup.set()
+        time.sleep(0.05)
+    raise AssertionError(f"投递 {delivery_id} 未在{timeout}秒内处理: {delivery_status(delivery_id)}")
+
+
+def test_worker_survives_malformed_payloads():
+    """载荷不是JSON对象或字段类型错误时标记为failed，worker继续处理后面的投递"""
+    payloads = {
+        'bad-list': b'[1, 2]',
+        'bad-string': b'"push"',
+        'bad-repository': b'{"repository": "org/app", "ref": "refs/heads/main"}',
+        'bad-json': b'{not json',
+        'untargeted': json.dumps({'repository': {'full_name': 'org/app'}, 'ref': 'refs/heads/other'}).encode(),
+    }
+    for delivery_id, payload in payloads.items():
+        assert webhook_server.record_delivery(delivery_id, 'push', payload)
+    webhook_server._delivery_wakeup.set()
+
+    statuses = {delivery_id: wait_for_status(delivery_id)[0] for delivery_id in payloads}
+    print(f"投递状态: {statuses}")
+    assert statuses == {'bad-list': 'failed', 'bad-string': 'failed', 'bad-repository': 'failed',
+                        'bad-json': 'failed', 'untargeted': 'ignored'}
+
+
+def test_worker_survives_database_errors():
+    """领取投递时数据库出错（如database is locked），worker记录日志后继续运行"""
+    original = webhook_server._claim_next_delivery
+    calls = []
+
+    def flaky_claim(conn):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return original(conn)
+
+    webhook_server._claim_next_delivery = flaky_claim
+    try:
+        webhook_server._delivery_wakeup.set()
+        time.sleep(0.2)
+        payload = json.dumps({'repository': {'full_name': 'org/app'}, 'ref': 'refs/heads/nowhere'}).encode()
+        assert webhook_server.record_delivery('after-db-error', 'push', payload)
+        assert wait_for_status('after-db-error')[0] == 'ignored'
+    finally:
+        webhook_server._claim_next_delivery = original
+    assert len(calls) > 1
+
+
+def test_drain_target_releases_directory_on_errors():
+    """记录结果失败时部署目录不会一直处于占用状态，之后的投递照常部署"""
+    deploy_path = os.path.join(TMP_DIR, 'drain')
+    target = {'path': deploy_path}
+    row = {'delivery_id': 'drain-1'}
+    deployed = []
+    original_run, original_finish = webhook_server.run_deployment, webhook_server._finish_delivery
+
+    def fake_run(payload_data, target, stage_timings):
+        deployed.append(payload_data['n'])
+        return True, '部署成功'
+
+    def broken_finish(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    webhook_server.run_deployment = fake_run
+    webhook_server._finish_delivery = broken_finish
+    try:
+        with webhook_server._target_lock:
+            webhook_server._target_queues[deploy_path] = [(row, {'n': 1}, target)]
+            webhook_server._active_targets.add(deploy_path)
+        webhook_server._drain_target(deploy_path)
+        assert deploy_path not in webhook_server._active_targets
+
+        # 之后的投递照常部署
+        webhook_server._finish_delivery = original_finish
+        with webhook_server._target_lock:
+            webhook_server._target_queues[deploy_path] = [({'delivery_id': 'drain-2'}, {'n': 2}, target)]
+            webhook_server._active_targets.add(deploy_path)
+        webhook_server._deploy_executor.submit(webhook_server._drain_target, deploy_path).result(timeout=5)
+        assert deploy_path not in webhook_server._active_targets
+    finally:
+        webhook_server.run_deployment = original_run
+        webhook_server._finish_delivery = original_finish
+    assert deployed == [1, 2]
+
+
+def test_single_worker_process():
+    """worker文件锁已被本进程持有，其他进程拿不到锁，也不会重置正在部署的投递"""
+    code = (
+        "import fcntl, sys\n"
+        f"f = open({webhook_server.DELIVERY_WORKER_LOCK!r}, 'a')\n"
+        "try:\n"
+        "    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+        "except BlockingIOError:\n"
+        "    sys.exit(3)\n"
+    )
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 3
+
+
+def test_deliveries_requires_signature():
+    """/deliveries需要签名，limit限制在1-200"""
+    client = webhook_server.app.test_client()
+    assert client.get('/deliveries').status_code == 403
+    assert client.get('/deliveries?limit=5', headers={'X-Hub-Signature-256': sign(b'limit=1')}).status_code == 403
+
+    response = client.get('/deliveries?limit=-1', headers={'X-Hub-Signature-256': sign(b'limit=-1')})
+    assert response.status_code == 200 and len(response.get_json()) == 1
+    response = client.get('/deliveries', headers={'X-Hub-Signature-256': sign(b'')})
+    assert response.status_code == 200 and len(response.get_json()) > 1
+
+
+
+def git(*args, cwd):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+
+def commit_file(repo, name, content):
+    with open(os.path.join(repo, name), 'w') as f:
+        f.write(content)
+    git('add', name, cwd=repo)
+    git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', f'update {name}', cwd=repo)
+
+
+def test_dependency_hash_is_stable():
+    """内容相同则哈希相同；内容变化、文件增删都会改变哈希；依赖文件都不存在时为None"""
+    deploy_path = tempfile.mkdtemp(dir=TMP_DIR)
+    assert webhook_server.hash_dependency_files(deploy_path, webhook_server.NODE_DEP_FILES) is None
+
+    with open(os.path.join(deploy_path, 'package.json'), 'w') as f:
+        f.write('{"name": "app"}')
+    first = webhook_server.hash_dependency_files(deploy_path, webhook_server.NODE_DEP_FILES)
+    assert first == webhook_server.hash_dependency_files(deploy_path, webhook_server.NODE_DEP_FILES)
+
+    with open(os.path.join(deploy_path, 'package-lock.json'), 'w') as f:
+        f.write('{}')
+    with_lock = webhook_server.hash_dependency_files(deploy_path, webhook_server.NODE_DEP_FILES)
+    assert with_lock != first
+
+    # 同样的内容放在不同文件中，哈希不同
+    os.remove(os.path.join(deploy_path, 'package-lock.json'))
+    with open(os.path.join(deploy_path, 'package.json'), 'w') as f:
+        f.write('{"name": "app"}{}')
+    assert webhook_server.hash_dependency_files(deploy_path, webhook_server.NODE_DEP_FILES) not in (first, with_lock)
+
+
+def test_atomic_symlink_and_cleanup():
+    """已有的普通目录被移到一旁；链接被原子替换；旧环境只保留DEPS_ENV_KEEP个"""
+    root = tempfile.mkdtemp(dir=TMP_DIR)
+    link_path = os.path.join(root, '.venv')
+    os.makedirs(os.path.join(link_path, 'lib'))
+    env_dir = os.path.join(root, 'envs')
+    envs = []
+    for i in range(4):
+        env_path = os.path.join(env_dir, f'py-{i}')
+        os.makedirs(env_path)
+        os.utime(env_path, (1000 + i, 1000 + i))
+        envs.append(env_path)
+
+    webhook_server._atomic_symlink(envs[0], link_path)
+    assert os.path.realpath(link_path) == os.path.realpath(envs[0])
+    assert [name for name in os.listdir(root) if name.startswith('.venv.old-')]
+    webhook_server._atomic_symlink(envs[3], link_path)
+    assert os.path.realpath(link_path) == os.path.realpath(envs[3])
+
+    webhook_server._cleanup_old_envs(env_dir, 'py-', envs[3])
+    print(f"保留的环境: {sorted(os.listdir(env_dir))}")
+    assert sorted(os.listdir(env_dir)) == ['py-2', 'py-3']
+
+
+def test_install_skipped_when_requirements_unchanged():
+    """requirements.txt未变化且.venv已指向完整环境时跳过安装；变化时安装到新环境并切换.venv"""
+    origin = tempfile.mkdtemp(dir=TMP_DIR)
+    git('init', '-q', '-b', 'main', cwd=origin)
+    commit_file(origin, 'requirements.txt', '# 没有依赖\n')
+    deploy_path = os.path.join(TMP_DIR, 'deploy')
+    git('clone', '-q', origin, deploy_path, cwd=TMP_DIR)
+    env_dir = os.path.join(TMP_DIR, 'deploy_envs')
+    target = {'path': deploy_path, 'branch': 'main', 'remote': 'origin', 'fetch_depth': 0,
+              'custom_cmd': None, 'service': None, 'deps_env_dir': env_dir}
+    event = {'repository': {'full_name': 'org/app'}}
+
+    installs = []
+    original_install = webhook_server.install_python_deps
+
+    def counting_install(deploy_path, deps_hash, env_dir):
+        installs.append(deps_hash)
+        original_install(deploy_path, deps_hash, env_dir)
+
+    webhook_server.install_python_deps = counting_install
+    try:
+        assert webhook_server.run_deployment(event, target)[0]
+        first_env = os.path.realpath(os.path.join(deploy_path, '.venv'))
+        assert len(installs) == 1
+
+        commit_file(origin, 'app.py', 'print("v2")\n')
+        timings = {}
+        assert webhook_server.run_deployment(event, target, timings)[0]
+        assert len(installs) == 1
+        assert os.path.exists(os.path.join(deploy_path, 'app.py'))
+
+        commit_file(origin, 'requirements.txt', '# 依赖已更新\n')
+        assert webhook_server.run_deployment(event, target)[0]
+    finally:
+        webhook_server.install_python_deps = original_install
+
+    second_env = os.path.realpath(os.path.join(deploy_path, '.venv'))
+    print(f"安装次数: {len(installs)}, 跳过安装时各阶段耗时: {timings}")
+    assert len(installs) == 2 and installs[0] != installs[1]
+    assert second_env != first_env
+    assert os.path.exists(os.path.join(second_env, 'bin', 'python'))
+    assert os.path.exists(os.path.join(second_env, webhook_server.ENV_READY_MARKER))
+    # 上一个环境保留用于回滚
+    assert os.path.isdir(first_env)
+
+
+
+def test_yaml_only_needed_with_config():
+    """未设置WEBHOOK_CONFIG时不导入yaml"""
+    code = "import sys; sys.modules['yaml'] = None; import webhook_server; print(len(webhook_server.DEPLOY_TARGETS))"
+    env = {**os.environ, 'DELIVERY_DB': os.path.join(TMP_DIR, 'no_yaml.db')}
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, timeout=30)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '1'
+
+
+def test_deploy_target_lookup():
+    """按(仓库, 分支)查找部署目标，未配置的仓库回退到'*'目标，默认配置可被单个目标覆盖"""
+    config_path = os.path.join(TMP_DIR, 'targets.yaml')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        f.write(
+            "defaults:\n"
+            "  fetch_depth: 5\n"
+            "repos:\n"
+            "  - {repository: org/app, branch: main, path: /srv/app, service: app}\n"
+            "  - {repository: org/app, branch: develop, path: /srv/app-staging, fetch_depth: 0}\n"
+            "  - {repository: '*', branch: main, path: /srv/default}\n"
+        )
+    targets = webhook_server.load_deploy_targets(config_path)
+    assert targets[('org/app', 'main')]['fetch_depth'] == 5
+    assert targets[('org/app', 'develop')]['fetch_depth'] == 0
+    assert targets[('org/app', 'main')]['deps_env_dir'] == '/srv/app/.deploy_envs'
+
+    original = webhook_server.DEPLOY_TARGETS
+    webhook_server.DEPLOY_TARGETS = targets
+    try:
+        assert webhook_server.find_deploy_target('org/app', 'main')['path'] == '/srv/app'
+        assert webhook_server.find_deploy_target('org/app', 'develop')['path'] == '/srv/app-staging'
+        assert webhook_server.find_deploy_target('org/other', 'main')['path'] == '/srv/default'
+        assert webhook_server.find_deploy_target('org/other', 'develop') is None
+
+        # 未提供配置文件时由环境变量生成'*'目标，匹配任意仓库的DEPLOY_BRANCH分支
+        webhook_server.DEPLOY_TARGETS = webhook_server.load_deploy_targets(None)
+        assert list(webhook_server.DEPLOY_TARGETS) == [('*', 'main')]
+        assert webhook_server.find_deploy_target('any/repo', 'main')['path'] == os.environ['DEPLOY_PATH']
+        assert webhook_server.find_deploy_target('any/repo', 'feature') is None
+    finally:
+        webhook_server.DEPLOY_TARGETS = original
+
+    with open(config_path, 'a', encoding='utf-8') as f:
+        f.write("  - {repository: org/app, branch: main, path: /srv/dup}\n")
+    for content, error in ((None, '重复'), ("repos:\n  - {repository: org/app, path: /srv/app}\n", 'branch')):
+        if content is not None:
+            with open(config_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        try:
+            webhook_server.load_deploy_targets(config_path)
+        except ValueError as e:
+            assert error in str(e)
+        else:
+            raise AssertionError("配置错误时应该抛出ValueError")
+
+
+def test_backlog_collapsed_to_latest_delivery():
+    """同一部署目录积压的投递只部署最新的一个，其余标记为superseded"""
+    deploy_path = os.path.join(TMP_DIR, 'backlog')
+    target = {'path': deploy_path}
+    ids = ['backlog-1', 'backlog-2', 'backlog-3']
+    with webhook_server._delivery_db() as conn:
+        for delivery_id in ids:
+            # 已被worker领取的投递
+            conn.execute("INSERT INTO deliveries (delivery_id, event, payload, received_at, status) "
+                         "VALUES (?, 'push', '{}', ?, 'running')", (delivery_id, time.time()))
+        rows = [conn.execute("SELECT * FROM deliveries WHERE delivery_id = ?", (delivery_id,)).fetchone()
+                for delivery_id in ids]
+
+    deployed = []
+    original_run = webhook_server.run_deployment
+
+    def fake_run(payload_data, target, stage_timings):
+        deployed.append(payload_data['id'])
+        stage_timings['fetch'] = 0.01
+        return True, '部署成功'
+
+    webhook_server.run_deployment = fake_run
+    try:
+        with webhook_server._target_lock:
+            webhook_server._target_queues[deploy_path] = [(row, {'id': row['delivery_id']}, target) for row in rows]
+            webhook_server._active_targets.add(deploy_path)
+        webhook_server._drain_target(deploy_path)
+    finally:
+        webhook_server.run_deployment = original_run
+
+    statuses = [delivery_status(delivery_id) for delivery_id in ids]
+    print(f"积压投递状态: {statuses}")
+    assert deployed == ['backlog-3']
+    assert [status for status, _ in statuses] == ['superseded', 'superseded', 'done']
+    assert all('backlog-3' in message for _, message in statuses[:2])
+    assert deploy_path not in webhook_server._active_targets
+
+
+if __name__ == '__main__':
+    test_worker_survives_malformed_payloads()
+    test_worker_survives_database_errors()
+    test_drain_target_releases_directory_on_errors()
+    test_single_worker_process()
+    test_deliveries_requires_signature()
+    test_dependency_hash_is_stable()
+    test_atomic_symlink_and_cleanup()
+    test_install_skipped_when_requirements_unchanged()
+    test_yaml_only_needed_with_config()
+    test_deploy_target_lookup()
+    test_backlog_collapsed_to_latest_delivery()
+    print("全部测试通过")
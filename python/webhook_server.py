@@ -1,20 +1,42 @@
+import fcntl
 import hmac
 import hashlib
 import json
 import logging
 import os
+import shutil
+import sqlite3
 import subprocess
+import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone  # 修改导入
 from flask import Flask, request, jsonify, abort
 
 # ===== 配置区域 =====
 WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET', 'your_default_secret_123')
+# 多仓库部署配置文件（YAML），参考 webhook_config.yaml；
+# 未配置时使用下面的 DEPLOY_PATH/DEPLOY_BRANCH 等环境变量作为单仓库部署
+WEBHOOK_CONFIG = os.environ.get('WEBHOOK_CONFIG')
 DEPLOY_PATH = os.environ.get('DEPLOY_PATH', '/var/www/myapp')
 REPO_BRANCH = os.environ.get('DEPLOY_BRANCH', 'main')
 ALLOWED_EVENTS = os.environ.get('ALLOWED_EVENTS', 'push').split(',')
 LOG_FILE = os.environ.get('LOG_FILE', '/var/log/webhook_deploy.log')
+# 拉取深度，只拉取配置分支的最近N个提交；0表示不限制
+FETCH_DEPTH = int(os.environ.get('FETCH_DEPTH', '1'))
+# 同时执行部署的最大数量（同一部署目录始终串行）
+DEPLOY_WORKERS = int(os.environ.get('DEPLOY_WORKERS', '4'))
+# 保留的历史依赖环境数量（含当前环境），便于回滚
+DEPS_ENV_KEEP = int(os.environ.get('DEPS_ENV_KEEP', '2'))
+# 投递日志数据库，按X-GitHub-Delivery记录每次投递及部署结果
+DELIVERY_DB = os.environ.get(
+    'DELIVERY_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhook_deliveries.db')
+)
+# worker文件锁：多个进程（如gunicorn -w N）共用一个投递日志时，只有持有该锁的进程执行部署
+DELIVERY_WORKER_LOCK = os.environ.get('DELIVERY_WORKER_LOCK', f"{DELIVERY_DB}.worker.lock")
 # ===================
 
 # 初始化日志系统
@@ -44,85 +66,356 @@ def verify_signature(payload, signature):
     
     return hmac.compare_digest(received_sig, computed_sig)
 
-def run_deployment(event_data):
-    """执行部署任务（在单独线程中运行）"""
+# 依赖文件分组：Python依赖和Node.js依赖分别计算哈希
+# 注意：Python依赖安装到部署目录下的 .venv 虚拟环境（链接到DEPS_ENV_DIR中按哈希命名的环境），
+# 不再用PATH中的pip安装到webhook服务自身的解释器；被部署的服务需要用 .venv/bin/python 启动
+PYTHON_DEP_FILES = ('requirements.txt',)
+NODE_DEP_FILES = ('package.json', 'package-lock.json')
+
+
+def hash_dependency_files(deploy_path, filenames):
+    """
+    计算一组依赖文件的联合哈希
+
+    参数:
+        deploy_path: 部署目录
+        filenames: 依赖文件名列表
+
+    返回:
+        str: 十六进制哈希值；所有文件都不存在时返回None
+    """
+    digest = hashlib.sha256()
+    found = False
+    for filename in filenames:
+        file_path = os.path.join(deploy_path, filename)
+        # 文件名也参与哈希，避免文件增删时哈希不变
+        digest.update(filename.encode('utf-8') + b'\0')
+        if not os.path.exists(file_path):
+            digest.update(b'<missing>')
+            continue
+        found = True
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+    return digest.hexdigest() if found else None
+
+
+def _atomic_symlink(target, link_path):
+    """
+    原子地将link_path指向target（先创建临时链接再rename覆盖）
+
+    如果link_path是普通目录（旧版本直接安装的依赖），先将其移到一旁
+    """
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        backup_path = f"{link_path}.old-{int(time.time())}"
+        logger.info(f"将旧依赖目录移到: {backup_path}")
+        os.rename(link_path, backup_path)
+
+    tmp_link = f"{link_path}.tmp-{os.getpid()}"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link_path)
+
+
+# 环境构建完成后写入的标记文件，没有该标记的环境视为未完成
+ENV_READY_MARKER = '.deploy_env_ready'
+
+
+def _env_is_active(link_path, env_path):
+    """检查link_path当前是否已指向env_path且环境已构建完成"""
+    env_root = os.path.dirname(env_path) if env_path.endswith('node_modules') else env_path
+    return (
+        os.path.islink(link_path)
+        and os.path.realpath(link_path) == os.path.realpath(env_path)
+        and os.path.exists(os.path.join(env_root, ENV_READY_MARKER))
+    )
+
+
+def _cleanup_old_envs(env_dir, prefix, keep_path):
+    """清理同类的旧依赖环境，保留最近的DEPS_ENV_KEEP个"""
+    if not os.path.isdir(env_dir):
+        return
+    candidates = [
+        os.path.join(env_dir, name)
+        for name in os.listdir(env_dir)
+        if name.startswith(prefix)
+    ]
+    candidates.sort(key=os.path.getmtime, reverse=True)
+    stale = [path for path in candidates if path != keep_path][max(DEPS_ENV_KEEP - 1, 0):]
+    for path in stale:
+        logger.info(f"清理旧依赖环境: {path}")
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _build_env(env_path, build):
+    """
+    构建依赖环境，完成后写入标记文件
+
+    环境直接在最终路径中构建（venv中的脚本会记录绝对路径，不能事后改名），
+    在切换链接之前服务始终使用旧环境，因此构建过程不影响线上服务
+
+    参数:
+        env_path: 环境目录
+        build: 构建函数，参数为环境目录路径
+    """
+    marker = os.path.join(env_path, ENV_READY_MARKER)
+    if os.path.exists(marker):
+        # 同样的依赖之前已经装过（例如回滚），直接复用
+        logger.info(f"复用已有依赖环境: {env_path}")
+        return
+    # 上次构建中断留下的残缺环境，删除后重建
+    shutil.rmtree(env_path, ignore_errors=True)
+    os.makedirs(env_path)
+    try:
+        build(env_path)
+    except Exception:
+        shutil.rmtree(env_path, ignore_errors=True)
+        raise
+    with open(marker, 'w') as f:
+        f.write(datetime.now(timezone.utc).isoformat())
+
+
+def install_python_deps(deploy_path, deps_hash, env_dir):
+    """
+    在全新的虚拟环境中安装Python依赖，然后原子切换 deploy_path/.venv
+
+    虚拟环境用运行webhook服务的解释器（sys.executable）创建，
+    被部署的服务需要使用 deploy_path/.venv/bin/python 才能用到这些依赖
+
+    参数:
+        deploy_path: 部署目录
+        deps_hash: requirements.txt的哈希
+        env_dir: 依赖环境存放目录
+    """
+    env_path = os.path.join(env_dir, f"py-{deps_hash[:16]}")
+    requirements_path = os.path.join(deploy_path, 'requirements.txt')
+
+    def build(path):
+        subprocess.run([sys.executable, "-m", "venv", path], check=True, timeout=120)
+        subprocess.run(
+            [os.path.join(path, 'bin', 'python'), "-m", "pip", "install", "-r", requirements_path],
+            cwd=deploy_path,
+            check=True,
+            timeout=300
+        )
+
+    _build_env(env_path, build)
+    _atomic_symlink(env_path, os.path.join(deploy_path, '.venv'))
+    _cleanup_old_envs(env_dir, 'py-', env_path)
+
+
+def install_node_deps(deploy_path, deps_hash, env_dir):
+    """
+    在独立目录中安装Node.js依赖，然后原子切换 deploy_path/node_modules
+
+    参数:
+        deploy_path: 部署目录
+        deps_hash: package.json和package-lock.json的联合哈希
+        env_dir: 依赖环境存放目录
+    """
+    env_path = os.path.join(env_dir, f"node-{deps_hash[:16]}")
+    lock_path = os.path.join(deploy_path, 'package-lock.json')
+
+    def build(path):
+        shutil.copy2(os.path.join(deploy_path, 'package.json'), path)
+        if os.path.exists(lock_path):
+            shutil.copy2(lock_path, path)
+            # 有lock文件时使用npm ci，安装结果可复现且更快
+            cmd = ["npm", "ci", "--production"]
+        else:
+            cmd = ["npm", "install", "--production"]
+        subprocess.run(cmd, cwd=path, check=True, timeout=300)
+
+    _build_env(env_path, build)
+    _atomic_symlink(os.path.join(env_path, 'node_modules'), os.path.join(deploy_path, 'node_modules'))
+    _cleanup_old_envs(env_dir, 'node-', env_path)
+
+
+@contextmanager
+def _timed_stage(stage_timings, stage):
+    """记录一个部署阶段的耗时（秒），阶段失败时同样记录"""
+    stage_start = time.time()
+    try:
+        yield
+    finally:
+        stage_timings[stage] = round(time.time() - stage_start, 3)
+
+
+# ===== 部署目标配置 =====
+
+def load_deploy_targets(config_path=None):
+    """
+    加载部署目标配置
+
+    配置文件中每个目标由 仓库全名 + 分支 唯一确定，对应一个部署目录和部署命令；
+    未提供配置文件时，根据环境变量生成单个部署目标（兼容旧的单仓库部署方式）
+
+    参数:
+        config_path: YAML配置文件路径
+
+    返回:
+        dict: {(仓库全名, 分支): 部署目标配置}
+
+    异常:
+        FileNotFoundError: 配置文件不存在
+        ValueError: 配置项缺失或重复
+    """
+    if not config_path:
+        target = {
+            'repository': os.environ.get('DEPLOY_REPOSITORY', '*'),
+            'branch': REPO_BRANCH,
+            'path': DEPLOY_PATH,
+            'remote': 'origin',
+            'fetch_depth': FETCH_DEPTH,
+            'custom_cmd': os.environ.get('CUSTOM_DEPLOY_CMD'),
+            'service': os.environ.get('SERVICE_NAME'),
+            'deps_env_dir': os.environ.get('DEPS_ENV_DIR', os.path.join(DEPLOY_PATH, '.deploy_envs')),
+        }
+        return {(target['repository'], target['branch']): target}
+
+    # 只有使用配置文件时才需要PyYAML
+    import yaml
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+
+    defaults = config.get('defaults', {})
+    targets = {}
+    for index, item in enumerate(config.get('repos', [])):
+        target = {
+            'remote': 'origin',
+            'fetch_depth': FETCH_DEPTH,
+            'custom_cmd': None,
+            'service': None,
+            **defaults,
+            **item,
+        }
+        for required in ('repository', 'branch', 'path'):
+            if not target.get(required):
+                raise ValueError(f"配置文件第{index + 1}个部署目标缺少 {required}")
+        target.setdefault('deps_env_dir', os.path.join(target['path'], '.deploy_envs'))
+
+        key = (target['repository'], target['branch'])
+        if key in targets:
+            raise ValueError(f"部署目标重复: {key[0]}@{key[1]}")
+        targets[key] = target
+
+    logger.info(f"已加载 {len(targets)} 个部署目标: {config_path}")
+    return targets
+
+
+DEPLOY_TARGETS = load_deploy_targets(WEBHOOK_CONFIG)
+
+
+def find_deploy_target(repo_name, branch):
+    """根据仓库全名和分支查找部署目标，找不到时返回None（'*'表示匹配任意仓库）"""
+    return DEPLOY_TARGETS.get((repo_name, branch)) or DEPLOY_TARGETS.get(('*', branch))
+
+
+def run_deployment(event_data, target, stage_timings=None):
+    """
+    执行部署任务（由投递日志的后台worker调用）
+
+    参数:
+        event_data: push事件的有效载荷
+        target: 部署目标配置，见 load_deploy_targets
+        stage_timings: 可选，用于接收各阶段耗时的字典
+            （fetch、reset、install、custom_command、restart）
+    """
+    if stage_timings is None:
+        stage_timings = {}
     start_time = time.time()
     repo_name = event_data['repository']['full_name']
-    ref = event_data.get('ref', '')
-    branch = ref.split('/')[-1] if '/' in ref else ref
+    deploy_path = target['path']
+    branch = target['branch']
+    remote = target['remote']
+    env_dir = target['deps_env_dir']
     
-    logger.info(f"开始部署: {repo_name}@{branch}")
+    logger.info(f"开始部署: {repo_name}@{branch} -> {deploy_path}")
     
     try:
-        # 1. 拉取最新代码
+        # 记录拉取前的依赖文件哈希，用于判断是否需要重新安装依赖
+        python_hash_before = hash_dependency_files(deploy_path, PYTHON_DEP_FILES)
+        node_hash_before = hash_dependency_files(deploy_path, NODE_DEP_FILES)
+
+        # 1. 拉取最新代码（只拉取配置的分支，并限制深度）
         logger.info("拉取最新代码...")
-        fetch_result = subprocess.run(
-            ["git", "-C", DEPLOY_PATH, "fetch", "--all"],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=120  # 添加超时
-        )
+        fetch_cmd = ["git", "-C", deploy_path, "fetch", "--no-tags", "--prune"]
+        if target['fetch_depth']:
+            fetch_cmd.append(f"--depth={int(target['fetch_depth'])}")
+        fetch_cmd += [remote, f"+refs/heads/{branch}:refs/remotes/{remote}/{branch}"]
+        with _timed_stage(stage_timings, 'fetch'):
+            fetch_result = subprocess.run(
+                fetch_cmd,
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=120  # 添加超时
+            )
         logger.debug(f"Fetch 输出: {fetch_result.stdout[:200]}...")  # 截断长输出
         
-        reset_result = subprocess.run(
-            ["git", "-C", DEPLOY_PATH, "reset", "--hard", f"origin/{REPO_BRANCH}"],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=60
-        )
+        with _timed_stage(stage_timings, 'reset'):
+            reset_result = subprocess.run(
+                ["git", "-C", deploy_path, "reset", "--hard", f"{remote}/{branch}"],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=60
+            )
         logger.debug(f"Reset 输出: {reset_result.stdout[:200]}...")
         
         # 2. 安装依赖（根据项目类型）
-        requirements_path = os.path.join(DEPLOY_PATH, 'requirements.txt')
-        package_path = os.path.join(DEPLOY_PATH, 'package.json')
-        
-        if os.path.exists(requirements_path):
-            logger.info("安装Python依赖...")
-            subprocess.run(
-                ["pip", "install", "-r", requirements_path],
-                cwd=DEPLOY_PATH,
-                check=True,
-                timeout=300
-            )
-        elif os.path.exists(package_path):
-            logger.info("安装Node.js依赖...")
-            subprocess.run(
-                ["npm", "install", "--production"],
-                cwd=DEPLOY_PATH,
-                check=True,
-                timeout=300
-            )
+        # 依赖文件未变化且当前环境可用时跳过安装；否则在新环境中安装后原子切换
+        with _timed_stage(stage_timings, 'install'):
+            python_hash = hash_dependency_files(deploy_path, PYTHON_DEP_FILES)
+            node_hash = hash_dependency_files(deploy_path, NODE_DEP_FILES)
+            
+            if python_hash:
+                env_path = os.path.join(env_dir, f"py-{python_hash[:16]}")
+                if python_hash == python_hash_before and _env_is_active(os.path.join(deploy_path, '.venv'), env_path):
+                    logger.info("requirements.txt未变化，跳过Python依赖安装")
+                else:
+                    logger.info("安装Python依赖...")
+                    install_python_deps(deploy_path, python_hash, env_dir)
+            elif node_hash:
+                env_path = os.path.join(env_dir, f"node-{node_hash[:16]}", 'node_modules')
+                if node_hash == node_hash_before and _env_is_active(os.path.join(deploy_path, 'node_modules'), env_path):
+                    logger.info("package.json/package-lock.json未变化，跳过Node.js依赖安装")
+                else:
+                    logger.info("安装Node.js依赖...")
+                    install_node_deps(deploy_path, node_hash, env_dir)
         
         # 3. 执行自定义部署命令
-        custom_cmd = os.environ.get('CUSTOM_DEPLOY_CMD')
+        custom_cmd = target['custom_cmd']
         if custom_cmd:
             logger.info(f"执行自定义命令: {custom_cmd}")
-            subprocess.run(
-                custom_cmd,
-                shell=True,
-                cwd=DEPLOY_PATH,
-                check=True,
-                timeout=600
-            )
+            with _timed_stage(stage_timings, 'custom_command'):
+                subprocess.run(
+                    custom_cmd,
+                    shell=True,
+                    cwd=deploy_path,
+                    check=True,
+                    timeout=600
+                )
         
         # 4. 重启服务
-        service_name = os.environ.get('SERVICE_NAME')
+        service_name = target['service']
         if service_name:
             logger.info(f"重启服务: {service_name}")
-            subprocess.run(
-                ["sudo", "systemctl", "restart", service_name],
-                check=True,
-                timeout=30
-            )
+            with _timed_stage(stage_timings, 'restart'):
+                subprocess.run(
+                    ["sudo", "systemctl", "restart", service_name],
+                    check=True,
+                    timeout=30
+                )
         
         duration = time.time() - start_time
-        logger.info(f"部署成功! 耗时: {duration:.2f}秒")
+        logger.info(f"部署成功! {repo_name}@{branch} 耗时: {duration:.2f}秒, 各阶段耗时: {stage_timings}")
         return True, "部署成功"
     
     except subprocess.CalledProcessError as e:
-        error_msg = f"命令执行失败: {e.cmd}\n错误输出: {e.stderr.strip()}"
+        error_msg = f"命令执行失败: {e.cmd}\n错误输出: {(e.stderr or '').strip()}"
         logger.error(error_msg)
         return False, error_msg
     except subprocess.TimeoutExpired as e:
@@ -134,13 +427,291 @@ def run_deployment(event_data):
         logger.exception(error_msg)
         return False, error_msg
 
+# ===== 投递日志 =====
+# webhook请求只负责把投递写入SQLite日志并立即返回，
+# 由后台worker按接收顺序消费日志执行部署。
+# delivery_id为主键，GitHub重新投递（相同X-GitHub-Delivery）不会重复部署。
+# 多个进程都可以接收webhook，但同一时间只有持有DELIVERY_WORKER_LOCK的一个进程运行worker；
+# 其他进程的worker线程阻塞在文件锁上，持有锁的进程退出后由其中一个接替。
+
+def _db_connect():
+    """创建投递日志数据库连接（每个线程单独创建）"""
+    conn = sqlite3.connect(DELIVERY_DB, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@contextmanager
+def _delivery_db():
+    """短连接：提交事务后关闭连接，供请求处理函数使用"""
+    conn = _db_connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def init_delivery_log():
+    """初始化投递日志表（每个进程启动时调用）"""
+    db_dir = os.path.dirname(DELIVERY_DB)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    with _delivery_db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                delivery_id   TEXT PRIMARY KEY,
+                event         TEXT NOT NULL,
+                payload       BLOB NOT NULL,
+                received_at   REAL NOT NULL,
+                status        TEXT NOT NULL DEFAULT 'pending',
+                message       TEXT,
+                stage_timings TEXT,
+                started_at    REAL,
+                finished_at   REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_status ON deliveries (status, received_at)")
+
+
+def _acquire_worker_lock():
+    """
+    阻塞直到获得worker文件锁，返回需要一直保持打开的锁文件
+
+    锁随进程退出自动释放，不会因为进程崩溃而残留
+    """
+    lock_file = open(DELIVERY_WORKER_LOCK, 'a')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def _requeue_interrupted_deliveries():
+    """
+    把上一个worker进程退出时未完成的投递重新置为待处理
+
+    只能在持有worker文件锁后调用：此时不存在其他正在部署的进程，'running'的投递都已中断
+    """
+    with _delivery_db() as conn:
+        cursor = conn.execute("UPDATE deliveries SET status = 'pending' WHERE status = 'running'")
+    if cursor.rowcount:
+        logger.warning(f"{cursor.rowcount} 个中断的投递已重新置为待处理")
+
+
+def record_delivery(delivery_id, event_type, payload):
+    """
+    写入一条投递记录
+
+    返回:
+        bool: True表示新投递，False表示重复投递（已存在相同delivery_id）
+    """
+    with _delivery_db() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO deliveries (delivery_id, event, payload, received_at) VALUES (?, ?, ?, ?)",
+            (delivery_id, event_type, payload, time.time())
+        )
+        return cursor.rowcount == 1
+
+
+def _claim_next_delivery(conn):
+    """领取最早的一条待处理投递，多个worker并存时通过条件更新保证只有一个领取成功"""
+    while True:
+        row = conn.execute(
+            "SELECT * FROM deliveries WHERE status = 'pending' ORDER BY received_at LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            cursor = conn.execute(
+                "UPDATE deliveries SET status = 'running', started_at = ? WHERE delivery_id = ? AND status = 'pending'",
+                (time.time(), row['delivery_id'])
+            )
+        if cursor.rowcount == 1:
+            return row
+
+
+def _finish_delivery(delivery_id, status, message, stage_timings=None):
+    """记录投递的处理结果和各阶段耗时"""
+    with _delivery_db() as conn:
+        conn.execute(
+            "UPDATE deliveries SET status = ?, message = ?, stage_timings = ?, finished_at = ? WHERE delivery_id = ?",
+            (status, message, json.dumps(stage_timings or {}), time.time(), delivery_id)
+        )
+
+
+def resolve_delivery(row):
+    """
+    解析投递载荷并查找对应的部署目标
+
+    返回:
+        tuple: (载荷, 部署目标, 说明)；无需部署时部署目标为None
+    """
+    try:
+        payload_data = json.loads(row['payload'])
+    except ValueError as e:
+        return None, None, f"无效的JSON载荷: {str(e)}"
+    if not isinstance(payload_data, dict) or not isinstance(payload_data.get('repository', {}), dict):
+        return None, None, "载荷格式错误: 缺少repository对象"
+
+    repo_name = payload_data.get('repository', {}).get('full_name', '')
+    ref = payload_data.get('ref', '')
+    if not isinstance(repo_name, str) or not isinstance(ref, str):
+        return None, None, "载荷格式错误: repository.full_name和ref必须为字符串"
+    branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+    target = find_deploy_target(repo_name, branch)
+    if target is None:
+        logger.info(f"未配置部署目标，忽略推送: {repo_name}@{branch}")
+        return payload_data, None, f"未配置部署目标: {repo_name}@{branch}"
+    return payload_data, target, ''
+
+
+_delivery_wakeup = threading.Event()
+_worker_started = False
+_worker_lock = threading.Lock()
+# 每个部署目录一个待部署队列，同一目录的部署串行执行，不同目录之间并行
+# （只有持有worker文件锁的进程执行部署，因此跨进程同样成立）
+_target_queues = {}
+_active_targets = set()
+_target_lock = threading.Lock()
+_deploy_executor = None
+
+
+def _drain_target(deploy_path):
+    """
+    依次执行某个部署目录的待部署投递
+
+    队列中积压多个投递时只部署最新的一个（拉取的是分支最新代码，结果相同），
+    较早的投递标记为superseded
+    """
+    try:
+        while True:
+            with _target_lock:
+                queue = _target_queues.get(deploy_path)
+                if not queue:
+                    _active_targets.discard(deploy_path)
+                    return
+                pending = list(queue)
+                queue.clear()
+            try:
+                _deploy_latest(pending)
+            except Exception:
+                # 记录结果失败（如数据库被锁）时继续处理该目录的后续投递
+                logger.exception(f"处理部署目录 {deploy_path} 的投递时出错")
+    except BaseException:
+        # 异常退出时释放该目录，否则之后的投递永远不会再被部署
+        with _target_lock:
+            _active_targets.discard(deploy_path)
+        raise
+
+
+def _deploy_latest(pending):
+    """部署积压投递中的最新一个，其余标记为superseded"""
+    for row, _, _ in pending[:-1]:
+        _finish_delivery(row['delivery_id'], 'superseded', f"已被更新的投递取代: {pending[-1][0]['delivery_id']}")
+
+    row, payload_data, target = pending[-1]
+    delivery_id = row['delivery_id']
+    stage_timings = {}
+    try:
+        success, message = run_deployment(payload_data, target, stage_timings)
+        status = 'done' if success else 'failed'
+    except Exception as e:
+        logger.exception(f"处理投递时出错: DeliveryID={delivery_id}")
+        status, message = 'failed', str(e)
+    _finish_delivery(delivery_id, status, message, stage_timings)
+    logger.info(f"投递处理完成: DeliveryID={delivery_id}, 状态={status}, 各阶段耗时={stage_timings}")
+
+
+def _log_future_error(future):
+    """部署线程中未捕获的异常只会保存在Future里，需要主动记录"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("部署线程异常退出", exc_info=future.exception())
+
+
+def delivery_worker():
+    """
+    后台worker：获得worker文件锁后，按接收顺序领取投递，分发到各部署目录的队列中执行
+
+    单次处理出错（如数据库被锁、载荷格式错误）只记录日志并把该投递标记为失败，worker继续运行
+    """
+    # 锁文件保持打开直到进程退出
+    lock_file = _acquire_worker_lock()
+    logger.info(f"已获得worker文件锁: {DELIVERY_WORKER_LOCK}, PID={os.getpid()}")
+    while True:
+        try:
+            _requeue_interrupted_deliveries()
+            break
+        except sqlite3.Error:
+            logger.exception("重置中断的投递失败，稍后重试")
+            time.sleep(1)
+    conn = _db_connect()
+    while True:
+        row = None
+        try:
+            row = _claim_next_delivery(conn)
+            if row is None:
+                # 没有待处理投递时等待唤醒；其他进程接收的投递无法唤醒本进程，超时后再检查一次
+                _delivery_wakeup.wait(timeout=5)
+                _delivery_wakeup.clear()
+                continue
+            _dispatch_delivery(row)
+        except Exception as e:
+            logger.exception(f"投递worker出错: DeliveryID={row['delivery_id'] if row is not None else None}")
+            if row is not None:
+                try:
+                    _finish_delivery(row['delivery_id'], 'failed', f"投递处理出错: {str(e)}")
+                except Exception:
+                    logger.exception(f"记录投递失败状态出错: DeliveryID={row['delivery_id']}")
+            # 连接可能已不可用，重新连接并稍等，避免数据库持续被锁时空转
+            conn.close()
+            conn = _db_connect()
+            time.sleep(1)
+
+
+def _dispatch_delivery(row):
+    """解析一条已领取的投递，放入对应部署目录的队列"""
+    delivery_id = row['delivery_id']
+    logger.info(f"开始处理投递: DeliveryID={delivery_id}")
+    payload_data, target, message = resolve_delivery(row)
+    if target is None:
+        _finish_delivery(delivery_id, 'ignored' if payload_data is not None else 'failed', message)
+        return
+
+    deploy_path = target['path']
+    with _target_lock:
+        _target_queues.setdefault(deploy_path, []).append((row, payload_data, target))
+        if deploy_path in _active_targets:
+            return
+        _active_targets.add(deploy_path)
+    _deploy_executor.submit(_drain_target, deploy_path).add_done_callback(_log_future_error)
+
+
+def start_delivery_worker():
+    """启动后台worker（重复调用只会启动一次）"""
+    global _worker_started, _deploy_executor
+    with _worker_lock:
+        if _worker_started:
+            return
+        init_delivery_log()
+        _deploy_executor = ThreadPoolExecutor(max_workers=DEPLOY_WORKERS, thread_name_prefix='deploy')
+        thread = threading.Thread(target=delivery_worker, name='delivery-worker', daemon=True)
+        thread.start()
+        _worker_started = True
+        logger.info(f"投递日志worker线程已启动（获得worker文件锁后开始部署）: DB={DELIVERY_DB}, 部署目标数={len(DEPLOY_TARGETS)}")
+
+
 @app.route('/webhook', methods=['POST'])
 def handle_webhook():
-    """处理GitHub Webhook请求的主函数"""
+    """
+    处理GitHub Webhook请求的主函数
+
+    只做事件过滤和签名验证，然后把投递写入日志立即返回，
+    JSON解析和部署由后台worker完成
+    """
     # 1. 获取请求头
     event_type = request.headers.get('X-GitHub-Event', 'ping')
     signature = request.headers.get('X-Hub-Signature-256', '')
-    delivery_id = request.headers.get('X-GitHub-Delivery', 'unknown')
+    delivery_id = request.headers.get('X-GitHub-Delivery', '')
     
     # 2. 记录请求信息
     logger.info(f"收到Webhook请求: Event={event_type}, DeliveryID={delivery_id}")
@@ -153,22 +724,16 @@ def handle_webhook():
             "reason": f"事件类型 {event_type} 未启用"
         }), 200
     
-    # 4. 获取并验证签名
-    payload = request.data
+    # 4. 获取并验证签名（HMAC计算开销很小，且必须在写入日志前拒绝伪造请求）
+    payload = request.get_data()
     if not verify_signature(payload, signature):
         logger.error(f"签名验证失败! DeliveryID={delivery_id}")
         abort(403, description="无效的签名")
     
-    # 5. 解析有效载荷
-    try:
-        payload_data = request.get_json()
-    except Exception as e:
-        logger.error(f"JSON解析失败: {str(e)}")
-        abort(400, description="无效的JSON载荷")
-    
-    # 6. 处理ping事件
+    # 5. 处理ping事件
     if event_type == 'ping':
         logger.info("处理ping事件")
+        payload_data = request.get_json(silent=True) or {}
         return jsonify({
             "status": "pong",
             "zen": payload_data.get('zen', ''),
@@ -176,35 +741,26 @@ def handle_webhook():
             "timestamp": datetime.now(timezone.utc).isoformat()  # 修复弃用警告
         }), 200
     
-    # 7. 处理push事件
+    # 6. 处理push事件：写入投递日志后立即返回
     if event_type == 'push':
-        ref = payload_data.get('ref', '')
-        branch = ref.split('/')[-1] if '/' in ref else ref
+        if not delivery_id:
+            abort(400, description="缺少X-GitHub-Delivery请求头")
         
-        # 检查分支
-        if branch != REPO_BRANCH:
-            logger.info(f"忽略非{REPO_BRANCH}分支的推送: {branch}")
+        if not record_delivery(delivery_id, event_type, payload):
+            logger.info(f"重复投递，忽略: DeliveryID={delivery_id}")
             return jsonify({
-                "status": "ignored",
-                "reason": f"仅部署{REPO_BRANCH}分支，当前分支: {branch}"
+                "status": "duplicate",
+                "delivery_id": delivery_id
             }), 200
         
-        # 8. 异步执行部署
-        thread = threading.Thread(
-            target=run_deployment,
-            args=(payload_data,),
-            daemon=True
-        )
-        thread.start()
-        
-        logger.info(f"已启动部署线程: ThreadID={thread.ident}")
+        _delivery_wakeup.set()
         return jsonify({
             "status": "accepted",
-            "message": f"开始部署{branch}分支",
+            "delivery_id": delivery_id,
             "timestamp": datetime.now(timezone.utc).isoformat()  # 修复弃用警告
         }), 202
     
-    # 9. 处理其他事件类型
+    # 7. 处理其他事件类型
     logger.info(f"处理事件: {event_type}")
     return jsonify({
         "status": "unhandled",
@@ -212,6 +768,30 @@ def handle_webhook():
         "timestamp": datetime.now(timezone.utc).isoformat()  # 修复弃用警告
     }), 200
 
+@app.route('/deliveries', methods=['GET'])
+def list_deliveries():
+    """
+    查看最近的投递及各阶段部署耗时
+
+    返回内容包含部署命令的错误输出，与/webhook一样要求签名：
+    X-Hub-Signature-256为WEBHOOK_SECRET对查询字符串（如 limit=50，无参数时为空串）的HMAC-SHA256。
+    不按来源IP放行，经Nginx反向代理时所有请求的来源都是本机。
+    """
+    if not verify_signature(request.query_string, request.headers.get('X-Hub-Signature-256', '')):
+        logger.error(f"投递查询签名验证失败: {request.remote_addr}")
+        abort(403, description="无效的签名")
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    with _delivery_db() as conn:
+        rows = conn.execute(
+            "SELECT delivery_id, event, status, message, stage_timings, received_at, started_at, finished_at "
+            "FROM deliveries ORDER BY received_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    return jsonify([
+        {**dict(row), "stage_timings": json.loads(row['stage_timings'] or '{}')}
+        for row in rows
+    ]), 200
+
 @app.errorhandler(400)
 def bad_request(error):
     logger.error(f"错误请求: {error.description}")
@@ -232,6 +812,9 @@ def internal_error(error):
     logger.exception("服务器内部错误")
     return jsonify({"error": "服务器内部错误"}), 500
 
+# 模块加载时启动worker，使用Gunicorn部署时同样生效
+start_delivery_worker()
+
 if __name__ == '__main__':
     # 生产环境应使用Gunicorn+Nginx
     app.run(host='0.0.0.0', port=8000, debug=False)
\ No newline at end of file
@@ -5,8 +5,152 @@
 import base64
 import hashlib
 import hmac
+import math
 import os
 import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# PBKDF2迭代次数
+PBKDF2_ITERATIONS = 100000
+# 派生密钥缓存的最大条目数（每个主密钥+盐值一条）
+DERIVED_KEY_CACHE_SIZE = 1024
+# 批量接口每个进程任务包含的记录数
+BULK_CHUNK_SIZE = 64
+
+
+def _wipe(buffer):
+    """用0覆盖密钥字节"""
+    buffer[:] = bytes(len(buffer))
+
+
+class DerivedKeyCache:
+    """
+    派生密钥缓存（LRU，线程安全）
+    
+    盐值是用户名而不是每次加密随机生成的，同一主密钥和用户名总是派生出相同的密钥，
+    所以可以缓存：同一用户后续的加解密不再重复执行PBKDF2迭代。
+    
+    缓存键是主密钥和盐值的HMAC（使用进程内随机密钥），不保存主密钥本身；
+    条目被淘汰、删除或清空时用0覆盖缓存中的密钥（返回给调用方的是副本，随调用结束释放）
+    """
+    
+    def __init__(self, maxsize=DERIVED_KEY_CACHE_SIZE):
+        """
+        参数:
+            maxsize: 最大条目数，0表示不缓存
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+    
+    def _cache_key(self, master_key, salt):
+        master_bytes = master_key.encode('utf-8')
+        return hmac.new(self._secret, struct.pack('>I', len(master_bytes)) + master_bytes + salt.encode('utf-8'),
+                        hashlib.sha256).digest()
+    
+    def get(self, master_key, salt):
+        """返回缓存的派生密钥（bytes），未缓存时返回None"""
+        key = self._cache_key(master_key, salt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return bytes(entry)
+    
+    def put(self, master_key, salt, derived_key):
+        if self.maxsize <= 0:
+            return
+        key = self._cache_key(master_key, salt)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = bytearray(derived_key)
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                _wipe(evicted)
+    
+    def discard(self, master_key, salt):
+        key = self._cache_key(master_key, salt)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            _wipe(entry)
+    
+    def clear(self):
+        with self._lock:
+            entries, self._entries = self._entries, OrderedDict()
+        for entry in entries.values():
+            _wipe(entry)
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+_derived_key_cache = DerivedKeyCache()
+
+
+def configure_derived_key_cache(maxsize=DERIVED_KEY_CACHE_SIZE):
+    """
+    清空派生密钥缓存并设置最大条目数，0表示关闭缓存
+    
+    返回:
+        DerivedKeyCache: 当前使用的缓存（可以查看hits/misses）
+    """
+    _derived_key_cache.clear()
+    _derived_key_cache.maxsize = maxsize
+    _derived_key_cache.hits = _derived_key_cache.misses = 0
+    return _derived_key_cache
+
+
+def clear_derived_key_cache():
+    """清空并擦除所有缓存的派生密钥（如更换主密钥后）"""
+    _derived_key_cache.clear()
+
+
+def _derive_key(master_key, salt, store=True):
+    """
+    使用PBKDF2从主密钥和盐值派生64字节密钥（32字节用于加密，32字节用于HMAC），优先使用缓存
+    
+    store为False时不把新派生的密钥放入缓存（解密时等HMAC验证通过后再缓存，避免错误密钥占用缓存）
+    """
+    derived_key = _derived_key_cache.get(master_key, salt)
+    if derived_key is None:
+        derived_key = hashlib.pbkdf2_hmac(
+            'sha256',
+            master_key.encode('utf-8'),
+            salt.encode('utf-8'),
+            PBKDF2_ITERATIONS,
+            dklen=64
+        )
+        if store:
+            _derived_key_cache.put(master_key, salt, derived_key)
+    return derived_key
+
+def _xor_keystream(data, enc_key, iv):
+    """
+    用密钥流 enc_key[i % len(enc_key)] ^ iv[i % len(iv)] 对数据逐字节异或（加密和解密相同）
+    
+    密钥流以两者长度的最小公倍数（32字节密钥、16字节IV时为32字节）为周期，
+    先生成一个周期并重复到数据长度，再把数据和密钥流各转成一个大整数整体异或，
+    避免逐字节的Python循环；结果与逐字节计算完全相同
+    """
+    length = len(data)
+    if not length:
+        return b''
+    period = len(enc_key) * len(iv) // math.gcd(len(enc_key), len(iv))
+    block = bytes(enc_key[i % len(enc_key)] ^ iv[i % len(iv)] for i in range(period))
+    keystream = (block * (length // period + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(length, 'big')
 
 def encrypt_data(data, salt, master_key):
     """
@@ -40,15 +184,8 @@ def encrypt_data(data, salt, master_key):
                 'message': '参数错误：数据、盐值和主密钥必须是字符串'
             }
         
-        # 使用PBKDF2从主密钥和盐值派生密钥
-        # 使用100000次迭代来增强安全性
-        derived_key = hashlib.pbkdf2_hmac(
-            'sha256',
-            master_key.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000,
-            dklen=64  # 64字节密钥（32字节用于加密，32字节用于HMAC）
-        )
+        # 使用PBKDF2从主密钥和盐值派生密钥（100000次迭代，同一主密钥和盐值的结果会被缓存）
+        derived_key = _derive_key(master_key, salt)
         
         # 分离加密密钥和HMAC密钥
         enc_key = derived_key[:32]  # 前32字节用于加密
@@ -61,20 +198,16 @@ def encrypt_data(data, salt, master_key):
         data_bytes = data.encode('utf-8')
         
         # 使用XOR加密（使用派生密钥和IV）
-        encrypted_bytes = bytearray()
-        for i, byte in enumerate(data_bytes):
-            # 使用enc_key和IV的组合作为密钥流
-            key_byte = enc_key[i % len(enc_key)] ^ iv[i % len(iv)]
-            encrypted_bytes.append(byte ^ key_byte)
+        encrypted_bytes = _xor_keystream(data_bytes, enc_key, iv)
         
         # 计算HMAC（用于验证数据完整性）
-        hmac_obj = hmac.new(hmac_key, iv + bytes(encrypted_bytes), hashlib.sha256)
+        hmac_obj = hmac.new(hmac_key, iv + encrypted_bytes, hashlib.sha256)
         hmac_digest = hmac_obj.digest()
         
         # 组合所有数据：盐值长度 + 盐值 + IV + 密文 + HMAC
         salt_bytes = salt.encode('utf-8')
         salt_length = struct.pack('>I', len(salt_bytes))
-        combined = salt_length + salt_bytes + iv + bytes(encrypted_bytes) + hmac_digest
+        combined = salt_length + salt_bytes + iv + encrypted_bytes + hmac_digest
         
         # Base64编码
         encrypted_data = base64.b64encode(combined).decode('utf-8')
@@ -143,14 +276,8 @@ def decrypt_data(encrypted_data, salt, master_key, original_data=None):
                 'message': '盐值验证失败：盐值不匹配'
             }
         
-        # 使用相同的方法重新派生密钥
-        derived_key = hashlib.pbkdf2_hmac(
-            'sha256',
-            master_key.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000,
-            dklen=64
-        )
+        # 使用相同的方法重新派生密钥（HMAC验证通过后才放入缓存）
+        derived_key = _derive_key(master_key, salt, store=False)
         
         # 分离加密密钥和HMAC密钥
         enc_key = derived_key[:32]
@@ -160,18 +287,16 @@ def decrypt_data(encrypted_data, salt, master_key, original_data=None):
         hmac_obj = hmac.new(hmac_key, iv + ciphertext, hashlib.sha256)
         computed_hmac = hmac_obj.digest()
         
-        if computed_hmac != stored_hmac:
+        if not hmac.compare_digest(computed_hmac, stored_hmac):
             return {
                 'status': False,
                 'data': '',
                 'message': 'HMAC验证失败：数据可能被篡改或密钥不正确'
             }
+        _derived_key_cache.put(master_key, salt, derived_key)
         
         # 使用XOR解密
-        decrypted_bytes = bytearray()
-        for i, byte in enumerate(ciphertext):
-            key_byte = enc_key[i % len(enc_key)] ^ iv[i % len(iv)]
-            decrypted_bytes.append(byte ^ key_byte)
+        decrypted_bytes = _xor_keystream(ciphertext, enc_key, iv)
         
         # 转换为字符串
         decrypted_data = decrypted_bytes.decode('utf-8')
@@ -213,6 +338,92 @@ def verify_data(encrypted_data, salt, master_key, data_to_verify):
     result = decrypt_data(encrypted_data, salt, master_key, data_to_verify)
     return result['status']
 
+def _run_chunk(operation, master_key, chunk):
+    """在工作进程中处理一组记录，返回 [(原始序号, 结果)]"""
+    func = {'encrypt': encrypt_data, 'decrypt': decrypt_data, 'verify': verify_data}[operation]
+    return [(index, func(record[0], record[1], master_key, *record[2:])) for index, record in chunk]
+
+def _bulk_chunks(records, chunk_size):
+    """
+    把记录切分为进程任务，返回 [[(原始序号, 记录), ...], ...]
+
+    按盐值分组后再切分，记录少的用户整组放在同一个任务中，只派生一次密钥；
+    超过chunk_size条记录的用户拆到多个任务中（每个任务各派生一次密钥），
+    单个用户的大量记录也能使用多个进程
+    """
+    groups = OrderedDict()
+    for index, record in enumerate(records):
+        salt = record[1] if isinstance(record[1], str) else ''
+        groups.setdefault(salt, []).append((index, record))
+    chunks = []
+    chunk = []
+    for items in groups.values():
+        for start in range(0, len(items), chunk_size):
+            chunk.extend(items[start:start + chunk_size])
+            if len(chunk) >= chunk_size:
+                chunks.append(chunk)
+                chunk = []
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _run_bulk(operation, records, master_key, processes, chunk_size):
+    records = list(records)
+    chunks = _bulk_chunks(records, max(chunk_size, 1))
+    
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(chunks) <= 1:
+        outputs = [_run_chunk(operation, master_key, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as executor:
+            outputs = list(executor.map(_run_chunk, repeat(operation), repeat(master_key), chunks))
+    
+    results = [None] * len(records)
+    for output in outputs:
+        for index, result in output:
+            results[index] = result
+    return results
+
+def encrypt_many(records, master_key, processes=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量加密，使用进程池并行执行密钥派生和加密
+    
+    参数:
+        records: (data, salt) 元组列表
+        master_key: 主密钥 (str)
+        processes: 进程数，默认为CPU核数；为1时在当前进程中执行
+        chunk_size: 每个进程任务包含的记录数
+    
+    返回:
+        list: 与records顺序一致的encrypt_data结果字典列表
+    """
+    return _run_bulk('encrypt', records, master_key, processes, chunk_size)
+
+def decrypt_many(records, master_key, processes=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量解密，参数同encrypt_many
+    
+    参数:
+        records: (encrypted_data, salt) 或 (encrypted_data, salt, original_data) 元组列表
+    
+    返回:
+        list: 与records顺序一致的decrypt_data结果字典列表
+    """
+    return _run_bulk('decrypt', records, master_key, processes, chunk_size)
+
+def verify_many(records, master_key, processes=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量验证，参数同encrypt_many
+    
+    参数:
+        records: (encrypted_data, salt, data_to_verify) 元组列表
+    
+    返回:
+        list: 与records顺序一致的验证结果（bool）列表
+    """
+    return _run_bulk('verify', records, master_key, processes, chunk_size)
+
 def demo_encryption_decryption():
     """
     演示多个用户的密码加解密过程，并验证解密是否正确
@@ -398,6 +609,7 @@ def demo_encryption_decryption():
     print("5. 随机IV（初始化向量）：确保相同数据每次加密结果不同")
     print("6. 盐值：使用用户名作为盐值，确保每个用户的加密结果不同")
     print("7. 100000次迭代：增强密钥派生的安全性")
+    print("8. 派生密钥缓存：同一主密钥和用户名只派生一次密钥；批量接口encrypt_many等使用多进程并行")
     print("\n注意：由于无法安装外部加密库，本实现使用了XOR加密代替AES")
     print("XOR加密可以真正解密出明文，适合演示和学习目的")
     print("在生产环境中，建议使用pycryptodome库实现真正的AES加密")
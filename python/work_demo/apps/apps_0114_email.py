@@ -2,61 +2,87 @@
 # -*- coding: utf-8 -*-
 """
 IMAP邮箱文件夹名解码工具
-简化版实现IMAP修改版UTF-7编码的解码逻辑
+基于正则实现IMAP修改版UTF-7编码的解码和编码逻辑，并缓存最近使用的文件夹名
 用于将修改版UTF-7编码的邮箱文件夹名转换为正常中文格式
 例如：&Ti1lhw-other_test -> 中文other_test
+
+另外提供IMAP连接池和多文件夹并行扫描（scan_email_folders）
 """
 
 import base64
+import imaplib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Optional
+
+
+# 需要base64编码的连续字符（可打印ASCII 0x20-0x7e以外的字符），以及需要转义为"&-"的"&"
+_ENCODE_RE = re.compile(r'&|[^\x20-\x7e]+')
+# "&...-" 编码段，修改版base64字母表为 A-Za-z0-9+,
+_DECODE_RE = re.compile(r'&([A-Za-z0-9+,]*)-')
+
+# 文件夹名的数量通常有限且会被反复编解码，缓存最近使用的结果
+FOLDER_NAME_CACHE_SIZE = 32768
+
+
+@lru_cache(maxsize=FOLDER_NAME_CACHE_SIZE)
+def _decode_segment_text(encoded: str) -> str:
+    """解码一个"&...-"段的内容（层级文件夹名中同一段经常重复出现，单独缓存）"""
+    if not encoded:
+        # &- 表示字面意义的 &
+        return '&'
+    # 1. 将,替换为/（修改版base64用","代替"/"）
+    # 2. 添加base64填充
+    # 3. 解码base64和UTF-16BE（代理对会被合并为一个字符）
+    encoded = encoded.replace(',', '/')
+    return base64.b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-16be')
+
+
+def _decode_segment(match) -> str:
+    try:
+        return _decode_segment_text(match.group(1))
+    except Exception:
+        # 解码失败，保留原始编码
+        return match.group(0)
+
+
+@lru_cache(maxsize=FOLDER_NAME_CACHE_SIZE)
+def _encode_segment_text(text: str) -> str:
+    if text == '&':
+        return '&-'
+    # 连续的非ASCII字符作为一段整体编码为UTF-16BE + base64
+    b64 = base64.b64encode(text.encode('utf-16be', errors='surrogatepass')).decode('ascii')
+    return f"&{b64.rstrip('=').replace('/', ',')}-"
 
 
+def _encode_segment(match) -> str:
+    return _encode_segment_text(match.group(0))
+
+
+@lru_cache(maxsize=FOLDER_NAME_CACHE_SIZE)
 def decode_modified_utf7(s: str) -> str:
     """
-    简化版IMAP修改版UTF-7编码解码
+    IMAP修改版UTF-7编码解码（RFC 3501 5.1.3）
     
     Args:
         s: 待解码的字符串，如"&Ti1lhw-other_test"
         
     Returns:
-        解码后的字符串，如"中文other_test"
+        解码后的字符串，如"中文other_test"；没有结束符"-"的"&"按普通字符保留
     """
-    import base64
-    
-    # 分割字符串，处理每个编码段
-    parts = s.split('&')
-    result = [parts[0]]
-    
-    for part in parts[1:]:
-        if '-' in part:
-            # 提取编码部分和剩余部分
-            encoded, rest = part.split('-', 1)
-            if encoded:
-                try:
-                    # 1. 将,替换为+
-                    # 2. 添加base64填充
-                    # 3. 解码base64和UTF-16BE
-                    encoded = encoded.replace(',', '+')
-                    padding = 4 - len(encoded) % 4
-                    if padding < 4:
-                        encoded += '=' * padding
-                    decoded = base64.b64decode(encoded).decode('utf-16be')
-                    result.extend([decoded, rest])
-                except Exception:
-                    # 解码失败，保留原始编码
-                    result.append(f"&{part}")
-            else:
-                # &- 表示字面意义的 &
-                result.extend(['&', rest])
-        else:
-            # 没有结束符，将&作为普通字符处理
-            result.append(f"&{part}")
-    
-    return ''.join(result)
+    if '&' not in s:
+        return s
+    return _DECODE_RE.sub(_decode_segment, s)
 
 
+@lru_cache(maxsize=FOLDER_NAME_CACHE_SIZE)
 def encode_modified_utf7(s: str) -> str:
     """
-    简化版IMAP修改版UTF-7编码
+    IMAP修改版UTF-7编码（RFC 3501 5.1.3）
     
     Args:
         s: 待编码的字符串，如"中文other_test"
@@ -64,23 +90,7 @@ def encode_modified_utf7(s: str) -> str:
     Returns:
         编码后的字符串，如"&Ti1lhw-other_test"
     """
-    result = []
-    
-    for c in s:
-        if 0x20 <= ord(c) <= 0x7e and c != '&':
-            # ASCII可打印字符且不是&，直接添加
-            result.append(c)
-        else:
-            # 编码为UTF-16BE + base64
-            try:
-                utf16 = c.encode('utf-16be')
-                b64 = base64.b64encode(utf16).decode('ascii').rstrip('=').replace('+', ',')
-                result.append(f"&{b64}-")
-            except Exception:
-                # 编码失败，直接添加字符
-                result.append(c)
-    
-    return ''.join(result)
+    return _ENCODE_RE.sub(_encode_segment, s)
 
 
 def process_email_folders(folders: list) -> list:
@@ -96,6 +106,227 @@ def process_email_folders(folders: list) -> list:
     return [decode_modified_utf7(folder) for folder in folders]
 
 
+# ===== IMAP连接池与并行扫描 =====
+
+# LIST响应：(\HasNoChildren) "/" "INBOX"  或  (\HasNoChildren) "/" INBOX
+_LIST_RE = re.compile(r'\((?P<flags>[^)]*)\) (?P<delimiter>"[^"]*"|NIL) (?P<name>.+)$')
+_STATUS_RE = re.compile(r'(MESSAGES|UNSEEN|RECENT|UIDNEXT|UIDVALIDITY) (\d+)')
+
+
+class ConnectionPool:
+    """
+    阻塞式连接池基类：最多同时存在max_connections个连接，空闲连接后进先出复用
+
+    连接数已满时借用方在条件变量上等待；归还连接和丢弃连接都会唤醒等待者，
+    被唤醒后重新检查空闲连接和max_connections，连接被丢弃后可以新建连接。
+    子类通过_open/_close/_is_alive定制连接的创建、关闭和复用前检查。
+    """
+
+    # 超时异常信息中的连接类型
+    kind = ''
+
+    def __init__(self, connect: Callable, max_connections: int = 4):
+        """
+        Args:
+            connect: 创建连接的无参函数
+            max_connections: 最大连接数
+        """
+        if max_connections <= 0:
+            raise ValueError("max_connections必须大于0")
+        self._connect = connect
+        self.max_connections = max_connections
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _open(self):
+        return self._connect()
+
+    def _close(self, conn, graceful: bool) -> None:
+        """关闭连接，graceful为False表示连接已出错"""
+
+    def _is_alive(self, conn) -> bool:
+        """复用空闲连接前的检查，返回False时丢弃该连接"""
+        return True
+
+    def _take(self, timeout: Optional[float]):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("连接池已关闭")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._created < self.max_connections:
+                        self._created += 1
+                        conn = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"等待{self.kind}连接超时（最大连接数 {self.max_connections}）")
+                    self._cond.wait(remaining)
+            if conn is None:
+                # 在锁外建立连接，失败时让出名额
+                try:
+                    return self._open()
+                except BaseException:
+                    self._forget()
+                    raise
+            if self._is_alive(conn):
+                return conn
+            self._discard(conn)
+
+    def _release(self, conn) -> None:
+        """归还连接；连接池已关闭时关闭该连接"""
+        with self._cond:
+            if not self._closed:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
+        self._discard(conn, graceful=True)
+
+    def _forget(self) -> None:
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _discard(self, conn, graceful: bool = False) -> None:
+        """丢弃连接：让出名额并唤醒一个等待者，再关闭连接"""
+        self._forget()
+        try:
+            self._close(conn, graceful)
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """关闭所有空闲连接（正在使用的连接归还时关闭），正在等待的借用方抛出RuntimeError"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn, graceful=True)
+
+
+class IMAPConnectionPool(ConnectionPool):
+    """
+    同一账户的IMAP连接池
+
+    最多创建max_connections个已登录连接（多数邮箱服务商限制单账户并发连接数），
+    用完归还后被其他文件夹复用；连接出错（网络断开等）时丢弃，下次按需重建。
+    """
+
+    kind = 'IMAP'
+
+    def __init__(self, connect: Callable[[], imaplib.IMAP4], max_connections: int = 4):
+        """
+        Args:
+            connect: 创建并登录IMAP连接的函数，如 lambda: login('imap.example.com', user, password)
+            max_connections: 最大连接数
+        """
+        super().__init__(connect, max_connections)
+
+    def _close(self, mail: imaplib.IMAP4, graceful: bool) -> None:
+        mail.logout()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """借用一个连接，用完自动归还；IMAP协议错误以外的异常会丢弃该连接"""
+        mail = self._take(timeout)
+        try:
+            yield mail
+        except imaplib.IMAP4.error as e:
+            # 命令级错误（如文件夹不存在）连接仍可用；abort表示连接已断开
+            if isinstance(e, imaplib.IMAP4.abort):
+                self._discard(mail)
+            else:
+                self._release(mail)
+            raise
+        except BaseException:
+            self._discard(mail)
+            raise
+        else:
+            self._release(mail)
+
+
+def quote_folder(folder: str) -> str:
+    """文件夹名加引号（包含空格等字符时IMAP命令需要引号）"""
+    if folder.startswith('"'):
+        return folder
+    return '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def list_folders(mail: imaplib.IMAP4) -> list:
+    """
+    列出可选择的文件夹（跳过\\Noselect）
+
+    Returns:
+        编码后的原始文件夹名列表，可直接用于SELECT/STATUS
+    """
+    status, data = mail.list()
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"获取文件夹列表失败: {status}")
+    folders = []
+    for line in data:
+        if isinstance(line, tuple):
+            line = line[0]
+        if not line:
+            continue
+        match = _LIST_RE.match(line.decode('utf-8', errors='replace'))
+        if match is None or '\\noselect' in match.group('flags').lower():
+            continue
+        name = match.group('name')
+        if name.startswith('"') and name.endswith('"'):
+            name = name[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        folders.append(name)
+    return folders
+
+
+def folder_status(mail: imaplib.IMAP4, folder: str) -> dict:
+    """默认的单文件夹扫描：STATUS获取邮件总数和未读数（不需要SELECT）"""
+    status, data = mail.status(quote_folder(folder), '(MESSAGES UNSEEN)')
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"获取文件夹 {folder} 状态失败")
+    counts = {key.lower(): int(value) for key, value in _STATUS_RE.findall(data[0].decode('utf-8', errors='replace'))}
+    return {'messages': counts.get('messages', 0), 'unseen': counts.get('unseen', 0)}
+
+
+def scan_email_folders(pool: IMAPConnectionPool, folders: Optional[list] = None,
+                       scan_folder: Callable[[imaplib.IMAP4, str], dict] = folder_status) -> list:
+    """
+    用连接池并行扫描多个文件夹
+
+    Args:
+        pool: IMAP连接池，并发数等于pool.max_connections
+        folders: 编码后的原始文件夹名列表，默认通过LIST获取全部文件夹
+        scan_folder: 扫描单个文件夹的函数，参数为(连接, 原始文件夹名)，返回结果字典；
+            需要SELECT时由该函数自己选择文件夹
+
+    Returns:
+        按文件夹列表顺序排列的结果，每项包含 folder（解码后的名称）、raw_name，
+        以及scan_folder的返回值；扫描失败的文件夹包含 error
+    """
+    if folders is None:
+        with pool.connection() as mail:
+            folders = list_folders(mail)
+
+    def scan(folder):
+        result = {'folder': decode_modified_utf7(folder), 'raw_name': folder}
+        try:
+            with pool.connection() as mail:
+                result.update(scan_folder(mail, folder))
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    # executor.map按提交顺序返回结果，与完成顺序无关
+    with ThreadPoolExecutor(max_workers=pool.max_connections) as executor:
+        return list(executor.map(scan, folders))
+
+
 # 测试示例
 if __name__ == "__main__":
     print("=== IMAP邮箱文件夹名解码测试 ===")
@@ -130,4 +361,17 @@ if __name__ == "__main__":
     print(f"   decoded = [decode_modified_utf7(f.decode()) for f in imap_folders]")
     print(f"   # 输出: ['中文other_test', 'INBOX']")
     print(f"   ")
+    print(f"\n4. 多文件夹并行扫描示例:")
+    print(f"   from apps_0114_email import IMAPConnectionPool, scan_email_folders")
+    print(f"   ")
+    print(f"   def connect():")
+    print(f"       mail = imaplib.IMAP4_SSL('imap.example.com')")
+    print(f"       mail.login('user@example.com', 'password')")
+    print(f"       return mail")
+    print(f"   ")
+    print(f"   pool = IMAPConnectionPool(connect, max_connections=4)")
+    print(f"   for result in scan_email_folders(pool):")
+    print(f"       print(result['folder'], result.get('messages'), result.get('unseen'))")
+    print(f"   pool.close()")
+    print(f"   ")
     print(f"=== 测试完成 ===")
\ No newline at end of file
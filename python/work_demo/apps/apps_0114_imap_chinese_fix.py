@@ -37,7 +37,7 @@ def solve_chinese_folder_issue():
     print("   encoded_folders = [")
     print("       b'INBOX',")
     print("       b'&Ti1lhw-other_test',  # 编码后的 '中文other_test'")
-    print("       b'&U,BTFw-',           # 编码后的 '中'")
+    print("       b'&U,BTFw-',           # 编码后的 '台北'")
     print("   ]")
     print()
     print("   # 解码为中文显示")
@@ -14,47 +14,64 @@
 # 2.4 不存在缓存，则将当前数据放到缓存中
 # 2.5 以上缓存的过期时间按照结束时间为过期时间
 # 2.6 以上开始时间结束时间为字符串格式，如："2025-01-01 17:19:00"
+# 2.7 读取、合并、写回在Redis端用Lua脚本原子完成，同一用户并发刷卡不会丢失更新；
+#     合并后结束时间已过的记录直接删除，键不会无限增长
 # 例子：
 # 缓存中开始时间：2025-10-30 18:00:00 结束时间：2025-10-30 22:00:00
 # 当前开始时间：2025-10-31 01:00:00 结束时间：2025-10-31 06:00:00
 # 者最终时间为，开始时间：2025-10-30 18:00:00 结束时间：2025-10-31 09:00:00
 
 import redis
+import contextlib
 import json
-from datetime import datetime
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('door_access')
 
-def get_door_access_time(username, planned_start_time, planned_end_time=None, start_offset_hours=1, end_offset_hours=1):
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CACHE_KEY_PREFIX = "door_access:"
+
+# Redis配置，进程内所有调用共享同一个连接池
+REDIS_CONFIG = {'host': 'localhost', 'port': 6379, 'db': 0}
+REDIS_MAX_CONNECTIONS = 50
+_redis_pool = None
+_redis_pool_lock = threading.Lock()
+
+
+def get_redis_client():
     """
-    获取门禁开通时间函数
-    
-    参数：
-    username (str): 用户名
-    planned_start_time (str): 计划开始时间，格式为"YYYY-MM-DD HH:MM:SS"
-    planned_end_time (str, optional): 计划结束时间，格式为"YYYY-MM-DD HH:MM:SS"。若未提供，则根据开始时间自动计算
-    start_offset_hours (float, optional): 开始时间偏移量（小时），默认为1
-    end_offset_hours (float, optional): 结束时间偏移量（小时），默认为1
-    
-    返回：
-    dict: 包含开始时间和结束时间的门禁信息
-    
-    异常：
-    ValueError: 当输入参数无效时
-    redis.RedisError: 当Redis操作失败时
+    获取共享连接池上的Redis客户端
+
+    连接池在第一次调用时创建，之后每次调用只是从池中借用连接，
+    不再为每次请求新建TCP连接并ping
     """
-    from datetime import timedelta
-    
+    global _redis_pool
+    if _redis_pool is None:
+        with _redis_pool_lock:
+            if _redis_pool is None:
+                _redis_pool = redis.ConnectionPool(
+                    max_connections=REDIS_MAX_CONNECTIONS, decode_responses=True, **REDIS_CONFIG
+                )
+                logger.info(f"创建Redis连接池: {REDIS_CONFIG['host']}:{REDIS_CONFIG['port']}")
+    return redis.Redis(connection_pool=_redis_pool)
+
+
+def _resolve_planned_times(username, planned_start_time, planned_end_time, start_offset_hours, end_offset_hours):
+    """校验参数并计算计划开始/结束时间，返回 (开始时间, 结束时间) 的datetime"""
     # 参数验证
     if not username or not isinstance(username, str):
         raise ValueError("用户名必须是非空字符串")
     
     # 验证计划开始时间格式
     try:
-        dt_planned_start = datetime.strptime(planned_start_time, "%Y-%m-%d %H:%M:%S")
+        dt_planned_start = datetime.strptime(planned_start_time, TIME_FORMAT)
     except ValueError:
         raise ValueError("时间格式必须为'YYYY-MM-DD HH:MM:SS'")
     
@@ -66,7 +83,7 @@ def get_door_access_time(username, planned_start_time, planned_end_time=None, st
     if planned_end_time is not None:
         # 如果提供了计划结束时间，验证并使用它
         try:
-            dt_planned_end = datetime.strptime(planned_end_time, "%Y-%m-%d %H:%M:%S")
+            dt_planned_end = datetime.strptime(planned_end_time, TIME_FORMAT)
         except ValueError:
             raise ValueError("计划结束时间格式必须为'YYYY-MM-DD HH:MM:SS'")
         
@@ -86,116 +103,330 @@ def get_door_access_time(username, planned_start_time, planned_end_time=None, st
             # 开始时间早于9点，结束时间为当天9点
             dt_planned_end = dt_planned_start.replace(hour=9, minute=0, second=0, microsecond=0)
     
-    # 格式化为字符串
-    planned_start_str = dt_planned_start.strftime("%Y-%m-%d %H:%M:%S")
-    planned_end_str = dt_planned_end.strftime("%Y-%m-%d %H:%M:%S")
+    return dt_planned_start, dt_planned_end
+
+
+# 在Redis端原子地合并门禁时间，避免并发的GET/SET互相覆盖
+# KEYS[1]: 缓存键  ARGV: 用户名, 开始时间, 结束时间, 过期时间戳
+# 时间字符串格式固定为"YYYY-MM-DD HH:MM:SS"，可以直接按字符串比较大小
+# 返回合并后的JSON；合并后已过期的记录直接删除
+MERGE_ACCESS_SCRIPT = """
+local start_time, end_time, expire_at = ARGV[2], ARGV[3], tonumber(ARGV[4])
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, data = pcall(cjson.decode, current)
+    if ok and type(data) == 'table' and type(data.start_time) == 'string' and type(data.end_time) == 'string' then
+        if data.start_time < start_time then start_time = data.start_time end
+        if data.end_time > end_time then end_time = data.end_time end
+        local cached_expire_at = tonumber(data.expire_at)
+        if cached_expire_at and cached_expire_at > expire_at then expire_at = cached_expire_at end
+    end
+end
+local value = cjson.encode({username = ARGV[1], start_time = start_time, end_time = end_time, expire_at = expire_at})
+if expire_at <= tonumber(redis.call('TIME')[1]) then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], value)
+    redis.call('EXPIREAT', KEYS[1], expire_at)
+end
+return value
+"""
+
+# 结束时间之后保留缓存的秒数。默认结束时间为每天09:00，
+# 过期后键自动删除，下一次刷卡重新开始新一天的时间范围
+DOOR_ACCESS_GRACE_SECONDS = 0
+
+
+def _merge_access_args(username, dt_planned_start, dt_planned_end):
+    """生成合并脚本的 (keys, args)"""
+    expire_at = int(dt_planned_end.timestamp()) + DOOR_ACCESS_GRACE_SECONDS
+    return (
+        [f"{CACHE_KEY_PREFIX}{username}"],
+        [username, dt_planned_start.strftime(TIME_FORMAT), dt_planned_end.strftime(TIME_FORMAT), expire_at]
+    )
+
+
+def _apply_offsets(updated_data, start_offset_hours, end_offset_hours):
+    """对缓存中的时间应用偏移量，构建返回数据"""
+    dt_start_original = datetime.strptime(updated_data['start_time'], TIME_FORMAT)
+    dt_end_original = datetime.strptime(updated_data['end_time'], TIME_FORMAT)
+    return {
+        'username': updated_data['username'],
+        'start_time': (dt_start_original + timedelta(hours=start_offset_hours)).strftime(TIME_FORMAT),
+        'end_time': (dt_end_original + timedelta(hours=end_offset_hours)).strftime(TIME_FORMAT)
+    }
+
+
+def get_door_access_time(username, planned_start_time, planned_end_time=None, start_offset_hours=1, end_offset_hours=1,
+                         redis_client=None):
+    """
+    获取门禁开通时间函数
+    
+    参数：
+    username (str): 用户名
+    planned_start_time (str): 计划开始时间，格式为"YYYY-MM-DD HH:MM:SS"
+    planned_end_time (str, optional): 计划结束时间，格式为"YYYY-MM-DD HH:MM:SS"。若未提供，则根据开始时间自动计算
+    start_offset_hours (float, optional): 开始时间偏移量（小时），默认为1
+    end_offset_hours (float, optional): 结束时间偏移量（小时），默认为1
+    redis_client (redis.Redis, optional): Redis客户端，默认使用共享连接池（get_redis_client）
     
-    # 连接Redis
-    try:
-        # 使用默认Redis配置
-        r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-        # 测试连接
-        r.ping()
-        logger.info("成功连接到Redis: localhost:6379")
-        
-    except redis.RedisError as e:
-        logger.error(f"Redis连接失败: {str(e)}")
-        raise redis.RedisError(f"Redis连接失败: {str(e)}")
+    返回：
+    dict: 包含开始时间和结束时间的门禁信息
     
-    # 缓存键名
-    cache_key = f"door_access:{username}"
-    updated_data = None
+    异常：
+    ValueError: 当输入参数无效时
+    redis.RedisError: 当Redis操作失败时
+    """
+    dt_planned_start, dt_planned_end = _resolve_planned_times(
+        username, planned_start_time, planned_end_time, start_offset_hours, end_offset_hours
+    )
+    
+    r = redis_client if redis_client is not None else get_redis_client()
+    keys, args = _merge_access_args(username, dt_planned_start, dt_planned_end)
     
     try:
-        # 尝试从缓存获取数据
-        cached_data = r.get(cache_key)
-        
-        if cached_data:
-            try:
-                # 缓存存在，解析数据
-                cached_info = json.loads(cached_data)
-                cached_start = cached_info['start_time']
-                cached_end = cached_info['end_time']
-                
-                # 转换为datetime对象进行比较
-                dt_cached_start = datetime.strptime(cached_start, "%Y-%m-%d %H:%M:%S")
-                dt_cached_end = datetime.strptime(cached_end, "%Y-%m-%d %H:%M:%S")
-                
-                # 缓存中开始时间和当前计划开始时间比较，取最早的开始时间
-                min_start = min(dt_cached_start, dt_planned_start).strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 缓存中的结束时间和当前计划结束时间比较，取最晚的结束时间
-                max_end = max(dt_cached_end, dt_planned_end).strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 更新缓存数据
-                updated_data = {
-                    'username': username,
-                    'start_time': min_start,
-                    'end_time': max_end
-                }
-                logger.info(f"用户 {username} 存在缓存，合并时间范围: {cached_start}-{cached_end} 与 {planned_start_str}-{planned_end_str}")
-                
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                logger.error(f"解析缓存数据失败: {str(e)}，将覆盖缓存")
-                # 解析失败，使用当前数据
-                updated_data = {
-                    'username': username,
-                    'start_time': planned_start_str,
-                    'end_time': planned_end_str
-                }
-        else:
-            # 缓存不存在，使用当前数据
-            updated_data = {
-                'username': username,
-                'start_time': planned_start_str,
-                'end_time': planned_end_str
-            }
-            logger.info(f"用户 {username} 不存在缓存，创建新的门禁时间: {planned_start_str}-{planned_end_str}")
-        
-        # 计算过期时间（以秒为单位）
-        dt_end_final = datetime.strptime(updated_data['end_time'], "%Y-%m-%d %H:%M:%S")
-        expire_seconds = int((dt_end_final - datetime.now()).total_seconds())
-        
-        # 确保过期时间不为负数
-        if expire_seconds < 0:
-            expire_seconds = 0
-            logger.warning(f"结束时间已过期，设置缓存永不过期（0秒）")
-        
-        # 将数据存入缓存
-        r.setex(cache_key, expire_seconds, json.dumps(updated_data))
-        logger.info(f"成功更新缓存: {cache_key}, 过期时间: {expire_seconds}秒")
+        # 读取、合并、写回和设置过期时间在一个Lua脚本中原子完成，只需一次往返（EVALSHA）
+        updated_data = json.loads(r.register_script(MERGE_ACCESS_SCRIPT)(keys=keys, args=args))
+        logger.info(f"成功更新缓存: {keys[0]}, 时间范围: {updated_data['start_time']}-{updated_data['end_time']}")
         
     except redis.RedisError as e:
         logger.error(f"Redis操作失败: {str(e)}")
         raise redis.RedisError(f"Redis操作失败: {str(e)}")
-    finally:
-        # 关闭Redis连接
-        try:
-            r.close()
-        except:
-            pass
     
     # 应用时间偏移量
-    dt_start_original = datetime.strptime(updated_data['start_time'], "%Y-%m-%d %H:%M:%S")
-    dt_end_original = datetime.strptime(updated_data['end_time'], "%Y-%m-%d %H:%M:%S")
-    
-    # 计算偏移后的时间
-    dt_start_offset = dt_start_original + timedelta(hours=start_offset_hours)
-    dt_end_offset = dt_end_original + timedelta(hours=end_offset_hours)
-    
-    # 构建返回数据
-    result_data = {
-        'username': updated_data['username'],
-        'start_time': dt_start_offset.strftime("%Y-%m-%d %H:%M:%S"),
-        'end_time': dt_end_offset.strftime("%Y-%m-%d %H:%M:%S")
-    }
+    result_data = _apply_offsets(updated_data, start_offset_hours, end_offset_hours)
     
     print(f"门禁时间获取成功：用户名={username}, 开始时间={result_data['start_time']}, 结束时间={result_data['end_time']}")
     
     return result_data
 
+
+def get_door_access_times(access_requests, redis_client=None):
+    """
+    批量获取门禁开通时间
+    
+    所有请求的合并脚本放进一个pipeline发送，无论多少个用户都只有一次Redis往返。
+    同一批次中重复出现的用户在Redis端按顺序依次合并。
+    
+    参数：
+    access_requests (list): 参数字典列表，每个字典的键与get_door_access_time的参数相同，
+        如 {"username": "zhangsan", "planned_start_time": "2025-10-30 18:00:00"}
+    redis_client (redis.Redis, optional): Redis客户端，默认使用共享连接池
+    
+    返回：
+    list: 与access_requests顺序一致的门禁信息列表
+    
+    异常：
+    ValueError: 任一请求参数无效时（此时不会读写Redis）
+    redis.RedisError: 当Redis操作失败时
+    """
+    if not access_requests:
+        return []
+    
+    # 先校验全部参数，避免写入一半
+    resolved = []
+    for params in access_requests:
+        params = dict(params)
+        start_offset_hours = params.pop('start_offset_hours', 1)
+        end_offset_hours = params.pop('end_offset_hours', 1)
+        dt_start, dt_end = _resolve_planned_times(
+            params['username'], params['planned_start_time'], params.get('planned_end_time'),
+            start_offset_hours, end_offset_hours
+        )
+        resolved.append((params['username'], dt_start, dt_end, start_offset_hours, end_offset_hours))
+    
+    r = redis_client if redis_client is not None else get_redis_client()
+    merge_script = r.register_script(MERGE_ACCESS_SCRIPT)
+    
+    try:
+        # 每个请求一次脚本调用，全部放进一个pipeline；同一用户的多个请求在Redis端按顺序合并
+        pipe = r.pipeline(transaction=False)
+        for username, dt_start, dt_end, _, _ in resolved:
+            keys, args = _merge_access_args(username, dt_start, dt_end)
+            merge_script(keys=keys, args=args, client=pipe)
+        values = pipe.execute()
+        logger.info(f"批量更新缓存成功: {len(resolved)} 个请求")
+        
+    except redis.RedisError as e:
+        logger.error(f"Redis批量操作失败: {str(e)}")
+        raise redis.RedisError(f"Redis批量操作失败: {str(e)}")
+    
+    results = [
+        _apply_offsets(json.loads(value), start_offset_hours, end_offset_hours)
+        for value, (_, _, _, start_offset_hours, end_offset_hours) in zip(values, resolved)
+    ]
+    return results
+
+
+def query_door_access_times(usernames, redis_client=None):
+    """
+    批量查询门禁缓存（只读，一次MGET）
+    
+    参数：
+    usernames (list): 用户名列表
+    redis_client (redis.Redis, optional): Redis客户端，默认使用共享连接池
+    
+    返回：
+    dict: {用户名: 缓存的门禁信息}，没有缓存或缓存无法解析的用户值为None
+    """
+    if not usernames:
+        return {}
+    
+    r = redis_client if redis_client is not None else get_redis_client()
+    try:
+        values = r.mget([f"{CACHE_KEY_PREFIX}{username}" for username in usernames])
+    except redis.RedisError as e:
+        logger.error(f"Redis批量查询失败: {str(e)}")
+        raise redis.RedisError(f"Redis批量查询失败: {str(e)}")
+    
+    result = {}
+    for username, value in zip(usernames, values):
+        try:
+            result[username] = json.loads(value) if value else None
+        except json.JSONDecodeError:
+            logger.error(f"用户 {username} 的缓存数据无法解析")
+            result[username] = None
+    return result
+
+
+# ===== 基准测试 =====
+
+class LatencyRedisStub:
+    """
+    本地Redis替身：内存字典 + 模拟网络往返延迟，用于不依赖Redis服务的基准测试
+    
+    每个命令（或一次pipeline.execute）消耗一次round_trip；
+    connect()模拟新建连接的开销（TCP握手 + ping）
+    """
+
+    def __init__(self, round_trip=0.0002, connect_cost=0.001, store=None):
+        self.round_trip = round_trip
+        self.connect_cost = connect_cost
+        self.store = {} if store is None else store
+        self.round_trips = 0
+
+    def _wait(self):
+        self.round_trips += 1
+        time.sleep(self.round_trip)
+
+    def connect(self):
+        """模拟新建连接，返回共享同一份数据的新客户端"""
+        time.sleep(self.connect_cost)
+        return LatencyRedisStub(self.round_trip, self.connect_cost, self.store)
+
+    def ping(self):
+        self._wait()
+        return True
+
+    def mget(self, keys):
+        self._wait()
+        return [self.store.get(key) for key in keys]
+
+    def register_script(self, script):
+        # 替身只支持门禁合并脚本，用等价的Python逻辑代替Lua
+        return _StubMergeScript(self)
+
+    def pipeline(self, transaction=True):
+        return _LatencyRedisPipeline(self)
+
+    def close(self):
+        pass
+
+
+class _StubMergeScript:
+    """与MERGE_ACCESS_SCRIPT等价的Python实现"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def run(self, keys, args):
+        key = keys[0]
+        username, start_time, end_time, expire_at = args
+        current = self.client.store.get(key)
+        if current:
+            data = json.loads(current)
+            start_time = min(start_time, data['start_time'])
+            end_time = max(end_time, data['end_time'])
+            expire_at = max(expire_at, data.get('expire_at', 0))
+        value = json.dumps({'username': username, 'start_time': start_time, 'end_time': end_time,
+                            'expire_at': expire_at})
+        if expire_at <= time.time():
+            self.client.store.pop(key, None)
+        else:
+            self.client.store[key] = value
+        return value
+
+    def __call__(self, keys, args, client=None):
+        if isinstance(client, _LatencyRedisPipeline):
+            client.commands.append((self, keys, args))
+            return client
+        self.client._wait()
+        return self.run(keys, args)
+
+
+class _LatencyRedisPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def execute(self):
+        self.client._wait()
+        results = [script.run(keys, args) for script, keys, args in self.commands]
+        self.commands = []
+        return results
+
+
+def benchmark_door_access(count=2000, batch_size=200, round_trip=0.0002, connect_cost=0.001):
+    """
+    对比三种方式的吞吐量（次/秒）：
+    - per_call_connection: 每次调用新建连接并ping（连接池之前的做法）
+    - pooled: 共享连接，每次调用一次合并脚本往返
+    - bulk: get_door_access_times，每batch_size个请求一次往返
+    """
+    base_time = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    requests_list = [
+        {"username": f"user{i % 500}", "planned_start_time": (base_time + timedelta(hours=i % 72)).strftime(TIME_FORMAT)}
+        for i in range(count)
+    ]
+    results = {}
+    
+    # 屏蔽逐条日志和打印，避免I/O影响测试结果
+    log_level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            stub = LatencyRedisStub(round_trip, connect_cost)
+            start = time.perf_counter()
+            for params in requests_list:
+                client = stub.connect()
+                client.ping()
+                get_door_access_time(**params, redis_client=client)
+            results['per_call_connection'] = count / (time.perf_counter() - start)
+            
+            stub = LatencyRedisStub(round_trip, connect_cost)
+            start = time.perf_counter()
+            for params in requests_list:
+                get_door_access_time(**params, redis_client=stub)
+            results['pooled'] = count / (time.perf_counter() - start)
+            
+            stub = LatencyRedisStub(round_trip, connect_cost)
+            start = time.perf_counter()
+            for i in range(0, count, batch_size):
+                get_door_access_times(requests_list[i:i + batch_size], redis_client=stub)
+            results['bulk'] = count / (time.perf_counter() - start)
+    finally:
+        logger.setLevel(log_level)
+    return results
+
+
 # 示例调用
 if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        # 基准测试：python apps_1030.py --bench
+        for mode, ops in benchmark_door_access().items():
+            print(f"{mode:<22}{ops:>12,.0f} 次/秒")
+        sys.exit(0)
+    
     # 定义测试场景
     test_scenarios = [
         {
@@ -329,6 +560,20 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"测试失败! 错误: {str(e)}")
     
+    # 批量接口：一次MGET + 一次pipeline写回
+    print("\n========== 批量获取门禁时间 ==========")
+    try:
+        bulk_results = get_door_access_times([
+            {"username": "zhangsan", "planned_start_time": "2025-10-31 20:00:00"},
+            {"username": "lisi", "planned_start_time": "2025-11-01 07:00:00", "start_offset_hours": 0},
+            {"username": "zhouba", "planned_start_time": "2025-11-03 10:00:00"},
+        ])
+        for result in bulk_results:
+            print(f"批量结果: {result}")
+        print(f"批量查询: {query_door_access_times(['zhangsan', 'zhouba', 'nobody'])}")
+    except Exception as e:
+        print(f"批量测试失败! 错误: {str(e)}")
+    
     # 提示用户如何测试异常场景
     print("\n注意：代码中包含了异常测试用例（已注释），您可以取消注释来测试异常处理逻辑。")
     print("实际运行时，如果Redis服务器不可用，程序会捕获并显示相应的错误信息。")
@@ -338,3 +583,5 @@ if __name__ == "__main__":
     print("  * 开始时间晚于等于09:00:00：结束时间为第二天09:00:00")
     print("  * 开始时间早于09:00:00：结束时间为当天09:00:00")
     print("函数会自动合并Redis缓存中的时间范围，取最早的开始时间和最晚的结束时间。")
+    print("所有调用共享同一个Redis连接池；批量场景请使用get_door_access_times/query_door_access_times，")
+    print("基准测试: python apps_1030.py --bench")
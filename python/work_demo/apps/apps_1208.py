@@ -1,6 +1,22 @@
+import binascii
+import fnmatch
+import hashlib
 import imaplib
 import email
+import email.utils
+import io
+import os
+import re
+import select
+import ssl
+import tempfile
+import threading
+import time
 from email.header import decode_header
+from email.parser import BytesHeaderParser
+from typing import Optional
+
+from apps_0114_email import quote_folder
 
 def parse_email(raw_email: bytes) -> dict:
     """修正后的邮件解析函数"""
@@ -107,56 +123,811 @@ def parse_email(raw_email: bytes) -> dict:
         }
     }
 
-def fetch_emails(days_back=1):
+# 列表只需要这些头字段，不下载正文和附件
+HEADER_FIELDS = ('SUBJECT', 'FROM', 'DATE', 'MESSAGE-ID')
+# 每条UID FETCH命令包含的最大邮件数，避免命令行过长
+FETCH_CHUNK_SIZE = 5000
+
+_UID_RE = re.compile(rb'UID (\d+)')
+_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+
+
+def _decode_header_value(value) -> str:
+    """解码RFC 2047编码的头字段（处理多段编码和未知字符集）"""
+    if value is None:
+        return ''
+    parts = []
+    for text, encoding in decode_header(value):
+        if isinstance(text, bytes):
+            try:
+                text = text.decode(encoding or 'utf-8', errors='replace')
+            except (TypeError, LookupError):
+                text = text.decode('utf-8', errors='replace')
+        parts.append(text)
+    return ''.join(parts).strip()
+
+
+def compress_uid_set(uids) -> str:
+    """把UID列表压缩为IMAP序列集，如 [1,2,3,5,7,8] -> "1:3,5,7:8" """
+    ranges = []
+    start = prev = None
+    for uid in sorted({int(u) for u in uids}):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if prev != start else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if prev != start else str(start))
+    return ','.join(ranges)
+
+
+class LazyEmail:
+    """
+    只包含头字段、大小和标记的邮件，正文在第一次调用parse()时才下载
+    """
+
+    def __init__(self, mail, uid: int, size: int, flags: list, raw_header: bytes):
+        self._mail = mail
+        self.uid = uid
+        self.size = size
+        self.flags = flags
+        headers = email.message_from_bytes(raw_header)
+        # 原始头字段，用于计算与apps_1215.generate_email_uid一致的邮件UID
+        self.headers = headers
+        self.subject = _decode_header_value(headers['Subject'])
+        self.from_ = email.utils.parseaddr(headers['From'] or '')[1]
+        self.date = headers['Date']
+        self.message_id = headers['Message-ID']
+        self._parsed = None
+
+    @property
+    def seen(self) -> bool:
+        return '\\Seen' in self.flags
+
+    def fetch_raw(self) -> bytes:
+        """下载完整邮件（BODY.PEEK[]不会把邮件标记为已读）"""
+        status, data = self._mail.uid('FETCH', str(self.uid), '(BODY.PEEK[])')
+        if status != 'OK' or not data or not isinstance(data[0], tuple):
+            raise Exception(f"获取邮件 UID {self.uid} 失败")
+        return data[0][1]
+
+    def parse(self) -> dict:
+        """下载并解析正文，结果会缓存"""
+        if self._parsed is None:
+            self._parsed = parse_email(self.fetch_raw())
+        return self._parsed
+
+    def extract_attachments(self, output_dir: Optional[str] = None, fetch_chunk_size: int = 1024 * 1024,
+                            **kwargs) -> list:
+        """
+        分段下载邮件并流式提取附件，不把整封邮件读入内存（参数见extract_attachments）
+        """
+        stream = io.BufferedReader(IMAPBodyStream(self._mail, self.uid, fetch_chunk_size), fetch_chunk_size)
+        return extract_attachments(stream, output_dir, **kwargs)
+
+    def __repr__(self):
+        return f"LazyEmail(uid={self.uid}, subject={self.subject!r}, from={self.from_!r}, size={self.size})"
+
+
+def _parse_header_fetch_response(mail, data) -> list:
+    """
+    解析 UID FETCH (UID RFC822.SIZE FLAGS BODY.PEEK[HEADER.FIELDS (...)]) 的响应
+
+    imaplib返回的列表中，每封邮件是一个 (描述, 头字段字节) 元组，
+    后面跟着一个bytes片段（")" 或服务器放在正文之后的 " FLAGS (...))"）
+    """
+    records = []
+    for item in data:
+        if isinstance(item, tuple):
+            records.append([item[0], item[1]])
+        elif isinstance(item, bytes) and records:
+            records[-1][0] += item
+
+    emails = []
+    for meta, raw_header in records:
+        uid_match = _UID_RE.search(meta)
+        if uid_match is None:
+            continue
+        size_match = _SIZE_RE.search(meta)
+        flags_match = _FLAGS_RE.search(meta)
+        emails.append(LazyEmail(
+            mail,
+            uid=int(uid_match.group(1)),
+            size=int(size_match.group(1)) if size_match else 0,
+            flags=flags_match.group(1).decode('ascii', errors='replace').split() if flags_match else [],
+            raw_header=raw_header or b'',
+        ))
+    return emails
+
+
+def fetch_email_headers(mail, uids, chunk_size=FETCH_CHUNK_SIZE) -> list:
+    """
+    批量获取邮件头字段，每chunk_size封邮件一条UID FETCH命令
+
+    Args:
+        mail: 已选择文件夹的IMAP连接
+        uids: UID列表
+        chunk_size: 每条命令包含的邮件数
+
+    Returns:
+        list: 按UID升序排列的LazyEmail列表
+    """
+    uids = sorted({int(uid) for uid in uids})
+    fetch_items = f"(UID RFC822.SIZE FLAGS BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+    emails = []
+    for i in range(0, len(uids), chunk_size):
+        status, data = mail.uid('FETCH', compress_uid_set(uids[i:i + chunk_size]), fetch_items)
+        if status != 'OK':
+            raise Exception(f"批量获取邮件头失败: {status}")
+        emails.extend(_parse_header_fetch_response(mail, data))
+    emails.sort(key=lambda e: e.uid)
+    return emails
+
+
+# ===== 流式附件提取 =====
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentSink:
+    """
+    附件输出接口，附件按顺序逐个写入：open -> write(多次) -> close 或 abort
+    """
+
+    def open(self, info: dict) -> None:
+        pass
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def close(self, info: dict) -> Optional[str]:
+        """附件写完，info中已有size和sha256；返回保存位置"""
+        return None
+
+    def abort(self, info: dict) -> None:
+        """附件超过大小限制等原因被放弃，丢弃已写入的数据"""
+        pass
+
+
+class DirectorySink(AttachmentSink):
+    """
+    按内容哈希保存到目录：{output_dir}/{sha256前2位}/{sha256}
+
+    先写临时文件，写完后按哈希重命名；相同内容的附件（包括不同邮件中的）只保存一份
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._file = None
+
+    def open(self, info):
+        self._file = tempfile.NamedTemporaryFile(dir=self.output_dir, prefix='.part-', delete=False)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self, info):
+        self._file.close()
+        target_dir = os.path.join(self.output_dir, info['sha256'][:2])
+        target = os.path.join(target_dir, info['sha256'])
+        if os.path.exists(target):
+            os.remove(self._file.name)
+            info['duplicate'] = True
+        else:
+            os.makedirs(target_dir, exist_ok=True)
+            os.replace(self._file.name, target)
+        self._file = None
+        return target
+
+    def abort(self, info):
+        self._file.close()
+        os.remove(self._file.name)
+        self._file = None
+
+
+class _AttachmentWriter:
+    """边解码边计算哈希和大小，超过max_size时放弃"""
+
+    def __init__(self, info: dict, sink: AttachmentSink, max_size: Optional[int]):
+        self.info = info
+        self.sink = sink
+        self.max_size = max_size
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        sink.open(info)
+
+    def write(self, data: bytes) -> None:
+        if not data or self.info['skipped']:
+            return
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.sink.abort(self.info)
+            self.info['skipped'] = 'too_large'
+            return
+        self.sha256.update(data)
+        self.sink.write(data)
+
+    def close(self) -> None:
+        self.info['size'] = self.size
+        if not self.info['skipped']:
+            self.info['sha256'] = self.sha256.hexdigest()
+            self.info['path'] = self.sink.close(self.info)
+
+
+class _BodyDecoder:
+    """
+    按Content-Transfer-Encoding逐行解码正文
+
+    分隔行之前的换行符属于分隔符，所以每行末尾的换行符先保留，
+    确认后面还有正文时再输出
+    """
+
+    def __init__(self, encoding: str, consumer):
+        self.encoding = (encoding or '7bit').lower()
+        self.consumer = consumer
+        self._pending_eol = b''
+        self._carry = b''
+
+    def feed(self, line: bytes) -> None:
+        if self.consumer is None:
+            return
+        if self.encoding == 'base64':
+            data = self._carry + b''.join(line.split())
+            usable = len(data) - len(data) % 4
+            self._carry = data[usable:]
+            if usable:
+                self.consumer.write(binascii.a2b_base64(data[:usable]))
+            return
+
+        if line.endswith(b'\r\n'):
+            content, eol = line[:-2], b'\r\n'
+        elif line.endswith(b'\n'):
+            content, eol = line[:-1], b'\n'
+        else:
+            content, eol = line, b''
+
+        if self.encoding == 'quoted-printable':
+            content = self._carry + content
+            self._carry = b''
+            if eol and content.endswith(b'='):
+                # 软换行
+                content, eol = content[:-1], b''
+            elif not eol:
+                # 超长行被截断时，不要拆开"=XX"
+                tail = content.rfind(b'=', max(len(content) - 2, 0))
+                if tail != -1:
+                    content, self._carry = content[:tail], content[tail:]
+            content = binascii.a2b_qp(content)
+
+        self.consumer.write(self._pending_eol + content)
+        self._pending_eol = eol
+
+    def close(self) -> None:
+        if self.consumer is None:
+            return
+        if self.encoding == 'base64' and self._carry:
+            try:
+                self.consumer.write(binascii.a2b_base64(self._carry + b'=' * (-len(self._carry) % 4)))
+            except binascii.Error:
+                pass
+        elif self.encoding == 'quoted-printable' and self._carry:
+            self.consumer.write(binascii.a2b_qp(self._carry))
+        self.consumer.close()
+
+
+class _LineReader:
+    """按行读取，单行最多chunk_size字节（避免没有换行符的二进制内容占满内存）"""
+
+    def __init__(self, fp, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.at_line_start = True
+
+    def readline(self):
+        """返回 (行, 是否从行首开始)，文件结束返回 (None, True)"""
+        line = self.fp.readline(self.chunk_size)
+        if not line:
+            return None, True
+        at_start = self.at_line_start
+        if at_start and line.startswith(b'--') and not line.endswith(b'\n'):
+            # 可能是分隔行，读完整行（RFC 5322限制每行最多998字节）
+            while len(line) < 998 and not line.endswith(b'\n'):
+                more = self.fp.readline(998 - len(line))
+                if not more:
+                    break
+                line += more
+        self.at_line_start = line.endswith(b'\n')
+        return line, at_start
+
+
+def _stream_mime_parts(fp, open_part, chunk_size: int = STREAM_CHUNK_SIZE) -> None:
+    """
+    流式遍历MIME结构，内存中只保存当前行和各部分的头字段
+
+    Args:
+        fp: 二进制文件对象
+        open_part: 以部分的头字段（email.message.Message）调用，返回带write/close的对象接收解码后的内容，
+            返回None表示跳过该部分
+    """
+    reader = _LineReader(fp, chunk_size)
+    boundaries = []
+    header_parser = BytesHeaderParser()
+
+    def read_headers():
+        lines = []
+        while True:
+            line, at_start = reader.readline()
+            if line is None or (at_start and line in (b'\r\n', b'\n')):
+                break
+            lines.append(line)
+        return header_parser.parsebytes(b''.join(lines))
+
+    def find_boundary(line):
+        if not boundaries or not line.startswith(b'--'):
+            return None
+        stripped = line.rstrip()
+        for index in range(len(boundaries) - 1, -1, -1):
+            delimiter = b'--' + boundaries[index]
+            if stripped == delimiter:
+                return index, False
+            if stripped == delimiter + b'--':
+                return index, True
+        return None
+
+    def consume_body(decoder):
+        """读取正文直到分隔行，返回 (分隔符序号, 是否结束分隔符)，文件结束返回None"""
+        try:
+            while True:
+                line, at_start = reader.readline()
+                if line is None:
+                    return None
+                hit = find_boundary(line) if at_start else None
+                if hit is not None:
+                    return hit
+                decoder.feed(line)
+        finally:
+            decoder.close()
+
+    headers = read_headers()
+    while True:
+        boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+        if boundary:
+            # multipart容器：跳过前导部分，直到第一个分隔行
+            boundaries.append(boundary.encode('ascii', errors='replace'))
+            decoder = _BodyDecoder('7bit', None)
+        else:
+            decoder = _BodyDecoder(headers.get('Content-Transfer-Encoding', '7bit').strip(), open_part(headers))
+        hit = consume_body(decoder)
+        while hit is not None and hit[1]:
+            # 结束分隔符：该multipart结束，跳过结尾部分直到外层的下一个分隔行
+            del boundaries[hit[0]:]
+            hit = consume_body(_BodyDecoder('7bit', None))
+        if hit is None:
+            return
+        del boundaries[hit[0] + 1:]
+        headers = read_headers()
+
+
+def _match_types(content_type: str, patterns) -> bool:
+    return any(fnmatch.fnmatch(content_type, pattern.lower()) for pattern in patterns)
+
+
+def extract_attachments(source, output_dir: Optional[str] = None, sink: Optional[AttachmentSink] = None,
+                        allowed_types=None, skip_types=None, max_size: Optional[int] = None,
+                        chunk_size: int = STREAM_CHUNK_SIZE) -> list:
+    """
+    流式提取邮件附件：逐块解码写入磁盘或sink，不在内存中保存完整邮件和附件
+
+    Args:
+        source: 邮件的二进制文件对象（或bytes）
+        output_dir: 保存目录，按内容哈希去重保存（DirectorySink）；与sink二选一
+        sink: 自定义的AttachmentSink
+        allowed_types: 只提取这些MIME类型，支持通配符，如 ['application/pdf', 'image/*']
+        skip_types: 跳过这些MIME类型
+        max_size: 单个附件的最大字节数，超过的附件放弃保存
+        chunk_size: 读取块大小
+
+    Returns:
+        list: 每个附件的信息 {filename, content_type, size, sha256, path, duplicate, skipped}，
+            skipped为跳过原因（'type_not_allowed'、'type_skipped'、'too_large'），保存成功时为None
+    """
+    if sink is None:
+        if output_dir is None:
+            raise ValueError("需要指定output_dir或sink")
+        sink = DirectorySink(output_dir)
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    attachments = []
+
+    def open_part(headers):
+        filename = headers.get_filename()
+        disposition = headers.get_content_disposition()
+        if disposition != 'attachment' and not filename:
+            # 正文部分
+            return None
+        content_type = headers.get_content_type()
+        info = {
+            'filename': _decode_header_value(filename) if filename else None,
+            'content_type': content_type,
+            'size': 0,
+            'sha256': None,
+            'path': None,
+            'duplicate': False,
+            'skipped': None,
+        }
+        attachments.append(info)
+        if allowed_types and not _match_types(content_type, allowed_types):
+            info['skipped'] = 'type_not_allowed'
+            return None
+        if skip_types and _match_types(content_type, skip_types):
+            info['skipped'] = 'type_skipped'
+            return None
+        return _AttachmentWriter(info, sink, max_size)
+
+    _stream_mime_parts(source, open_part, chunk_size)
+    return attachments
+
+
+class IMAPBodyStream(io.RawIOBase):
+    """
+    用分段FETCH（BODY.PEEK[]<偏移.长度>）按需读取服务器上的邮件，
+    配合extract_attachments时内存中只有一个分段
+    """
+
+    def __init__(self, mail, uid: int, chunk_size: int = 1024 * 1024):
+        self.mail = mail
+        self.uid = uid
+        self.chunk_size = chunk_size
+        self._offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._eof:
+            return 0
+        size = min(len(buffer), self.chunk_size)
+        status, data = self.mail.uid('FETCH', str(self.uid), f'(BODY.PEEK[]<{self._offset}.{size}>)')
+        if status != 'OK':
+            raise Exception(f"获取邮件 UID {self.uid} 失败")
+        chunk = data[0][1] if data and isinstance(data[0], tuple) else b''
+        chunk = chunk or b''
+        if len(chunk) < size:
+            self._eof = True
+        buffer[:len(chunk)] = chunk
+        self._offset += len(chunk)
+        return len(chunk)
+
+
+# ===== IDLE推送监听 =====
+
+# RFC 2177：服务器可以在IDLE 30分钟后断开，需要在此之前结束并重新发起IDLE
+IDLE_RENEW_SECONDS = 25 * 60
+# 服务器不支持IDLE时的NOOP轮询间隔（秒）
+NOOP_POLL_INTERVAL = 30
+# 等待通知时检查停止标志的间隔（秒）
+_STOP_CHECK_INTERVAL = 0.5
+
+_NEW_MAIL_RE = re.compile(rb'\* \d+ (EXISTS|RECENT)', re.IGNORECASE)
+
+
+def _wait_readable(mail, timeout: float) -> bool:
+    """等待服务器发来数据；先检查连接缓冲区中已读入但未消费的数据，再select套接字"""
+    sock = mail.sock
+    original_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        if mail.file.peek(1):
+            return True
+    except (BlockingIOError, ssl.SSLWantReadError):
+        pass
+    finally:
+        sock.settimeout(original_timeout)
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+
+def _read_line(mail) -> bytes:
+    """读取一行服务器响应；mail.readline()在连接关闭时返回空字节串，这里转换为abort"""
+    line = mail.readline()
+    if not line:
+        raise imaplib.IMAP4.abort("服务器关闭了连接")
+    return line
+
+
+def _response_int(mail, name: str) -> Optional[int]:
+    """读取SELECT返回的响应码（如UIDVALIDITY、UIDNEXT）"""
+    _, data = mail.response(name)
+    if data and data[0]:
+        return int(data[0].split()[0])
+    return None
+
+
+class FolderIdleWatcher:
+    """
+    单个文件夹的新邮件监听器，使用一个独立连接
+    
+    服务器支持IDLE时在IDLE中等待EXISTS/RECENT通知，每idle_timeout秒重新发起IDLE；
+    否则每poll_interval秒发送NOOP。每次唤醒后用UID SEARCH查找上次之后的新UID，
+    以 {'folder', 'uids', 'uidvalidity'} 调用callback（可以直接传入queue.Queue().put）。
+    callback抛出异常时last_uid不前进，每retry_delay秒重新报告这些UID（至少一次）。
+    连接断开时按指数退避重连，重连后补发断开期间到达的邮件。
+    """
+
+    def __init__(self, connect, folder: str, callback, since_uid: Optional[int] = None,
+                 use_idle: bool = True, idle_timeout: float = IDLE_RENEW_SECONDS,
+                 poll_interval: float = NOOP_POLL_INTERVAL, reconnect_delay: float = 5,
+                 max_reconnect_delay: float = 300, retry_delay: float = 30,
+                 stop_event: Optional[threading.Event] = None):
+        """
+        Args:
+            connect: 创建并登录IMAP连接的函数（不需要选择文件夹）
+            folder: 编码后的原始文件夹名
+            callback: 收到新邮件时调用，参数为事件字典
+            since_uid: 只报告大于该UID的邮件，默认从启动时的最新邮件之后开始
+            use_idle: 服务器支持时是否使用IDLE，False则始终NOOP轮询
+            idle_timeout: 重新发起IDLE的间隔（秒）
+            poll_interval: NOOP轮询间隔（秒）
+            reconnect_delay: 首次重连等待时间（秒），之后每次翻倍
+            max_reconnect_delay: 重连等待时间上限（秒）
+            retry_delay: callback失败后重新报告的间隔（秒）
+            stop_event: 停止标志，多个监听器可以共用
+        """
+        self._connect = connect
+        self.folder = folder
+        self.callback = callback
+        self.last_uid = since_uid
+        self.uidvalidity = None
+        self.use_idle = use_idle
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.retry_delay = retry_delay
+        # 上次callback失败，需要在retry_delay后重新报告
+        self._retry_pending = False
+        self._stop = stop_event or threading.Event()
+        self._tag_counter = 0
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _open(self):
+        mail = self._connect()
+        try:
+            status, data = mail.select(quote_folder(self.folder), readonly=True)
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"选择文件夹 {self.folder} 失败: {data}")
+            uidvalidity = _response_int(mail, 'UIDVALIDITY')
+            if self.uidvalidity is not None and uidvalidity != self.uidvalidity:
+                # UID已全部失效，从当前最新邮件之后重新开始
+                print(f"文件夹 {self.folder} 的UIDVALIDITY已变化，重新建立基线")
+                self.last_uid = None
+            self.uidvalidity = uidvalidity
+            if self.last_uid is None:
+                uidnext = _response_int(mail, 'UIDNEXT')
+                if uidnext is not None:
+                    self.last_uid = uidnext - 1
+                else:
+                    status, data = mail.uid('SEARCH', None, 'UID', '*')
+                    uids = data[0].split() if status == 'OK' and data and data[0] else []
+                    self.last_uid = max((int(uid) for uid in uids), default=0)
+        except Exception:
+            mail.shutdown()
+            raise
+        return mail
+
+    def _check(self, mail) -> None:
+        """查找并报告新UID（"UID n:*"在没有新邮件时也会返回最大UID，需要过滤）"""
+        # 清除之前收到的通知；搜索期间服务器附带的EXISTS会保留下来，让下一次IDLE立即返回
+        for name in ('EXISTS', 'RECENT'):
+            mail.untagged_responses.pop(name, None)
+        status, data = mail.uid('SEARCH', None, 'UID', f'{self.last_uid + 1}:*')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"搜索文件夹 {self.folder} 新邮件失败")
+        uids = sorted(int(uid) for uid in (data[0].split() if data and data[0] else [])
+                      if int(uid) > self.last_uid)
+        if not uids:
+            self._retry_pending = False
+            return
+        try:
+            self.callback({'folder': self.folder, 'uids': uids, 'uidvalidity': self.uidvalidity})
+        except Exception as e:
+            # 不推进last_uid，下次检查时连同新邮件一起重新报告
+            self._retry_pending = True
+            print(f"处理文件夹 {self.folder} 新邮件 {uids} 失败: {str(e)}，{self.retry_delay}秒后重试")
+            return
+        self._retry_pending = False
+        self.last_uid = uids[-1]
+
+    def _idle_once(self, mail) -> None:
+        """发起IDLE，直到收到新邮件通知、到达idle_timeout或被停止，然后发送DONE结束"""
+        if 'EXISTS' in mail.untagged_responses or 'RECENT' in mail.untagged_responses:
+            # 上次搜索之后已经收到新邮件通知
+            return
+        self._tag_counter += 1
+        tag = f'IDLE{self._tag_counter}'.encode()
+        mail.send(tag + b' IDLE\r\n')
+        line = _read_line(mail)
+        notified = False
+        while line.startswith(b'* '):
+            notified = notified or bool(_NEW_MAIL_RE.match(line))
+            line = _read_line(mail)
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE失败: {line!r}")
+
+        deadline = time.monotonic() + self._wait_timeout(self.idle_timeout)
+        while not notified and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not _wait_readable(mail, min(remaining, _STOP_CHECK_INTERVAL)):
+                continue
+            line = _read_line(mail)
+            if line.startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(f"服务器断开连接: {line!r}")
+            if _NEW_MAIL_RE.match(line):
+                break
+
+        mail.send(b'DONE\r\n')
+        while True:
+            line = _read_line(mail)
+            if line.startswith(tag + b' '):
+                if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                    raise imaplib.IMAP4.error(f"IDLE结束失败: {line!r}")
+                return
+
+    def _poll_once(self, mail) -> None:
+        if not self._stop.wait(self._wait_timeout(self.poll_interval)):
+            mail.noop()
+
+    def _wait_timeout(self, timeout: float) -> float:
+        """有待重试的邮件时最多等待retry_delay秒"""
+        return min(timeout, self.retry_delay) if self._retry_pending else timeout
+
+    def run(self) -> None:
+        """监听直到stop()，在调用线程中阻塞运行"""
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            mail = None
+            try:
+                mail = self._open()
+                delay = self.reconnect_delay
+                use_idle = self.use_idle and 'IDLE' in mail.capabilities
+                self._check(mail)
+                while not self._stop.is_set():
+                    if use_idle:
+                        self._idle_once(mail)
+                    else:
+                        self._poll_once(mail)
+                    self._check(mail)
+                mail.logout()
+                mail = None
+            except (imaplib.IMAP4.error, OSError) as e:
+                if mail is not None:
+                    mail.shutdown()
+                if self._stop.is_set():
+                    break
+                print(f"监听文件夹 {self.folder} 出错: {str(e)}，{delay}秒后重连")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+
+class IMAPIdleWatcher:
+    """
+    多文件夹新邮件监听，每个文件夹一个线程和一个连接
+    
+    用法:
+        events = queue.Queue()
+        with IMAPIdleWatcher(connect, ['INBOX', 'Support'], events.put):
+            while True:
+                event = events.get()
+                with connect() as mail:
+                    mail.select(event['folder'], readonly=True)
+                    for item in fetch_email_headers(mail, event['uids']):
+                        ...
+    """
+
+    def __init__(self, connect, folders, callback, **options):
+        """
+        Args:
+            connect: 创建并登录IMAP连接的函数
+            folders: 编码后的原始文件夹名列表
+            callback: 收到新邮件时调用，参数为 {'folder', 'uids', 'uidvalidity'}，会在各文件夹的线程中调用
+            **options: 传给FolderIdleWatcher的其他参数，如idle_timeout、poll_interval
+        """
+        self._stop = threading.Event()
+        self.watchers = [FolderIdleWatcher(connect, folder, callback, stop_event=self._stop, **options)
+                         for folder in folders]
+        self._threads = []
+
+    def start(self) -> None:
+        for watcher in self.watchers:
+            thread = threading.Thread(target=watcher.run, name=f'imap-idle-{watcher.folder}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def fetch_emails(days_back=1, mail=None, preview_body=False):
     """
     获取指定天数内的邮件
     
+    列表只批量下载头字段、大小和标记；正文在调用返回对象的parse()时才下载
+    
     Args:
         days_back (int): 获取多少天内的邮件，默认1天（昨天到现在）
+        mail: 已登录的IMAP连接，默认新建连接并选择INBOX
+        preview_body (bool): 是否下载并打印每封邮件的正文预览和附件，默认False
+    
+    Returns:
+        list: LazyEmail列表
     """
     # 连接邮箱
-    mail = imaplib.IMAP4_SSL('imap.example.com')
-    mail.login('user@example.com', 'password')
-    mail.select('INBOX')
+    if mail is None:
+        mail = imaplib.IMAP4_SSL('imap.example.com')
+        mail.login('user@example.com', 'password')
+        mail.select('INBOX', readonly=True)
     
     # 计算指定天数前的日期
     import datetime
     target_date = datetime.datetime.now() - datetime.timedelta(days=days_back)
     search_date = target_date.strftime('%d-%b-%Y')
     
-    # 搜索指定日期到现在的邮件
+    # 搜索指定日期到现在的邮件（返回UID，后续命令不受邮件删除导致的序号变化影响）
     search_criteria = f'SINCE {search_date}'
-    status, messages = mail.search(None, search_criteria)
+    status, messages = mail.uid('SEARCH', None, search_criteria)
     if status != 'OK':
         raise Exception("搜索邮件失败")
+    uids = messages[0].split() if messages and messages[0] else []
     
     print(f"搜索条件: {search_criteria}")
     print(f"时间范围: 过去{days_back}天内的邮件")
-    print(f"找到邮件数量: {len(messages[0].split()) if messages[0] else 0}")
+    print(f"找到邮件数量: {len(uids)}")
     
-    # 遍历邮件并解析
-    for num in messages[0].split():
-        status, data = mail.fetch(num, '(RFC822)')
-        if status != 'OK':
-            continue
-        
-        raw_email = data[0][1]
-        try:
-            email_info = parse_email(raw_email)
-            print(f"主题: {email_info['subject']}")
-            print(f"发件人: {email_info['from']}")
-            print("正文预览:", email_info['body'][:200] + '...' if len(email_info['body']) > 200 else '')
-            print("内容类型:", f"纯文本: {email_info['content_types']['has_plain_text']}, HTML: {email_info['content_types']['has_html']}, 总部分数: {email_info['content_types']['total_parts']}")
-            print("附件数量:", len(email_info['attachments']))
-            if email_info['attachments']:
-                for i, attachment in enumerate(email_info['attachments']):
-                    print(f"  附件{i+1}: {attachment['filename']} ({attachment['content_type']})")
-            print('-' * 50)
-        except Exception as e:
-            print(f"解析邮件 {num} 失败: {str(e)}")
+    emails = fetch_email_headers(mail, uids)
+    for item in emails:
+        print(f"主题: {item.subject}")
+        print(f"发件人: {item.from_}")
+        print(f"大小: {item.size} 字节, 标记: {' '.join(item.flags) or '无'}")
+        if preview_body:
+            try:
+                email_info = item.parse()
+                print("正文预览:", email_info['body'][:200] + '...' if len(email_info['body']) > 200 else '')
+                print("内容类型:", f"纯文本: {email_info['content_types']['has_plain_text']}, HTML: {email_info['content_types']['has_html']}, 总部分数: {email_info['content_types']['total_parts']}")
+                print("附件数量:", len(email_info['attachments']))
+                if email_info['attachments']:
+                    for i, attachment in enumerate(email_info['attachments']):
+                        print(f"  附件{i+1}: {attachment['filename']} ({attachment['content_type']})")
+            except Exception as e:
+                print(f"解析邮件 UID {item.uid} 失败: {str(e)}")
+        print('-' * 50)
+    
+    return emails
 
 if __name__ == '__main__':
     # 可以通过修改days_back参数来调整搜索的时间范围
     # 例如：fetch_emails(7) 获取最近7天的邮件
     # 例如：fetch_emails(30) 获取最近30天的邮件
-    fetch_emails(days_back=1)  # 默认获取最近1天的邮件
\ No newline at end of file
+    # 例如：fetch_emails(1, preview_body=True) 同时下载正文并打印预览
+    emails = fetch_emails(days_back=1)  # 默认获取最近1天的邮件
+    # 需要正文时再下载，如: emails[0].parse()['body']
\ No newline at end of file
@@ -2,12 +2,26 @@
 """
 邮件UID生成和匹配工具
 根据发送人、时间和标题生成唯一的邮件ID，用于后续匹配和回复操作
+
+MailboxIndex 在本地SQLite中保存各文件夹邮件的 IMAP UID、MD5 UID、头字段和标记，
+按UIDVALIDITY/UIDNEXT增量同步，按MD5 UID查找邮件只需一次索引查询和一次FETCH。
+索引中的MD5 UID使用 apps_1215.generate_email_uid（原始From + 原始Subject + 格式化后的Date），
+与 apps_1215.reply_to_email_by_md5_uid、apps_1210 的分类缓存一致
 """
 
 import hashlib
 import datetime
+import email.utils
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
+import apps_1215
+from apps_0114_email import quote_folder
+from apps_1208 import fetch_email_headers, parse_email
+
 
 def generate_email_uid(sender: str, timestamp: str, subject: str) -> str:
     """
@@ -116,6 +130,246 @@ def reply_to_email_by_uid(email_list: list, target_uid: str, reply_content: str)
     return True
 
 
+# ===== 本地邮箱索引 =====
+
+_STATUS_RE = re.compile(rb'(UIDVALIDITY|UIDNEXT) (\d+)')
+_UID_RE = re.compile(rb'UID (\d+)')
+_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+
+# 索引格式版本，MD5 UID的计算方式变化时加1
+_INDEX_VERSION = 1
+
+
+def _header_timestamp(date_header: Optional[str]) -> str:
+    """把Date头转换为apps_1215.generate_email_uid使用的时间格式（保留邮件中的本地时间），无法解析时原样返回"""
+    if not date_header:
+        return ''
+    try:
+        return email.utils.parsedate_to_datetime(date_header).strftime('%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return date_header
+
+
+class MailboxIndex:
+    """
+    本地SQLite邮箱索引
+
+    sync_folder 先用STATUS读取UIDVALIDITY和UIDNEXT：
+    - UIDVALIDITY变化：服务器重建了UID，清空该文件夹的索引后全量同步
+    - UIDNEXT未变化：没有新邮件，不需要SELECT和FETCH
+    - 否则只获取 上次同步的最大UID+1 之后的新邮件头
+    """
+
+    def __init__(self, db_path: str = 'mailbox_index.db'):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _INDEX_VERSION:
+                # 旧版本索引的MD5 UID计算方式不同，清空后在下次同步时全量重建
+                conn.execute("DROP TABLE IF EXISTS messages")
+                conn.execute("DROP TABLE IF EXISTS folders")
+                conn.execute(f"PRAGMA user_version = {_INDEX_VERSION}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder       TEXT PRIMARY KEY,
+                    uidvalidity  INTEGER NOT NULL,
+                    uidnext      INTEGER NOT NULL,
+                    last_uid     INTEGER NOT NULL,
+                    synced_at    TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    folder       TEXT NOT NULL,
+                    imap_uid     INTEGER NOT NULL,
+                    md5_uid      TEXT,
+                    sender       TEXT,
+                    timestamp    TEXT,
+                    subject      TEXT,
+                    message_id   TEXT,
+                    flags        TEXT,
+                    size         INTEGER,
+                    PRIMARY KEY (folder, imap_uid)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_md5_uid ON messages (md5_uid)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程复用一个连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _db(self):
+        conn = self._connect()
+        with conn:
+            yield conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get_folder_state(self, folder: str) -> Optional[dict]:
+        """返回文件夹的同步状态（uidvalidity、uidnext、last_uid、synced_at），未同步过返回None"""
+        row = self._connect().execute("SELECT * FROM folders WHERE folder = ?", (folder,)).fetchone()
+        return dict(row) if row else None
+
+    def sync_folder(self, mail, folder: str = 'INBOX', refresh_flags: bool = False) -> int:
+        """
+        增量同步一个文件夹
+
+        Args:
+            mail: 已登录的IMAP连接
+            folder: 文件夹名（IMAP修改版UTF-7编码后的名称）
+            refresh_flags: 是否刷新已索引邮件的标记，并删除服务器上已不存在的邮件
+                （需要一次 UID FETCH 1:* (FLAGS)，邮件很多时较慢）
+
+        Returns:
+            int: 新索引的邮件数
+        """
+        status, data = mail.status(quote_folder(folder), '(UIDVALIDITY UIDNEXT)')
+        if status != 'OK':
+            raise Exception(f"获取文件夹 {folder} 状态失败")
+        values = {key.decode(): int(value) for key, value in _STATUS_RE.findall(data[0])}
+        uidvalidity, uidnext = values['UIDVALIDITY'], values['UIDNEXT']
+
+        state = self.get_folder_state(folder)
+        if state is not None and state['uidvalidity'] != uidvalidity:
+            print(f"文件夹 {folder} 的UIDVALIDITY已变化，重建索引")
+            with self._db() as conn:
+                conn.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+            state = None
+
+        last_uid = state['last_uid'] if state else 0
+        has_new = state is None or state['uidnext'] != uidnext
+        if not has_new and not refresh_flags:
+            return 0
+
+        status, _ = mail.select(quote_folder(folder), readonly=True)
+        if status != 'OK':
+            raise Exception(f"选择文件夹 {folder} 失败")
+
+        new_count = 0
+        if has_new:
+            # "UID n:*" 在没有更大UID时仍会返回最后一封邮件，需要过滤
+            status, result = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
+            if status != 'OK':
+                raise Exception(f"搜索文件夹 {folder} 的新邮件失败")
+            new_uids = [int(uid) for uid in (result[0].split() if result and result[0] else []) if int(uid) > last_uid]
+            rows = []
+            for item in fetch_email_headers(mail, new_uids):
+                rows.append(self._message_row(folder, item))
+                last_uid = max(last_uid, item.uid)
+            with self._db() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO messages
+                        (folder, imap_uid, md5_uid, sender, timestamp, subject, message_id, flags, size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+            new_count = len(rows)
+
+        if refresh_flags:
+            self._refresh_flags(mail, folder)
+
+        with self._db() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO folders (folder, uidvalidity, uidnext, last_uid, synced_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (folder, uidvalidity, uidnext, last_uid, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+        print(f"文件夹 {folder} 同步完成，新邮件 {new_count} 封")
+        return new_count
+
+    @staticmethod
+    def _message_row(folder: str, item) -> tuple:
+        timestamp = _header_timestamp(item.date)
+        # 与apps_1215回复时的计算方式相同：未解码的From、Subject头
+        md5_uid = apps_1215.generate_email_uid(item.headers['From'] or '', item.headers['Subject'] or '', timestamp)
+        return (folder, item.uid, md5_uid, item.from_, timestamp, item.subject,
+                item.message_id, ' '.join(item.flags), item.size)
+
+    def _refresh_flags(self, mail, folder: str) -> None:
+        status, data = mail.uid('FETCH', '1:*', '(FLAGS)')
+        if status != 'OK':
+            raise Exception(f"获取文件夹 {folder} 的邮件标记失败")
+        flags_by_uid = {}
+        for item in data:
+            line = item[0] if isinstance(item, tuple) else item
+            uid_match = _UID_RE.search(line or b'')
+            flags_match = _FLAGS_RE.search(line or b'')
+            if uid_match:
+                flags_by_uid[int(uid_match.group(1))] = flags_match.group(1).decode() if flags_match else ''
+
+        with self._db() as conn:
+            indexed = [row[0] for row in conn.execute("SELECT imap_uid FROM messages WHERE folder = ?", (folder,))]
+            removed = [(folder, uid) for uid in indexed if uid not in flags_by_uid]
+            conn.executemany("DELETE FROM messages WHERE folder = ? AND imap_uid = ?", removed)
+            conn.executemany("UPDATE messages SET flags = ? WHERE folder = ? AND imap_uid = ?",
+                             [(flags, folder, uid) for uid, flags in flags_by_uid.items()])
+
+    def find_by_md5_uid(self, md5_uid: str, folder: Optional[str] = None) -> Optional[dict]:
+        """
+        按MD5 UID查找已索引的邮件（索引查询，不访问服务器）
+
+        Returns:
+            Optional[dict]: 包含folder、imap_uid、from、timestamp、subject等字段，未找到返回None
+        """
+        sql = "SELECT * FROM messages WHERE md5_uid = ?"
+        params = [md5_uid]
+        if folder is not None:
+            sql += " AND folder = ?"
+            params.append(folder)
+        row = self._connect().execute(sql + " ORDER BY imap_uid DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result['from'] = result.pop('sender')
+        return result
+
+
+def fetch_raw_email_by_md5_uid(index: MailboxIndex, mail, md5_uid: str,
+                               folder: Optional[str] = None) -> Optional[tuple]:
+    """
+    通过本地索引按MD5 UID查找邮件，再用一次UID FETCH下载原始邮件（BODY.PEEK[]不会标记为已读）
+
+    Returns:
+        Optional[tuple]: (索引字段, 原始邮件bytes)，未找到或邮件已被删除返回None
+    """
+    entry = index.find_by_md5_uid(md5_uid, folder)
+    if entry is None:
+        return None
+    status, _ = mail.select(quote_folder(entry['folder']), readonly=True)
+    if status != 'OK':
+        raise Exception(f"选择文件夹 {entry['folder']} 失败")
+    status, data = mail.uid('FETCH', str(entry['imap_uid']), '(BODY.PEEK[])')
+    if status != 'OK' or not data or not isinstance(data[0], tuple):
+        # 索引过期（邮件已被删除），需要重新同步
+        return None
+    return entry, data[0][1]
+
+
+def find_email_by_md5_uid(index: MailboxIndex, mail, md5_uid: str, folder: Optional[str] = None) -> Optional[dict]:
+    """
+    通过本地索引按MD5 UID查找邮件，下载并解析正文
+
+    Returns:
+        Optional[dict]: 索引字段加上parse_email的解析结果（键 'email'），未找到返回None
+    """
+    found = fetch_raw_email_by_md5_uid(index, mail, md5_uid, folder)
+    if found is None:
+        return None
+    entry, raw = found
+    entry['email'] = parse_email(raw)
+    return entry
+
+
 def test_email_uid_functionality():
     """测试邮件UID功能"""
     
@@ -0,0 +1,429 @@
+# 邮件批量分类流水线，提示词设计见 dify/apps_1210.md
+#
+# 1. 从邮箱读取邮件（apps_1208.fetch_emails返回的LazyEmail，或包含title/sender/content的字典）
+# 2. 按generate_email_uid（发件人+标题+发送时间的MD5）查询结果缓存，已分类的邮件不再下载正文
+# 3. 清理并截断正文，按batch_size分批，最多max_workers个批次同时调用分类器
+# 4. 校验分类结果并写入缓存；失败的邮件不缓存，下次运行时重新分类
+import email.utils
+import json
+import re
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from apps_1208 import _decode_header_value, fetch_emails
+from apps_1215 import generate_email_uid
+
+DIFY_API_URL = "https://api.dify.ai/v1/chat/completions"
+
+ANALYSIS_TYPES = ('关注', '审批建议', '不处理')
+
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_MAX_WORKERS = 4
+# 正文截断长度（字符），控制每批请求的token数
+DEFAULT_MAX_BODY_CHARS = 2000
+
+SYSTEM_PROMPT = """你是一位专业的邮件分析助手，负责根据给定的邮件信息进行分类、分析和总结。
+
+## 分析类型定义
+- **关注**: 需要关注的数据，如重要通知、会议提醒、关键项目更新等
+- **审批建议**: 需要审批的数据，提供决策参考，如采购申请、报销审批、请假申请等
+- **不处理**: 敏感的数据，如个人隐私信息、财务数据、机密文件等需要保护的内容
+- **正文总结**: 提取邮件核心信息，简洁明了
+
+## 输出格式要求
+每次会收到一封或多封邮件，请严格按照以下JSON格式输出，不得添加任何额外内容：
+{
+  "results": [
+    {
+      "uid": "邮件唯一标识符",
+      "title": "邮件标题",
+      "sender": "邮件发送人",
+      "analysis_type": "分析类型，取值为：关注、审批建议、不处理",
+      "approval_suggestions": ["审批建议列表，仅当analysis_type为审批建议时必填"],
+      "content_summary": "邮件正文核心总结",
+      "sensitive_content": "识别到的敏感内容，仅当analysis_type为不处理时必填"
+    }
+  ]
+}
+
+## 规则和约束
+1. 请确保分析类型准确，严格按照定义分类
+2. 审批建议需清晰、具体，编号格式为：采1、采2...
+3. 内容总结需提取核心信息，避免冗余
+4. 敏感内容需明确指出具体的敏感信息类型
+5. 所有字段必须填写，不得留空
+6. 仅当analysis_type为审批建议时，approval_suggestions字段为必填数组
+7. 仅当analysis_type为不处理时，sensitive_content字段为必填字符串
+8. 其他情况下，非必填字段可以为空数组或空字符串
+9. results中每封邮件对应一个对象，uid必须与输入一致"""
+
+
+def build_user_prompt(mails: List[Dict]) -> str:
+    """
+    生成一批邮件的USER提示词
+
+    参数:
+        mails: 邮件数据字典列表，包含title、sender、content、uid字段
+
+    返回:
+        str: USER角色提示词
+    """
+    sections = [f"请根据以下{len(mails)}封邮件信息逐封进行分析：\n"]
+    for i, mail_data in enumerate(mails, 1):
+        sections.append(f"""### 邮件{i}
+邮件标题：{mail_data['title']}
+发送人：{mail_data['sender']}
+邮件正文：{mail_data['content']}
+邮件UID：{mail_data['uid']}
+""")
+    sections.append("请按照要求分析每封邮件，并输出符合格式要求的JSON。")
+    return '\n'.join(sections)
+
+
+# ===== 分类器 =====
+# 分类器是任意可调用对象：参数为邮件数据字典列表，返回分析结果字典列表（按uid对应）
+
+class DifyMailClassifier:
+    """
+    调用Dify（OpenAI兼容的chat/completions接口）批量分析邮件，一批邮件一次请求
+    """
+
+    def __init__(self, api_key: str, url: str = DIFY_API_URL, model: str = "gpt-4-turbo", timeout: float = 120):
+        """
+        参数:
+            api_key: Dify平台的API密钥
+            url: 接口地址
+            model: 使用的模型名称，默认为gpt-4-turbo
+            timeout: 请求超时时间（秒）
+        """
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def __call__(self, mails: List[Dict]) -> List[Dict]:
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_user_prompt(mails)}
+            ],
+            "response_format": {"type": "json_object"}
+        }
+        request = urllib.request.Request(self.url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                                         headers=self.headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        content = json.loads(result['choices'][0]['message']['content'])
+        return content['results'] if isinstance(content, dict) else content
+
+
+class LocalStubClassifier:
+    """
+    按关键词分类的本地分类器，不调用大模型，用于测试和离线调试
+
+    batches记录每次调用的批次大小；delay模拟接口耗时
+    """
+
+    APPROVAL_KEYWORDS = ('审批', '申请', '报销', '采购', '请假')
+    SENSITIVE_KEYWORDS = ('身份证', '工资', '隐私', '密码', '银行卡')
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def classify(self, mail_data: Dict) -> Dict:
+        text = f"{mail_data['title']}\n{mail_data['content']}"
+        result = {
+            'uid': mail_data['uid'],
+            'title': mail_data['title'],
+            'sender': mail_data['sender'],
+            'analysis_type': '关注',
+            'approval_suggestions': [],
+            'content_summary': mail_data['content'][:100] or mail_data['title'],
+            'sensitive_content': ''
+        }
+        sensitive = [word for word in self.SENSITIVE_KEYWORDS if word in text]
+        if sensitive:
+            result['analysis_type'] = '不处理'
+            result['sensitive_content'] = f"包含{'、'.join(sensitive)}等敏感信息"
+        elif any(word in text for word in self.APPROVAL_KEYWORDS):
+            result['analysis_type'] = '审批建议'
+            result['approval_suggestions'] = [f"采1：核实{mail_data['title']}的必要性", "采2：审核金额和数量是否合理"]
+        return result
+
+    def __call__(self, mails: List[Dict]) -> List[Dict]:
+        with self._lock:
+            self.batches.append(len(mails))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            return [self.classify(mail_data) for mail_data in mails]
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def validate_result(result) -> Optional[str]:
+    """
+    按 dify/apps_1210.md 第7节校验分析结果
+
+    返回:
+        Optional[str]: 错误原因，结果有效时返回None
+    """
+    if not isinstance(result, dict):
+        return "分析结果不是JSON对象"
+    for field in ('uid', 'title', 'sender', 'analysis_type', 'content_summary'):
+        if not result.get(field):
+            return f"缺少必填字段 {field}"
+    analysis_type = result['analysis_type']
+    if analysis_type not in ANALYSIS_TYPES:
+        return f"未知的分析类型 {analysis_type}"
+    suggestions = result.get('approval_suggestions') or []
+    if not isinstance(suggestions, list):
+        return "approval_suggestions必须为数组"
+    if analysis_type == '审批建议' and not suggestions:
+        return "审批建议类型缺少approval_suggestions"
+    if analysis_type == '不处理' and not result.get('sensitive_content'):
+        return "不处理类型缺少sensitive_content"
+    return None
+
+
+# ===== 结果缓存 =====
+
+class ClassificationCache:
+    """
+    以generate_email_uid为键的分类结果缓存（SQLite），只在调用classify_emails的线程中使用
+    """
+
+    def __init__(self, db_path: str = 'email_classification.db'):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS email_classifications (
+                uid TEXT PRIMARY KEY,
+                analysis_type TEXT NOT NULL,
+                result TEXT NOT NULL,
+                classified_at REAL NOT NULL
+            )
+        ''')
+        self._conn.commit()
+
+    def get_many(self, uids: Iterable[str]) -> Dict[str, Dict]:
+        """批量查询，返回 {uid: 分析结果}（SQLite参数个数有上限，分段查询）"""
+        uids = list(dict.fromkeys(uids))
+        found = {}
+        for start in range(0, len(uids), 500):
+            chunk = uids[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT uid, result FROM email_classifications WHERE uid IN ({','.join('?' * len(chunk))})",
+                chunk)
+            for uid, result in rows:
+                found[uid] = json.loads(result)
+        return found
+
+    def put_many(self, results: List[Dict]) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO email_classifications (uid, analysis_type, result, classified_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(result['uid'], result['analysis_type'], json.dumps(result, ensure_ascii=False), now)
+                 for result in results])
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+# ===== 流水线 =====
+
+# 回复/转发时附带的原始邮件（apps_1215的回复格式以及常见客户端格式），分类时不需要
+_QUOTE_MARKER_RE = re.compile(r'^\s*-{2,}\s*(原始邮件|Original Message)\s*-{2,}\s*$', re.MULTILINE | re.IGNORECASE)
+_SPACES_RE = re.compile(r'[ \t　\xa0]+')
+
+
+def normalize_body(text: str, max_chars: int = DEFAULT_MAX_BODY_CHARS) -> str:
+    """
+    清理正文：去掉引用的原始邮件和">"引用行、空行和多余空白，并截断到max_chars个字符
+    """
+    if not text:
+        return ''
+    marker = _QUOTE_MARKER_RE.search(text)
+    if marker:
+        text = text[:marker.start()]
+    lines = []
+    for line in text.splitlines():
+        line = _SPACES_RE.sub(' ', line).strip()
+        if line and not line.startswith('>'):
+            lines.append(line)
+    text = '\n'.join(lines)
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + '…'
+    return text
+
+
+def email_uid_from_headers(headers) -> str:
+    """按apps_1215.reply_to_email_by_md5_uid的方式，用原始From、Subject和格式化后的Date计算邮件UID"""
+    date = headers['Date'] or ''
+    try:
+        sent_time = email.utils.parsedate_to_datetime(date).strftime('%Y-%m-%d %H:%M:%S') if date else ''
+    except (TypeError, ValueError):
+        sent_time = date
+    return generate_email_uid(headers['From'] or '', headers['Subject'] or '', sent_time)
+
+
+def _describe(item) -> Dict:
+    """提取邮件的UID、标题和发件人，正文通过load_body按需读取"""
+    if isinstance(item, dict):
+        content = item.get('content', '')
+        uid = item.get('uid') or generate_email_uid(item.get('sender', ''), item.get('title', ''),
+                                                    item.get('sent_time', ''))
+        return {'uid': uid, 'title': item.get('title', ''), 'sender': item.get('sender', ''),
+                'load_body': lambda: content}
+    return {'uid': email_uid_from_headers(item.headers), 'title': item.subject,
+            'sender': _decode_header_value(item.headers['From']),
+            'load_body': lambda: item.parse()['body']}
+
+
+def classify_emails(
+    emails: Iterable,
+    classifier: Callable[[List[Dict]], List[Dict]],
+    cache: Optional[ClassificationCache] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    max_body_chars: int = DEFAULT_MAX_BODY_CHARS
+) -> List[Dict]:
+    """
+    批量分类邮件
+
+    参数:
+        emails: LazyEmail列表，或包含title、sender、content以及uid或sent_time的字典列表
+        classifier: 分类器，如DifyMailClassifier或LocalStubClassifier
+        cache: 结果缓存，命中的邮件不下载正文、不调用分类器
+        batch_size: 每次调用分类器的邮件数
+        max_workers: 同时进行的分类请求数
+        max_body_chars: 正文截断长度
+
+    返回:
+        List[Dict]: 按输入顺序排列的分析结果，附加cached字段表示是否来自缓存；
+            分类失败的邮件只包含uid、title、sender、error和cached
+    """
+    if batch_size <= 0 or max_workers <= 0:
+        raise ValueError("batch_size和max_workers必须大于0")
+    items = [_describe(item) for item in emails]
+    results: List[Optional[Dict]] = [None] * len(items)
+    cached = cache.get_many(item['uid'] for item in items) if cache is not None else {}
+
+    # 同一封邮件（如出现在多个文件夹中）只分类一次
+    positions: Dict[str, List[int]] = {}
+    pending = []
+    for index, item in enumerate(items):
+        uid = item['uid']
+        if uid in cached:
+            results[index] = dict(cached[uid], cached=True)
+        elif uid in positions:
+            positions[uid].append(index)
+        else:
+            positions[uid] = [index]
+            pending.append(item)
+
+    def fail(item, error):
+        for index in positions[item['uid']]:
+            results[index] = {'uid': item['uid'], 'title': item['title'], 'sender': item['sender'],
+                              'error': error, 'cached': False}
+
+    def batches():
+        # 正文在提交批次前才读取，同时在途的正文最多max_workers+1批
+        for start in range(0, len(pending), batch_size):
+            batch = []
+            for item in pending[start:start + batch_size]:
+                try:
+                    content = normalize_body(item['load_body'](), max_body_chars)
+                except Exception as e:
+                    fail(item, f"读取正文失败: {str(e)}")
+                    continue
+                batch.append({'uid': item['uid'], 'title': item['title'], 'sender': item['sender'],
+                              'content': content})
+            if batch:
+                yield batch
+
+    def collect(batch, future):
+        try:
+            returned = {result.get('uid'): result for result in future.result() if isinstance(result, dict)}
+        except Exception as e:
+            for mail_data in batch:
+                fail(mail_data, f"分类失败: {str(e)}")
+            return
+        classified = []
+        for mail_data in batch:
+            result = returned.get(mail_data['uid'])
+            error = "分类结果缺失" if result is None else validate_result(result)
+            if error:
+                fail(mail_data, error)
+                continue
+            result = dict(result, approval_suggestions=result.get('approval_suggestions') or [],
+                          sensitive_content=result.get('sensitive_content') or '')
+            classified.append(result)
+            for index in positions[mail_data['uid']]:
+                results[index] = dict(result, cached=False)
+        if cache is not None and classified:
+            cache.put_many(classified)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        for batch in batches():
+            if len(running) >= max_workers:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(running.pop(future), future)
+            running[executor.submit(classifier, batch)] = batch
+        for future, batch in running.items():
+            collect(batch, future)
+
+    hits = sum(1 for result in results if result['cached'])
+    failed = sum(1 for result in results if 'error' in result)
+    print(f"邮件分类完成: 共 {len(results)} 封，缓存命中 {hits} 封，"
+          f"新分类 {len(results) - hits - failed} 封，失败 {failed} 封")
+    return results
+
+
+def classify_recent_emails(mail, classifier, cache: Optional[ClassificationCache] = None,
+                           days_back: int = 1, **options) -> List[Dict]:
+    """
+    分类最近days_back天的邮件（mail为已登录并选择文件夹的IMAP连接），其他参数见classify_emails
+    """
+    return classify_emails(fetch_emails(days_back, mail=mail), classifier, cache, **options)
+
+
+if __name__ == "__main__":
+    mails = [
+        {"title": "关于购买新办公设备的申请", "sender": "行政部 <admin@company.com>",
+         "content": "尊敬的领导，您好！由于现有办公设备老化，影响工作效率，申请购买10台新电脑，预算总额为5万元。请审批。",
+         "sent_time": "2024-06-15 09:00:00"},
+        {"title": "项目进度报告", "sender": "项目经理 <pm@company.com>",
+         "content": "各位项目成员，本周项目进度达到80%，预计下周可以完成全部开发工作。请各小组注意测试环节，确保项目质量。",
+         "sent_time": "2024-06-15 10:00:00"},
+        {"title": "客户隐私数据处理报告", "sender": "法务部 <legal@company.com>",
+         "content": "尊敬的领导，附件是客户隐私数据处理报告，包含客户姓名、身份证号、联系方式等敏感信息。请严格保密，仅用于内部审计。",
+         "sent_time": "2024-06-15 11:00:00"},
+    ]
+
+    # 本地分类器示例；接入Dify时换成 DifyMailClassifier(api_key="YOUR_API_KEY")
+    # 从邮箱读取时: classify_recent_emails(mail, classifier, cache, days_back=1)
+    cache = ClassificationCache(':memory:')
+    for result in classify_emails(mails, LocalStubClassifier(), cache):
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    # 再次运行时全部命中缓存
+    classify_emails(mails, LocalStubClassifier(), cache)
+    cache.close()
@@ -3,11 +3,15 @@ import smtplib
 import imaplib
 import email
 import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List
+
+from apps_0114_email import ConnectionPool
 
 def parse_single_email_address(email_str: str) -> tuple:
     """
@@ -111,6 +115,263 @@ def generate_email_uid(from_email: str, subject: str, sent_time: str) -> str:
     md5_hash = hashlib.md5(combined.encode('utf-8'))
     return md5_hash.hexdigest()
 
+# ===== SMTP连接池与并发发送 =====
+
+# 服务端主动断开（421为"服务不可用，即将关闭连接"）时重连重发
+_RECONNECT_CODES = (421,)
+
+
+def smtp_connector(
+    smtp_server: str,
+    smtp_port: int,
+    smtp_username: str,
+    smtp_password: str,
+    use_ssl: bool = False,
+    starttls: bool = False,
+    timeout: float = 30
+) -> Callable[[], smtplib.SMTP]:
+    """
+    生成创建并登录SMTP连接的函数，供SMTPConnectionPool使用
+    
+    参数:
+        smtp_server: SMTP服务器地址
+        smtp_port: SMTP服务器端口
+        smtp_username: SMTP用户名
+        smtp_password: SMTP密码
+        use_ssl: 是否使用SMTP_SSL（465端口）
+        starttls: 是否在明文连接上执行STARTTLS（587端口）
+        timeout: 网络超时时间（秒）
+    
+    返回:
+        Callable: 无参函数，每次调用返回一个已登录的SMTP连接
+    """
+    def connect() -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if use_ssl else smtplib.SMTP
+        smtp = smtp_class(smtp_server, smtp_port, timeout=timeout)
+        try:
+            if starttls:
+                smtp.starttls()
+            smtp.login(smtp_username, smtp_password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+    return connect
+
+
+class SMTPDeliveryUnknown(smtplib.SMTPServerDisconnected):
+    """DATA命令发出后连接断开、没有收到服务器的最终回复，邮件可能已经被接收，不能确定是否已投递"""
+
+
+class _PooledSMTP:
+    """连接池中的SMTP连接及其使用情况"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.sent = 0
+        # 当前邮件是否已发出DATA命令（smtplib.SMTP.sendmail通过self.data发送正文）
+        self.data_started = False
+        data = smtp.data
+
+        def tracked_data(msg):
+            self.data_started = True
+            return data(msg)
+
+        smtp.data = tracked_data
+
+
+class SMTPConnectionPool(ConnectionPool):
+    """
+    同一SMTP服务器/账户的连接池
+    
+    登录和TLS握手只在创建连接时做一次，之后的邮件复用已登录的会话；
+    最多同时存在max_connections个连接（即该服务器的并发上限），
+    服务端在DATA之前断开连接时丢弃该连接并自动重连重发一次。
+    """
+
+    kind = 'SMTP'
+
+    def __init__(
+        self,
+        connect: Callable[[], smtplib.SMTP],
+        max_connections: int = 4,
+        max_idle_time: float = 30.0,
+        max_messages_per_connection: int = 100
+    ):
+        """
+        参数:
+            connect: 创建并登录SMTP连接的函数，如 smtp_connector(...) 的返回值
+            max_connections: 最大连接数
+            max_idle_time: 空闲超过该时间（秒）的连接在复用前先发NOOP检查是否仍然可用
+            max_messages_per_connection: 单个连接最多发送的邮件数，达到后关闭
+                （很多服务器限制单个会话的邮件数）
+        """
+        super().__init__(connect, max_connections)
+        self.max_idle_time = max_idle_time
+        self.max_messages_per_connection = max_messages_per_connection
+        # 统计：新建连接数、重连次数
+        self.connections_opened = 0
+        self.reconnects = 0
+
+    def _open(self) -> _PooledSMTP:
+        smtp = self._connect()
+        with self._cond:
+            self.connections_opened += 1
+        return _PooledSMTP(smtp)
+
+    def _close(self, conn: _PooledSMTP, graceful: bool) -> None:
+        if graceful:
+            conn.smtp.quit()
+        else:
+            conn.smtp.close()
+
+    def _is_alive(self, conn: _PooledSMTP) -> bool:
+        if time.monotonic() - conn.last_used < self.max_idle_time:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _release(self, conn: _PooledSMTP) -> None:
+        conn.last_used = time.monotonic()
+        if conn.sent >= self.max_messages_per_connection:
+            self._discard(conn, graceful=True)
+        else:
+            super()._release(conn)
+
+    def send(self, msg, from_addr: Optional[str] = None, to_addrs: Optional[List[str]] = None,
+             timeout: Optional[float] = None) -> Dict:
+        """
+        用池中的连接发送一封邮件，参数同 smtplib.SMTP.send_message
+        
+        只有确定服务器没有接收邮件时才换一个新连接重发一次：
+        - DATA命令发出之前连接被断开（MAIL/RCPT阶段），或服务器回复421
+        - DATA命令发出之后连接被断开、没有收到最终回复时，服务器可能已经接收了邮件，
+          重发可能导致对方收到两封，因此不重发，抛出SMTPDeliveryUnknown由调用方决定如何处理
+        
+        返回:
+            Dict: 被拒绝的收件人 {地址: (错误码, 错误信息)}，全部成功时为空字典
+        
+        异常:
+            SMTPDeliveryUnknown: DATA之后连接断开，不确定邮件是否已被接收
+            smtplib.SMTPException: 发送失败（收件人全部被拒、重连后仍断开等）
+        """
+        for attempt in range(2):
+            conn = self._take(timeout)
+            conn.data_started = False
+            try:
+                refused = conn.smtp.send_message(msg, from_addr, to_addrs)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException,
+                    smtplib.SMTPRecipientsRefused) as e:
+                disconnected = (isinstance(e, smtplib.SMTPServerDisconnected)
+                                or getattr(e, 'smtp_code', None) in _RECONNECT_CODES)
+                if not disconnected:
+                    # 发件人/收件人/正文被拒绝等命令级错误，RSET后连接仍可复用
+                    self._reset_and_release(conn)
+                    raise
+                self._discard(conn)
+                if isinstance(e, smtplib.SMTPServerDisconnected) and conn.data_started:
+                    raise SMTPDeliveryUnknown(f"发送DATA后连接断开，邮件可能已被接收: {str(e)}") from e
+                if attempt == 1:
+                    raise
+                with self._cond:
+                    self.reconnects += 1
+            except BaseException:
+                self._discard(conn)
+                raise
+            else:
+                conn.sent += 1
+                self._release(conn)
+                return refused
+
+    def _reset_and_release(self, conn: _PooledSMTP) -> None:
+        try:
+            conn.smtp.rset()
+        except (smtplib.SMTPException, OSError):
+            self._discard(conn)
+        else:
+            self._release(conn)
+
+
+def send_messages_concurrently(messages: List, pool: Optional[SMTPConnectionPool] = None) -> List[Dict]:
+    """
+    并发发送多封邮件，每个SMTP服务器的并发数不超过其连接池的max_connections
+    
+    参数:
+        messages: 邮件列表（配合pool参数），或 (连接池, 邮件) 元组列表（发往多个SMTP服务器）
+        pool: 所有邮件共用的连接池
+    
+    返回:
+        List[Dict]: 按messages顺序排列的发送结果，每项包含 index、to、subject、success、
+            refused（被拒绝的收件人）、error（失败原因，成功时为None）和
+            delivery_unknown（DATA之后连接断开，不确定是否已投递，见SMTPDeliveryUnknown）
+    """
+    jobs = [(pool, item) if pool is not None else item for item in messages]
+    pools = {id(job_pool): job_pool for job_pool, _ in jobs}
+    if not jobs:
+        return []
+
+    def send(index_job):
+        index, (job_pool, msg) = index_job
+        result = {'index': index, 'to': msg['To'], 'subject': msg['Subject'],
+                  'success': False, 'refused': {}, 'error': None, 'delivery_unknown': False}
+        try:
+            result['refused'] = job_pool.send(msg)
+            result['success'] = True
+        except SMTPDeliveryUnknown as e:
+            result['error'] = str(e)
+            result['delivery_unknown'] = True
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    # 线程数等于各连接池上限之和，单个连接池内的并发由连接池的上限控制
+    max_workers = sum(job_pool.max_connections for job_pool in pools.values())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(send, enumerate(jobs)))
+
+
+def _scan_inbox_for_uid(imap: imaplib.IMAP4, target_uid: str) -> Optional[email.message.Message]:
+    """逐封下载收件箱邮件，返回MD5 UID与target_uid匹配的邮件（没有本地索引时使用）"""
+    imap.select('INBOX')
+    
+    # 搜索所有邮件
+    result, data = imap.search(None, 'ALL')
+    if result != 'OK':
+        raise Exception("搜索邮件失败")
+    
+    for e_id in data[0].split():
+        # 获取邮件内容
+        result, msg_data = imap.fetch(e_id, '(RFC822)')
+        if result != 'OK':
+            continue
+        
+        msg = email.message_from_bytes(msg_data[0][1])
+        
+        # 提取邮件信息
+        msg_from = msg['From'] if msg['From'] else ''
+        msg_subject = msg['Subject'] if msg['Subject'] else ''
+        msg_date = msg['Date'] if msg['Date'] else ''
+        
+        # 解析日期格式，统一时间字符串格式
+        try:
+            if msg_date:
+                date_obj = email.utils.parsedate_to_datetime(msg_date)
+                # 格式化为统一的时间字符串格式
+                formatted_date = date_obj.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                formatted_date = ''
+        except:
+            formatted_date = msg_date
+        
+        # 生成当前邮件的MD5 UID并比较
+        if generate_email_uid(msg_from, msg_subject, formatted_date) == target_uid:
+            return msg
+    return None
+
+
 def reply_to_email_by_md5_uid(
     smtp_server: str,
     smtp_port: int,
@@ -125,7 +386,9 @@ def reply_to_email_by_md5_uid(
     target_sent_time: str,
     reply_body: str,
     reply_subject: str = "",
-    is_html: bool = False
+    is_html: bool = False,
+    smtp_pool: Optional[SMTPConnectionPool] = None,
+    mailbox_index=None
 ) -> bool:
     """
     通过发送人、邮件标题、发送时间的MD5值作为UID来回复邮件
@@ -145,6 +408,10 @@ def reply_to_email_by_md5_uid(
         reply_body: 回复邮件的正文
         reply_subject: 回复邮件的主题（可选，默认自动生成）
         is_html: 正文是否为HTML格式，默认为False
+        smtp_pool: SMTP连接池（可选），传入时复用池中已登录的连接发送，
+            批量回复时避免每封邮件重复登录；此时忽略smtp_server等SMTP连接参数
+        mailbox_index: 本地邮箱索引（apps_1209.MailboxIndex，可选），传入时先增量同步收件箱，
+            再按MD5 UID查索引并只下载目标邮件；不传时逐封下载收件箱查找
     
     返回:
         bool: 回复是否成功
@@ -156,55 +423,19 @@ def reply_to_email_by_md5_uid(
         # 生成目标邮件的MD5 UID
         target_uid = generate_email_uid(target_from_email, target_subject, target_sent_time)
         
-        # 1. 连接到IMAP服务器并获取所有邮件
+        # 1. 连接到IMAP服务器并查找目标邮件
         with imaplib.IMAP4(imap_server, imap_port) as imap:
             imap.login(imap_username, imap_password)
-            imap.select('INBOX')
-            
-            # 搜索所有邮件
-            result, data = imap.search(None, 'ALL')
-            if result != 'OK':
-                raise Exception("搜索邮件失败")
-            
-            # 获取匹配的邮件
-            matched_msg = None
-            email_ids = data[0].split()
             
-            for e_id in email_ids:
-                # 获取邮件内容
-                result, msg_data = imap.fetch(e_id, '(RFC822)')
-                if result != 'OK':
-                    continue
-                
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
-                
-                # 提取邮件信息
-                msg_from = msg['From'] if msg['From'] else ''
-                msg_to = msg['To'] if msg['To'] else ''
-                msg_cc = msg['Cc'] if msg['Cc'] else ''
-                msg_subject = msg['Subject'] if msg['Subject'] else ''
-                msg_date = msg['Date'] if msg['Date'] else ''
-                
-                # 解析日期格式，统一时间字符串格式
-                try:
-                    # 尝试解析多种日期格式
-                    if msg_date:
-                        date_obj = email.utils.parsedate_to_datetime(msg_date)
-                        # 格式化为统一的时间字符串格式
-                        formatted_date = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        formatted_date = ''
-                except:
-                    formatted_date = msg_date
-                
-                # 生成当前邮件的MD5 UID
-                current_uid = generate_email_uid(msg_from, msg_subject, formatted_date)
-                
-                # 比较UID是否匹配
-                if current_uid == target_uid:
-                    matched_msg = msg
-                    break
+            if mailbox_index is not None:
+                # apps_1209导入了本模块的generate_email_uid，这里延迟导入避免循环导入
+                from apps_1209 import fetch_raw_email_by_md5_uid
+                # 增量同步后一次索引查询和一次FETCH，不需要逐封下载收件箱
+                mailbox_index.sync_folder(imap, 'INBOX')
+                found = fetch_raw_email_by_md5_uid(mailbox_index, imap, target_uid, 'INBOX')
+                matched_msg = email.message_from_bytes(found[1]) if found else None
+            else:
+                matched_msg = _scan_inbox_for_uid(imap, target_uid)
             
             if not matched_msg:
                 raise Exception(f"未找到匹配的邮件，目标UID: {target_uid}")
@@ -281,10 +512,13 @@ def reply_to_email_by_md5_uid(
             else:
                 reply_msg.attach(MIMEText(full_body, 'plain', 'utf-8'))
             
-        # 4. 连接到SMTP服务器并发送回复邮件
-        with smtplib.SMTP(smtp_server, smtp_port) as smtp:
-            smtp.login(smtp_username, smtp_password)
-            smtp.send_message(reply_msg)
+        # 4. 发送回复邮件：有连接池时复用已登录的连接，否则单独连接SMTP服务器
+        if smtp_pool is not None:
+            smtp_pool.send(reply_msg)
+        else:
+            with smtplib.SMTP(smtp_server, smtp_port) as smtp:
+                smtp.login(smtp_username, smtp_password)
+                smtp.send_message(reply_msg)
             
         print(f"邮件回复成功！UID: {target_uid}")
         return True
@@ -1,31 +1,103 @@
 # 编写两个函数一个get_lock一个un_lock, 使用redis执行锁,value为时间戳,字符串格式,过期时间固定10分钟.如果获取到锁,返回True,否则返回False
 
-import redis
+import random
+import threading
 import time
+import uuid
+import zlib
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
+
+import redis
+
+
+# 所有键都空闲时才一次性加锁（全部成功或全部失败），返回0；
+# 否则返回第一个被占用的键的序号（从1开始），用于失败计数
+ACQUIRE_LOCKS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        return i
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('SET', key, ARGV[1], 'PX', ARGV[2])
+end
+return 0
+"""
+
+# 只有持有者（value与token一致）才能释放/续期，避免删除别人的锁；返回处理成功的键数
+RELEASE_LOCK_SCRIPT = """
+local count = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        count = count + redis.call('DEL', key)
+    end
+end
+return count
+"""
+
+EXTEND_LOCK_SCRIPT = """
+local count = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        count = count + redis.call('PEXPIRE', key, ARGV[2])
+    end
+end
+return count
+"""
+
+
+class _HeldLock:
+    """已获取的锁：owner token、同一次获取的所有键和看门狗线程"""
+
+    def __init__(self, token: str, keys: List[str]):
+        self.token = token
+        self.keys = keys
+        self.stop_event = threading.Event()
+        self.watchdog: Optional[threading.Thread] = None
 
 
 class RedisLock:
-    def __init__(self, redis_client: redis.Redis, failure_threshold: int = 5):
+    def __init__(self, redis_client: redis.Redis, failure_threshold: int = 5, expire_time: int = 600,
+                 held_locks: Optional[Dict[str, _HeldLock]] = None):
         """
         初始化Redis锁实例
         
         参数:
             redis_client: Redis客户端实例
             failure_threshold: 失败计数阈值，超过该值触发告警，默认5次
+            expire_time: 锁的过期时间（秒），默认10分钟(600秒)
+            held_locks: 记录已持有锁的字典，默认每个实例独立；独立函数get_lock/un_lock在同一线程内共享一个字典
         """
         self.redis_client = redis_client
-        self.expire_time = 600  # 固定过期时间10分钟(600秒)
+        self.expire_time = expire_time
         self.failure_threshold = failure_threshold
         self.failure_count_prefix = "lock_failure_count:"  # 失败计数键前缀
+        self._held = {} if held_locks is None else held_locks
+        self._held_lock = threading.Lock()
+        self._acquire_script = redis_client.register_script(ACQUIRE_LOCKS_SCRIPT)
+        self._release_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self._extend_script = redis_client.register_script(EXTEND_LOCK_SCRIPT)
+    
+    def _new_lock_value(self) -> str:
+        """锁的value：时间戳（年月日时分，如202312161430）+ 随机owner token"""
+        return f"{datetime.now().strftime('%Y%m%d%H%M')}:{uuid.uuid4().hex}"
     
-    def get_lock(self, lock_key: str) -> bool:
+    def get_lock(self, lock_key: str, blocking: bool = False, timeout: Optional[float] = None,
+                 retry_interval: float = 0.05, max_retry_interval: float = 1.0, watchdog: bool = False) -> bool:
         """
         获取Redis锁
         
+        使用 SET key value NX PX 一条命令原子地加锁并设置过期时间，
+        不会出现加锁成功但过期时间未设置的情况
+        
         参数:
             lock_key: 锁的键名
+            blocking: 是否阻塞等待，默认False（立即返回）
+            timeout: 阻塞等待的最长秒数，None表示一直等待
+            retry_interval: 重试的初始间隔（秒），之后按指数增长并加随机抖动
+            max_retry_interval: 重试间隔上限（秒）
+            watchdog: 是否启动看门狗线程，在释放前每隔过期时间的1/3自动续期，适用于耗时不确定的任务
             
         返回:
             bool: 获取到锁返回True，否则返回False
@@ -33,40 +105,120 @@ class RedisLock:
         异常:
             redis.RedisError: Redis操作失败时抛出异常
         """
-        try:
-            # 生成当前时间字符串（年月日时分秒格式）
-            current_time = datetime.now()
-            # 格式：年月日小时分钟，如202312161430
-            lock_value = current_time.strftime("%Y%m%d%H%M")
+        return self.get_locks([lock_key], blocking, timeout, retry_interval, max_retry_interval, watchdog)
+    
+    def get_locks(self, lock_keys: Iterable[str], blocking: bool = False, timeout: Optional[float] = None,
+                  retry_interval: float = 0.05, max_retry_interval: float = 1.0, watchdog: bool = False) -> bool:
+        """
+        一次获取多个Redis锁（全部成功或全部失败）
+        
+        多个键在一个Lua脚本中检查并加锁，只需一次往返；键按字典序排列，
+        任何调用方以相同顺序处理，不会因加锁顺序不一致而死锁。参数同get_lock。
+        Redis Cluster下多个键必须在同一个slot，需使用相同的hash tag，如 "{order}:1"、"{order}:2"。
+        
+        返回:
+            bool: 全部获取到返回True；任一键被占用则一个都不加锁，返回False
             
-            # 使用SETNX命令获取锁，设置过期时间
-            result = self.redis_client.setnx(lock_key, lock_value)
+        异常:
+            redis.RedisError: Redis操作失败时抛出异常
+        """
+        keys = sorted(set(lock_keys))
+        if not keys:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        busy_key = keys[0]
+        try:
+            while True:
+                lock_value = self._new_lock_value()
+                busy_key = self._try_acquire(keys, lock_value)
+                if busy_key is None:
+                    held = _HeldLock(lock_value, keys)
+                    with self._held_lock:
+                        for key in keys:
+                            self._held[key] = held
+                    if watchdog:
+                        self._start_watchdog(held)
+                    # 成功获取锁后重置失败计数
+                    self._reset_failure_count(*keys)
+                    return True
+                
+                if not blocking:
+                    break
+                # 指数退避 + 全随机抖动，避免大量客户端同时重试
+                sleep_time = random.uniform(0, min(max_retry_interval, retry_interval * (2 ** attempt)))
+                attempt += 1
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    sleep_time = min(sleep_time, remaining)
+                time.sleep(sleep_time)
             
-            if result:
-                # 设置过期时间
-                self.redis_client.expire(lock_key, self.expire_time)
-                # 成功获取锁后重置失败计数
-                self._reset_failure_count(lock_key)
-                return True
-            else:
-                # 失败计数加1
-                failure_count = self._increment_failure_count(lock_key)
-                # 检查是否超过阈值
-                if failure_count >= self.failure_threshold:
-                    self._trigger_alert(lock_key, failure_count)
-                return False
+            # 被占用的键失败计数加1（阻塞等待只在最终失败时计一次）
+            failure_count = self._increment_failure_count(busy_key)
+            # 检查是否超过阈值
+            if failure_count >= self.failure_threshold:
+                self._trigger_alert(busy_key, failure_count)
+            return False
                 
         except redis.RedisError as e:
             print(f"获取锁失败: {str(e)}")
             # Redis操作失败也计入失败次数
             try:
-                failure_count = self._increment_failure_count(lock_key)
+                failure_count = self._increment_failure_count(busy_key)
                 if failure_count >= self.failure_threshold:
-                    self._trigger_alert(lock_key, failure_count)
+                    self._trigger_alert(busy_key, failure_count)
             except:
                 # 忽略告警触发失败的异常
                 pass
             raise
+    
+    def _try_acquire(self, keys: List[str], lock_value: str) -> Optional[str]:
+        """尝试加锁一次，成功返回None，否则返回被占用的键"""
+        ttl_ms = int(self.expire_time * 1000)
+        if len(keys) == 1:
+            if self.redis_client.set(keys[0], lock_value, nx=True, px=ttl_ms):
+                return None
+            return keys[0]
+        busy_index = self._acquire_script(keys=keys, args=[lock_value, ttl_ms])
+        return None if busy_index == 0 else keys[busy_index - 1]
+    
+    def extend(self, lock_key: str, expire_time: Optional[float] = None) -> bool:
+        """
+        续期Redis锁（只有当前持有者才能续期）
+        
+        参数:
+            lock_key: 锁的键名
+            expire_time: 新的过期时间（秒，从现在开始计算），默认使用实例的expire_time
+            
+        返回:
+            bool: 续期成功返回True；未持有该锁或锁已被他人获取返回False
+        """
+        with self._held_lock:
+            held = self._held.get(lock_key)
+        if held is None:
+            return False
+        ttl_ms = int((self.expire_time if expire_time is None else expire_time) * 1000)
+        return bool(self._extend_script(keys=[lock_key], args=[held.token, ttl_ms]))
+    
+    def _start_watchdog(self, held: _HeldLock) -> None:
+        """启动看门狗线程，定期续期，直到释放锁或续期失败（锁已丢失）"""
+        interval = self.expire_time / 3
+        
+        def renew_loop():
+            while not held.stop_event.wait(interval):
+                keys = held.keys
+                try:
+                    if self._extend_script(keys=keys, args=[held.token, int(self.expire_time * 1000)]) < len(keys):
+                        print(f"⚠️ 锁 {', '.join(keys)} 续期失败，锁已过期或被其他客户端持有")
+                        return
+                except redis.RedisError as e:
+                    # 网络抖动时继续尝试，锁在过期前仍然有效
+                    print(f"锁 {', '.join(keys)} 续期出错: {str(e)}")
+        
+        held.watchdog = threading.Thread(target=renew_loop, name=f"lock-watchdog-{held.keys[0]}", daemon=True)
+        held.watchdog.start()
             
     def _increment_failure_count(self, lock_key: str) -> int:
         """
@@ -79,21 +231,21 @@ class RedisLock:
             int: 增加后的失败计数
         """
         failure_count_key = f"{self.failure_count_prefix}{lock_key}"
-        # 使用INCR命令原子增加计数
-        count = self.redis_client.incr(failure_count_key)
-        # 设置失败计数的过期时间为锁过期时间的2倍
-        self.redis_client.expire(failure_count_key, self.expire_time * 2)
+        # 使用INCR命令原子增加计数，过期时间为锁过期时间的2倍，一次往返完成
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.incr(failure_count_key)
+        pipe.expire(failure_count_key, int(self.expire_time * 2))
+        count, _ = pipe.execute()
         return count
         
-    def _reset_failure_count(self, lock_key: str) -> None:
+    def _reset_failure_count(self, *lock_keys: str) -> None:
         """
         重置失败计数
         
         参数:
-            lock_key: 锁的键名
+            lock_keys: 锁的键名
         """
-        failure_count_key = f"{self.failure_count_prefix}{lock_key}"
-        self.redis_client.delete(failure_count_key)
+        self.redis_client.delete(*[f"{self.failure_count_prefix}{lock_key}" for lock_key in lock_keys])
         
     def _trigger_alert(self, lock_key: str, failure_count: int) -> None:
         """
@@ -112,41 +264,132 @@ class RedisLock:
         """
         释放Redis锁
         
+        通过Lua脚本比较token后再删除，锁已过期并被其他客户端获取时不会误删
+        
         参数:
             lock_key: 锁的键名
             
         返回:
-            bool: 释放锁成功返回True，否则返回False
+            bool: 释放锁成功返回True；未持有该锁或锁已被他人获取返回False
+            
+        异常:
+            redis.RedisError: Redis操作失败时抛出异常
+        """
+        return self.un_locks([lock_key])
+    
+    def un_locks(self, lock_keys: Iterable[str]) -> bool:
+        """
+        释放多个Redis锁，同一次get_locks获取的键在一个Lua脚本中释放
+        
+        返回:
+            bool: 全部释放成功返回True；任一键未持有或已被他人获取返回False
             
         异常:
             redis.RedisError: Redis操作失败时抛出异常
         """
+        keys = sorted(set(lock_keys))
+        released_groups = {}
+        with self._held_lock:
+            for key in keys:
+                held = self._held.pop(key, None)
+                if held is not None:
+                    released_groups.setdefault(id(held), (held, []))[1].append(key)
+        
+        all_released = len(keys) > 0 and sum(len(group) for _, group in released_groups.values()) == len(keys)
         try:
-            # 删除锁
-            result = self.redis_client.delete(lock_key)
-            return result > 0
+            for held, group in released_groups.values():
+                remaining = [key for key in held.keys if key not in group]
+                held.keys = remaining
+                if not remaining:
+                    # 全部释放前先停止看门狗，避免释放后又被续期
+                    held.stop_event.set()
+                    if held.watchdog is not None:
+                        held.watchdog.join()
+                if self._release_script(keys=group, args=[held.token]) < len(group):
+                    all_released = False
+            return all_released
             
         except redis.RedisError as e:
             print(f"释放锁失败: {str(e)}")
             # Redis操作失败也计入失败次数
             try:
-                failure_count = self._increment_failure_count(lock_key)
-                if failure_count >= self.failure_threshold:
-                    self._trigger_alert(lock_key, failure_count)
+                for key in keys:
+                    failure_count = self._increment_failure_count(key)
+                    if failure_count >= self.failure_threshold:
+                        self._trigger_alert(key, failure_count)
             except:
                 # 忽略告警触发失败的异常
                 pass
             raise
 
 
-def get_lock(redis_client: redis.Redis, lock_key: str, failure_threshold: int = 5) -> bool:
+class StripedRedisLock:
+    """
+    分段锁：把任意多的逻辑ID（订单号、用户ID等）按哈希映射到固定数量的锁键上
+    
+    Redis中最多只有stripes个锁键，代价是不同ID可能落在同一段上而互相等待。
+    使用zlib.crc32而不是内置hash，保证不同进程对同一ID得到同一个锁键。
+    同一实例内的锁不可重入：两个ID落在同一段时，应该用get_locks一次获取。
+    """
+
+    def __init__(self, redis_client: redis.Redis, name: str, stripes: int = 1024, **lock_kwargs):
+        """
+        参数:
+            redis_client: Redis客户端实例
+            name: 锁名称，锁键为 "{name}:stripe:{段号}"
+            stripes: 分段数量，默认1024
+            lock_kwargs: 传给RedisLock的参数，如failure_threshold、expire_time
+        """
+        if stripes <= 0:
+            raise ValueError("stripes必须大于0")
+        self.name = name
+        self.stripes = stripes
+        self.lock = RedisLock(redis_client, **lock_kwargs)
+    
+    def stripe_key(self, resource_id) -> str:
+        """逻辑ID对应的锁键"""
+        stripe = zlib.crc32(str(resource_id).encode('utf-8')) % self.stripes
+        return f"{self.name}:stripe:{stripe}"
+    
+    def get_lock(self, resource_id, **kwargs) -> bool:
+        """获取逻辑ID对应的分段锁，参数同RedisLock.get_lock"""
+        return self.lock.get_lock(self.stripe_key(resource_id), **kwargs)
+    
+    def un_lock(self, resource_id) -> bool:
+        return self.lock.un_lock(self.stripe_key(resource_id))
+    
+    def get_locks(self, resource_ids: Iterable, **kwargs) -> bool:
+        """一次获取多个逻辑ID对应的分段锁（去重后全部成功或全部失败）"""
+        return self.lock.get_locks({self.stripe_key(resource_id) for resource_id in resource_ids}, **kwargs)
+    
+    def un_locks(self, resource_ids: Iterable) -> bool:
+        return self.lock.un_locks({self.stripe_key(resource_id) for resource_id in resource_ids})
+
+
+# 独立函数get_lock/un_lock每次创建新的RedisLock实例，按线程保存已持有的锁，
+# un_lock时只能找到本线程get_lock时的owner token，其他线程不能释放这把锁
+_function_locks = threading.local()
+
+
+def _thread_held_locks() -> Dict[str, _HeldLock]:
+    """当前线程通过独立函数持有的锁"""
+    held = getattr(_function_locks, 'held', None)
+    if held is None:
+        held = _function_locks.held = {}
+    return held
+
+
+def get_lock(redis_client: redis.Redis, lock_key: str, failure_threshold: int = 5, **lock_kwargs) -> bool:
     """
     获取Redis锁的独立函数
     
+    锁属于调用线程，需要在同一线程中调用un_lock释放
+    
     参数:
         redis_client: Redis客户端实例
         lock_key: 锁的键名
         failure_threshold: 失败计数阈值，超过该值触发告警，默认5次
+        lock_kwargs: 传给RedisLock.get_lock的参数，如blocking、timeout、watchdog
         
     返回:
         bool: 获取到锁返回True，否则返回False
@@ -154,29 +397,141 @@ def get_lock(redis_client: redis.Redis, lock_key: str, failure_threshold: int =
     异常:
         redis.RedisError: Redis操作失败时抛出异常
     """
-    lock = RedisLock(redis_client, failure_threshold)
-    return lock.get_lock(lock_key)
+    lock = RedisLock(redis_client, failure_threshold, held_locks=_thread_held_locks())
+    return lock.get_lock(lock_key, **lock_kwargs)
 
 
 def un_lock(redis_client: redis.Redis, lock_key: str, failure_threshold: int = 5) -> bool:
     """
     释放Redis锁的独立函数
     
+    只能释放本线程通过get_lock获取的锁。在其他线程或其他进程中调用（例如由另一个进程负责解锁）
+    会返回False且不删除锁，锁在过期后自动释放；需要跨线程传递锁时请共享同一个RedisLock实例
+    
     参数:
         redis_client: Redis客户端实例
         lock_key: 锁的键名
         failure_threshold: 失败计数阈值，超过该值触发告警，默认5次
         
     返回:
-        bool: 释放锁成功返回True，否则返回False
+        bool: 释放锁成功返回True；本线程未持有该锁或锁已被他人获取返回False
         
     异常:
         redis.RedisError: Redis操作失败时抛出异常
     """
-    lock = RedisLock(redis_client, failure_threshold)
+    lock = RedisLock(redis_client, failure_threshold, held_locks=_thread_held_locks())
     return lock.un_lock(lock_key)
 
 
+class InMemoryRedis:
+    """
+    本地Redis替身（线程安全），实现锁用到的命令：SET NX PX、GET、DELETE、INCR、EXPIRE、PEXPIRE，
+    以及本模块Lua脚本的等价Python实现，用于不依赖Redis服务的并发测试
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expire_at = {}
+        self._lock = threading.RLock()
+        self._scripts = {
+            ACQUIRE_LOCKS_SCRIPT: self._acquire_locks,
+            RELEASE_LOCK_SCRIPT: self._release_lock,
+            EXTEND_LOCK_SCRIPT: self._extend_lock,
+        }
+
+    def _alive(self, key):
+        expire_at = self._expire_at.get(key)
+        if expire_at is not None and time.monotonic() >= expire_at:
+            self._data.pop(key, None)
+            self._expire_at.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key) if self._alive(key) else None
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = value
+            self._expire_at.pop(key, None)
+            if px is not None:
+                self._expire_at[key] = time.monotonic() + px / 1000
+            elif ex is not None:
+                self._expire_at[key] = time.monotonic() + ex
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                if self._alive(key):
+                    del self._data[key]
+                    self._expire_at.pop(key, None)
+                    deleted += 1
+            return deleted
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data[key]) + 1 if self._alive(key) else 1
+            self._data[key] = str(value)
+            return value
+
+    def expire(self, key, seconds):
+        return self.pexpire(key, int(seconds * 1000))
+
+    def pexpire(self, key, milliseconds):
+        with self._lock:
+            if not self._alive(key):
+                return 0
+            self._expire_at[key] = time.monotonic() + int(milliseconds) / 1000
+            return 1
+
+    def pipeline(self, transaction=True):
+        return _InMemoryPipeline(self)
+
+    def register_script(self, script):
+        func = self._scripts[script]
+
+        def run(keys=(), args=(), client=None):
+            with self._lock:
+                return func(list(keys), list(args))
+        return run
+
+    def _acquire_locks(self, keys, args):
+        for i, key in enumerate(keys, 1):
+            if self._alive(key):
+                return i
+        for key in keys:
+            self.set(key, args[0], px=int(args[1]))
+        return 0
+
+    def _release_lock(self, keys, args):
+        return sum(self.delete(key) for key in keys if self.get(key) == args[0])
+
+    def _extend_lock(self, keys, args):
+        return sum(self.pexpire(key, args[1]) for key in keys if self.get(key) == args[0])
+
+
+class _InMemoryPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client._lock:
+            results = [func(*args, **kwargs) for func, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
 # 示例用法
 if __name__ == "__main__":
     try:
@@ -245,6 +600,24 @@ if __name__ == "__main__":
                 print("\n3. 使用独立函数: 释放锁失败！")
         else:
             print("使用独立函数: 获取锁失败！")
+        
+        # 阻塞获取（指数退避+随机抖动）与看门狗自动续期
+        print("\n=== 测试阻塞获取与看门狗续期 ===")
+        watchdog_lock = RedisLock(redis_client, expire_time=2)
+        if watchdog_lock.get_lock("test_watchdog_lock", blocking=True, timeout=5, watchdog=True):
+            time.sleep(5)  # 任务耗时超过过期时间，由看门狗续期
+            print(f"1. 5秒后锁仍然持有: {redis_client.get('test_watchdog_lock') is not None}")
+            print(f"2. 释放锁: {watchdog_lock.un_lock('test_watchdog_lock')}")
+        
+        # 多键加锁与分段锁
+        print("\n=== 测试多键加锁与分段锁 ===")
+        multi_lock = RedisLock(redis_client)
+        print(f"1. 一次获取3个资源锁: {multi_lock.get_locks(['res:a', 'res:b', 'res:c'])}")
+        print(f"2. 一次释放3个资源锁: {multi_lock.un_locks(['res:a', 'res:b', 'res:c'])}")
+        order_lock = StripedRedisLock(redis_client, 'order', stripes=256)
+        print(f"3. 订单10086对应的锁键: {order_lock.stripe_key(10086)}")
+        if order_lock.get_lock(10086):
+            print(f"4. 释放订单锁: {order_lock.un_lock(10086)}")
             
     except redis.RedisError as e:
         print(f"示例运行失败: {str(e)}")
@@ -1,11 +1,349 @@
 # 使用kafka读取topic数据,是否使用group读取编写函数demo
-from kafka import KafkaConsumer
+from kafka import KafkaConsumer, TopicPartition
+from kafka.structs import OffsetAndMetadata
 import json
+import logging
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _build_consumer_config(bootstrap_servers, group_id, auto_offset_reset, enable_auto_commit, **kwargs):
+    """生成KafkaConsumer配置，JSON反序列化value、UTF-8反序列化key"""
+    consumer_config = {
+        'bootstrap_servers': bootstrap_servers,
+        'auto_offset_reset': auto_offset_reset,
+        'enable_auto_commit': enable_auto_commit,
+        'value_deserializer': lambda x: json.loads(x.decode('utf-8')) if x else None,
+        'key_deserializer': lambda x: x.decode('utf-8') if x else None,
+        **kwargs
+    }
+    
+    # 如果提供了group_id，则添加到配置中
+    if group_id is not None:
+        consumer_config['group_id'] = group_id
+    return consumer_config
+
+
+def _to_msg_info(message):
+    """把ConsumerRecord转换为消息字典"""
+    return {
+        'topic': message.topic,
+        'partition': message.partition,
+        'offset': message.offset,
+        'key': message.key,
+        'value': message.value,
+        'timestamp': message.timestamp
+    }
+
+
+def _offset_and_metadata(offset):
+    """兼容不同kafka-python版本的OffsetAndMetadata（2.1起增加了leader_epoch字段）"""
+    try:
+        return OffsetAndMetadata(offset, None, -1)
+    except TypeError:
+        return OffsetAndMetadata(offset, None)
+
+
+def _has_group(consumer):
+    """消费者是否属于消费组；kafka-python不使用group时不能查询或提交偏移量（committed/commit会直接报错）"""
+    config = getattr(consumer, 'config', None)
+    return config is None or config.get('group_id') is not None
+
+
+def compute_consumer_lag(consumer):
+    """
+    计算消费者已分配分区的lag：分区末尾offset - 已提交offset
+    （未提交或不使用group时按当前位置计算，即已拉取但未消费的消息不计入）
+    
+    返回:
+        dict: {"topic[分区]": lag}
+    """
+    partitions = list(consumer.assignment())
+    if not partitions:
+        return {}
+    end_offsets = consumer.end_offsets(partitions)
+    has_group = _has_group(consumer)
+    lag = {}
+    for tp in partitions:
+        committed = consumer.committed(tp) if has_group else None
+        if committed is None:
+            committed = consumer.position(tp)
+        lag[f"{tp.topic}[{tp.partition}]"] = max(end_offsets.get(tp, 0) - committed, 0)
+    return lag
+
+
+def consume_kafka_batches(bootstrap_servers, topic, group_id=None, auto_offset_reset='earliest',
+                          max_records=500, poll_timeout_ms=1000, stop_at_end=False,
+                          idle_timeout_ms=None, consumer=None, metrics=None, on_poll=None, **consumer_kwargs):
+    """
+    以批次方式消费Kafka topic的生成器，内存中只保留当前批次
+
+    每次通过 poll(max_records=...) 拉取一批消息，产出 (records, commit)：
+    - records: 消息字典列表，格式与consume_kafka_topic返回的元素相同，同一分区内按offset有序
+    - commit: 提交本批次偏移量的函数，调用方处理完本批次后调用，实现至少一次消费；
+      也可以传入 {TopicPartition: 下一个offset} 提交指定位置；
+      不使用group时（包括传入的consumer没有group_id）没有可提交的位置，commit为空操作
+
+    参数:
+        bootstrap_servers (str or list): Kafka服务器地址
+        topic (str): 要消费的topic名称
+        group_id (str, optional): 消费者组ID，提供时使用subscribe，否则直接assign全部分区
+        auto_offset_reset (str, optional): 偏移量重置策略，默认'earliest'
+        max_records (int, optional): 每批最多消息数，默认500
+        poll_timeout_ms (int, optional): 单次poll的等待时间（毫秒），默认1000
+        stop_at_end (bool, optional): 是否在消费到分区末尾时停止（以开始消费时的末尾偏移量为准），
+            用于数据回放任务
+        idle_timeout_ms (int, optional): 连续多久没有新消息时停止，默认None表示一直消费
+        consumer (KafkaConsumer, optional): 已创建并订阅/分配好分区的消费者实例（例如测试用的模拟消费者），
+            提供时忽略连接参数，且不会在结束时关闭
+        metrics (KafkaMetrics, optional): 指标统计器（见 kafka_metrics.py），记录每批消息数、字节数、
+            调用方处理每批的耗时，并在上报时计算各分区lag
+        on_poll (callable, optional): 每次poll之前在消费线程中调用，参数为消费者实例，
+            可用于pause/resume分区；返回False时停止消费
+        **consumer_kwargs: 其他KafkaConsumer参数
+
+    产出:
+        tuple: (records, commit)
+    """
+    owns_consumer = consumer is None
+    if owns_consumer:
+        consumer = KafkaConsumer(**_build_consumer_config(
+            bootstrap_servers, group_id, auto_offset_reset, False, **consumer_kwargs))
+        if group_id is not None:
+            consumer.subscribe([topic])
+        else:
+            partitions = consumer.partitions_for_topic(topic) or set()
+            consumer.assign([TopicPartition(topic, p) for p in sorted(partitions)])
+    can_commit = _has_group(consumer)
+    
+    end_offsets = None
+    last_message_time = time.monotonic()
+    if metrics is not None:
+        metrics.set_lag_provider(lambda: compute_consumer_lag(consumer))
+    try:
+        while True:
+            if metrics is not None:
+                metrics.maybe_report()
+            if on_poll is not None and on_poll(consumer) is False:
+                return
+            polled = consumer.poll(timeout_ms=poll_timeout_ms, max_records=max_records)
+            
+            records = []
+            next_offsets = {}
+            batch_bytes = 0
+            for tp in sorted(polled, key=lambda tp: (tp.topic, tp.partition)):
+                for message in polled[tp]:
+                    records.append(_to_msg_info(message))
+                    next_offsets[tp] = message.offset + 1
+                    if metrics is not None:
+                        batch_bytes += max(getattr(message, 'serialized_value_size', 0), 0)
+            
+            if records:
+                last_message_time = time.monotonic()
+                
+                def commit(offsets=None, _batch_offsets=next_offsets):
+                    offsets = offsets if offsets is not None else _batch_offsets
+                    if can_commit:
+                        consumer.commit({tp: _offset_and_metadata(offset) for tp, offset in offsets.items()})
+                
+                batch_start = time.monotonic()
+                yield records, commit
+                if metrics is not None:
+                    metrics.record_batch('consumed', len(records), batch_bytes, time.monotonic() - batch_start)
+            elif on_poll is not None and consumer.paused():
+                # 有分区被暂停时没有新消息是正常的，不计入空闲时间
+                last_message_time = time.monotonic()
+            elif idle_timeout_ms is not None and (time.monotonic() - last_message_time) * 1000 >= idle_timeout_ms:
+                logger.info(f"超过 {idle_timeout_ms} 毫秒没有新消息，停止消费")
+                return
+            
+            if stop_at_end:
+                assignment = consumer.assignment()
+                if not assignment:
+                    continue
+                if end_offsets is None:
+                    # 以首次分配到分区时的末尾偏移量为准，之后写入的消息不在本次回放范围内
+                    end_offsets = consumer.end_offsets(list(assignment))
+                if all(consumer.position(tp) >= end_offsets.get(tp, 0) for tp in assignment):
+                    logger.info(f"已消费到所有分区末尾，停止消费: {topic}")
+                    return
+    finally:
+        if metrics is not None:
+            # 结束时上报最后一个窗口
+            metrics.report()
+            metrics.set_lag_provider(None)
+        if owns_consumer:
+            consumer.close()
+
+
+class _PartitionLanes:
+    """
+    按分区串行、分区之间并行地执行处理函数
+
+    每个分区一个待处理队列，同一时间最多一个线程处理某个分区，因此分区内严格按offset顺序处理；
+    每处理完一条消息就推进该分区的已完成位置，提交时只会提交连续处理完的位置
+
+    处理函数在本进程的线程池中执行，受GIL限制，只有I/O密集的处理函数（网络请求、写数据库等）能并行；
+    CPU密集的处理需要启动多个进程，每个进程一个消费者，由消费组在进程之间分配分区
+    """
+
+    def __init__(self, handler, max_workers):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='partition')
+        self.cond = threading.Condition()
+        self.queues = {}
+        self.active = set()
+        self.pending = 0
+        # 分区 -> 下一个待提交的offset（即已连续处理完的最后一条offset + 1）
+        self.done_offsets = {}
+        self.processed = 0
+        self.error = None
+
+    def submit(self, records):
+        with self.cond:
+            for record in records:
+                tp = TopicPartition(record['topic'], record['partition'])
+                self.queues.setdefault(tp, []).append(record)
+                self.pending += 1
+            idle = [tp for tp in self.queues if self.queues[tp] and tp not in self.active]
+            self.active.update(idle)
+        for tp in idle:
+            self.executor.submit(self._drain, tp)
+
+    def _drain(self, tp):
+        while True:
+            with self.cond:
+                queue = self.queues.get(tp)
+                if not queue or self.error is not None:
+                    self.active.discard(tp)
+                    self.cond.notify_all()
+                    return
+                record = queue.pop(0)
+            try:
+                self.handler(record)
+            except Exception as e:
+                logger.exception(f"处理消息失败: {tp.topic}[{tp.partition}]@{record['offset']}")
+                with self.cond:
+                    # 出错后停止所有分区的处理，失败消息及之后的消息都不会提交
+                    self.error = e
+                    self.active.discard(tp)
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.done_offsets[tp] = record['offset'] + 1
+                self.processed += 1
+                self.pending -= 1
+                self.cond.notify_all()
+
+    def busy_partitions(self):
+        """返回还有消息未处理完的分区"""
+        with self.cond:
+            return {tp for tp, queue in self.queues.items() if queue} | self.active
+
+    def wait_idle(self):
+        """等待所有分区处理完毕或出错停止"""
+        with self.cond:
+            self.cond.wait_for(lambda: not self.active)
+
+    def committable(self, committed):
+        """返回相对于已提交位置有推进的分区偏移量"""
+        with self.cond:
+            return {tp: offset for tp, offset in self.done_offsets.items() if committed.get(tp) != offset}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def consume_kafka_parallel(bootstrap_servers, topic, handler, group_id=None, max_workers=4,
+                           max_pending=10000, commit_interval=5.0, **batch_kwargs):
+    """
+    按分区并行消费Kafka topic：每个分区的消息交给线程池串行处理，不同分区并行处理
+
+    偏移量由本函数提交：某个分区只有在之前的消息都处理完后才会提交对应位置，
+    处理函数抛出异常时停止消费，只提交异常之前已处理完的位置，保证至少一次语义。
+    消费组再均衡时不做特殊处理，已分配给其他消费者的分区可能会被重复处理。
+
+    处理线程与消费者在同一进程中（见_PartitionLanes），只适合I/O密集的处理函数。
+    未处理消息过多时不会阻塞poll（阻塞超过max.poll.interval.ms会被移出消费组），
+    而是pause仍有积压的分区，继续poll其余分区，积压降下来后再resume。
+
+    参数:
+        bootstrap_servers (str or list): Kafka服务器地址
+        topic (str): 要消费的topic名称
+        handler (callable): 处理单条消息的函数，参数为消息字典
+        group_id (str, optional): 消费者组ID
+        max_workers (int, optional): 处理线程数，默认4（超过分区数没有意义）
+        max_pending (int, optional): 已拉取但未处理的最大消息数，超过时暂停拉取有积压的分区，默认10000
+        commit_interval (float, optional): 提交偏移量的最小间隔（秒），默认5秒
+        **batch_kwargs: 传递给consume_kafka_batches的参数，如 stop_at_end、consumer、max_records
+
+    返回:
+        dict: {'processed': 处理成功的消息数, 'committed': {分区: 已提交offset}}
+
+    异常:
+        处理函数抛出的第一个异常（已完成的偏移量提交之后重新抛出）
+    """
+    lanes = _PartitionLanes(handler, max_workers)
+    committed = {}
+    last_commit = time.monotonic()
+    
+    def commit_done(commit):
+        offsets = lanes.committable(committed)
+        if offsets:
+            commit(offsets)
+            committed.update(offsets)
+    
+    paused = set()
+    
+    def throttle(consumer):
+        # 在消费线程中执行（KafkaConsumer不是线程安全的），出错时停止拉取
+        if lanes.error is not None:
+            return False
+        if lanes.pending >= max_pending:
+            busy = (lanes.busy_partitions() & consumer.assignment()) - paused
+            if busy:
+                consumer.pause(*busy)
+                paused.update(busy)
+        elif paused:
+            # 再均衡后已不属于本消费者的分区不能resume
+            consumer.resume(*(paused & consumer.assignment()))
+            paused.clear()
+    
+    commit = None
+    batches = consume_kafka_batches(bootstrap_servers, topic, group_id=group_id, on_poll=throttle, **batch_kwargs)
+    try:
+        for records, batch_commit in batches:
+            # 复用生成器提供的提交函数，传入按分区计算的可提交位置
+            commit = batch_commit
+            lanes.submit(records)
+            if lanes.error is not None:
+                break
+            if time.monotonic() - last_commit >= commit_interval:
+                commit_done(commit)
+                last_commit = time.monotonic()
+        
+        lanes.wait_idle()
+        if commit is not None:
+            commit_done(commit)
+    finally:
+        lanes.shutdown()
+        # 关闭生成器（由生成器创建的消费者随之关闭）
+        batches.close()
+    
+    if lanes.error is not None:
+        raise lanes.error
+    
+    logger.info(f"并行消费完成: 处理 {lanes.processed} 条消息, 已提交 {committed}")
+    return {'processed': lanes.processed, 'committed': committed}
 
 
 def consume_kafka_topic(bootstrap_servers, topic, group_id=None, auto_offset_reset='latest',
-                         enable_auto_commit=False, consumer_timeout_ms=10000):
+                         enable_auto_commit=False, consumer_timeout_ms=10000,
+                         collect_messages=True, print_messages=True, consumer=None, metrics=None):
     """
     使用Kafka消费者读取topic数据，支持使用或不使用consumer group
     
@@ -19,34 +357,38 @@ def consume_kafka_topic(bootstrap_servers, topic, group_id=None, auto_offset_res
             默认值为 'latest'
         enable_auto_commit (bool, optional): 是否自动提交偏移量，默认False
         consumer_timeout_ms (int, optional): 消费者超时时间（毫秒），超时后停止消费，默认10秒
+        collect_messages (bool, optional): 是否把消息保存到返回列表中，默认True；
+            消费大topic时设为False，内存占用不随消息数增长（需要逐批处理请使用consume_kafka_batches）
+        print_messages (bool, optional): 是否打印每条消息，默认True
+        consumer (KafkaConsumer, optional): 已创建并订阅好topic的消费者实例（例如测试用的模拟消费者），
+            提供时忽略连接参数，且不会在结束时关闭
+        metrics (KafkaMetrics, optional): 指标统计器（见 kafka_metrics.py），记录消费条数、字节数和错误数，
+            并在上报时计算各分区lag
     
     返回:
-        list: 消费到的消息列表，每个元素包含topic、partition、offset、key、value等信息
+        list: 消费到的消息列表，每个元素包含topic、partition、offset、key、value等信息；
+            collect_messages为False时返回空列表
     
     异常:
         KafkaError: Kafka相关错误
         Exception: 其他未知错误
     """
+    owns_consumer = consumer is None
     try:
-        # 配置消费者参数
-        consumer_config = {
-            'bootstrap_servers': bootstrap_servers,
-            'auto_offset_reset': auto_offset_reset,
-            'enable_auto_commit': enable_auto_commit,
-            'consumer_timeout_ms': consumer_timeout_ms,
-            'value_deserializer': lambda x: json.loads(x.decode('utf-8')) if x else None,
-            'key_deserializer': lambda x: x.decode('utf-8') if x else None
-        }
-        
-        # 如果提供了group_id，则添加到配置中
-        if group_id is not None:
-            consumer_config['group_id'] = group_id
-        
-        # 创建消费者实例
-        consumer = KafkaConsumer(**consumer_config)
-        
-        # 订阅topic
-        consumer.subscribe([topic])
+        if owns_consumer:
+            # 配置消费者参数
+            consumer_config = _build_consumer_config(
+                bootstrap_servers, group_id, auto_offset_reset, enable_auto_commit,
+                consumer_timeout_ms=consumer_timeout_ms
+            )
+            
+            # 创建消费者实例
+            consumer = KafkaConsumer(**consumer_config)
+            
+            # 订阅topic
+            consumer.subscribe([topic])
+        if metrics is not None:
+            metrics.set_lag_provider(lambda: compute_consumer_lag(consumer))
         
         print(f"{'使用Group ID' if group_id else '不使用Group ID'}消费Kafka主题: {topic}")
         print(f"Kafka服务器: {bootstrap_servers}")
@@ -54,39 +396,45 @@ def consume_kafka_topic(bootstrap_servers, topic, group_id=None, auto_offset_res
         print("开始消费消息...")
         
         consumed_messages = []
+        consumed_count = 0
         
         # 开始消费消息
         for message in consumer:
-            # 格式化消息信息
-            msg_info = {
-                'topic': message.topic,
-                'partition': message.partition,
-                'offset': message.offset,
-                'key': message.key,
-                'value': message.value,
-                'timestamp': message.timestamp
-            }
+            consumed_count += 1
+            if metrics is not None:
+                metrics.record_batch('consumed', 1, max(getattr(message, 'serialized_value_size', 0), 0))
+                metrics.maybe_report()
             
-            consumed_messages.append(msg_info)
+            if collect_messages:
+                # 格式化消息信息
+                consumed_messages.append(_to_msg_info(message))
             
-            # 打印消费到的消息
-            print(f"\n消费到消息:")
-            print(f"  Topic: {message.topic}")
-            print(f"  Partition: {message.partition}")
-            print(f"  Offset: {message.offset}")
-            print(f"  Key: {message.key}")
-            print(f"  Value: {message.value}")
-            print(f"  Timestamp: {message.timestamp}")
-            
-        # 关闭消费者
-        consumer.close()
+            if print_messages:
+                # 打印消费到的消息
+                print(f"\n消费到消息:")
+                print(f"  Topic: {message.topic}")
+                print(f"  Partition: {message.partition}")
+                print(f"  Offset: {message.offset}")
+                print(f"  Key: {message.key}")
+                print(f"  Value: {message.value}")
+                print(f"  Timestamp: {message.timestamp}")
         
-        print(f"\n消费完成，共消费 {len(consumed_messages)} 条消息")
+        print(f"\n消费完成，共消费 {consumed_count} 条消息")
         return consumed_messages
         
     except Exception as e:
+        if metrics is not None:
+            metrics.record_error('consumed')
         print(f"消费消息时发生错误: {str(e)}")
         raise
+    finally:
+        if metrics is not None:
+            # 结束时上报最后一个窗口
+            metrics.report()
+            metrics.set_lag_provider(None)
+        # 关闭消费者
+        if owns_consumer and consumer is not None:
+            consumer.close()
 
 
 def consume_kafka_topic_group_mode(bootstrap_servers, topic, group_id, **kwargs):
@@ -120,6 +468,92 @@ def consume_kafka_topic_no_group_mode(bootstrap_servers, topic, **kwargs):
     return consume_kafka_topic(bootstrap_servers, topic, group_id=None, **kwargs)
 
 
+Record = namedtuple('Record', ['topic', 'partition', 'offset', 'key', 'value', 'timestamp'])
+
+
+class InMemoryKafkaConsumer:
+    """
+    内存中的模拟Kafka消费者，实现consume_kafka_batches用到的接口，用于测试和演示
+
+    参数:
+        topic: topic名称
+        partitions: {分区号: 消息value列表}
+        group_id: 消费者组ID，为None时与kafka-python一样不能查询或提交偏移量
+    """
+    def __init__(self, topic, partitions, group_id='in-memory'):
+        self.config = {'group_id': group_id}
+        self.data = {
+            TopicPartition(topic, p): [Record(topic, p, offset, None, value, 0) for offset, value in enumerate(values)]
+            for p, values in partitions.items()
+        }
+        self.positions = {tp: 0 for tp in self.data}
+        self.paused_partitions = set()
+        self.poll_count = 0
+        self.committed_offsets = {}
+        self.commit_history = []
+        self._lock = threading.Lock()
+    
+    def poll(self, timeout_ms=0, max_records=500):
+        """从各分区轮流取消息，每次最多max_records条"""
+        result = {}
+        with self._lock:
+            self.poll_count += 1
+            remaining = max_records
+            for tp, records in self.data.items():
+                if remaining <= 0:
+                    break
+                if tp in self.paused_partitions:
+                    continue
+                start = self.positions[tp]
+                chunk = records[start:start + remaining]
+                if chunk:
+                    result[tp] = chunk
+                    self.positions[tp] += len(chunk)
+                    remaining -= len(chunk)
+        return result
+    
+    def assignment(self):
+        return set(self.data)
+    
+    def pause(self, *partitions):
+        self.paused_partitions.update(partitions)
+    
+    def resume(self, *partitions):
+        self.paused_partitions.difference_update(partitions)
+    
+    def paused(self):
+        return set(self.paused_partitions)
+    
+    def end_offsets(self, partitions):
+        return {tp: len(self.data[tp]) for tp in partitions}
+    
+    def position(self, tp):
+        return self.positions[tp]
+    
+    def committed(self, tp):
+        assert self.config['group_id'] is not None, 'Requires group_id'
+        return self.committed_offsets.get(tp)
+    
+    def commit(self, offsets):
+        assert self.config['group_id'] is not None, 'Requires group_id'
+        with self._lock:
+            for tp, meta in offsets.items():
+                self.committed_offsets[tp] = meta.offset
+            self.commit_history.append({tp: meta.offset for tp, meta in offsets.items()})
+    
+    def __iter__(self):
+        """逐条产出消息，消费到所有分区末尾时结束（相当于KafkaConsumer的consumer_timeout_ms到期）"""
+        while True:
+            polled = self.poll(max_records=1)
+            if not polled:
+                return
+            for records in polled.values():
+                yield from records
+    
+    def close(self):
+        pass
+
+
 # 示例用法
 if __name__ == "__main__":
     # Kafka服务器地址
@@ -163,6 +597,39 @@ if __name__ == "__main__":
         print(f"错误: {str(e)}")
         print("请确保Kafka服务器正在运行且topic存在")
     
+    # 示例3: 批量拉取，处理完一批后手动提交偏移量，消费到分区末尾时停止
+    print("\n3. 批量拉取并手动提交偏移量:")
+    print("-" * 40)
+    try:
+        total = 0
+        for records, commit in consume_kafka_batches(
+            bootstrap_servers=bootstrap_servers,
+            topic=topic,
+            group_id='replay_group',
+            max_records=500,
+            stop_at_end=True
+        ):
+            # 在这里处理本批次消息，处理成功后再提交
+            total += len(records)
+            commit()
+        print(f"回放完成，共处理 {total} 条消息")
+    except Exception as e:
+        print(f"错误: {str(e)}")
+        print("请确保Kafka服务器正在运行且topic存在")
+    
+    # 示例4: 按分区并行处理（使用内存模拟消费者）
+    print("\n4. 按分区并行处理:")
+    print("-" * 40)
+    fake_consumer = InMemoryKafkaConsumer('demo_topic', {p: list(range(1000)) for p in range(4)})
+    result = consume_kafka_parallel(
+        None, 'demo_topic',
+        handler=lambda record: time.sleep(0.0005),
+        max_workers=4,
+        consumer=fake_consumer,
+        stop_at_end=True
+    )
+    print(f"并行处理完成: 共处理 {result['processed']} 条消息, 已提交偏移量 {fake_consumer.committed_offsets}")
+    
     print("\n" + "=" * 60)
     print("示例执行完成")
     print("=" * 60)
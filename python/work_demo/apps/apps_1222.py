@@ -7,51 +7,102 @@
 #         kafka.send(_topic, _value[i:i+100])
 
 import logging
-from typing import Dict, List, Any
+import time
+from itertools import islice
+from typing import Dict, List, Any, Iterable, Iterator
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def iter_batches(messages: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """
+    从任意可迭代对象（列表、生成器、数据库游标等）中按需取出批次
+
+    每次只在内存中保留一个批次
+    """
+    iterator = iter(messages)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def send_with_backpressure(kafka_producer, topic: str, message: Any,
+                           max_wait: float = 30.0, backoff: float = 0.05) -> None:
+    """
+    发送单条消息，生产者缓冲区满时先flush/等待再重试（背压）
+
+    缓冲区满的判断：confluent-kafka等生产者在本地队列满时抛出BufferError；
+    kafka-python的send在缓冲区满时会自行阻塞最多max_block_ms
+
+    异常:
+        BufferError: 等待超过max_wait秒后缓冲区仍然是满的
+    """
+    deadline = time.monotonic() + max_wait
+    while True:
+        try:
+            kafka_producer.send(topic, message)
+            return
+        except BufferError:
+            if time.monotonic() >= deadline:
+                raise
+            logger.debug(f"topic {topic} 生产者缓冲区已满，等待消息发出")
+            # 先把已缓冲的消息发出去，再短暂等待
+            kafka_producer.flush()
+            time.sleep(backoff)
+
+
 def batch_send_to_kafka(
-    data_dict: Dict[str, List[Any]],
+    data_dict: Dict[str, Iterable[Any]],
     kafka_producer,
     max_batch_size: int = 100
-) -> None:
+) -> Dict[str, int]:
     """
     分批将数据发送到Kafka
     
     参数:
-        data_dict: 数据字典，键为topic后缀，值为要发送的数据列表
+        data_dict: 数据字典，键为topic后缀，值为要发送的数据，
+            可以是列表，也可以是生成器等任意可迭代对象（按批次惰性读取，内存占用恒定）
         kafka_producer: Kafka生产者实例，需要实现send和flush方法
         max_batch_size: 每批次最大发送数量，默认100
+    
+    返回:
+        Dict: 每个topic成功发送的条数
     """
+    sent_counts = {}
     for _key, _value in data_dict.items():
         _topic = f"topic_{_key}"
-        logger.info(f"处理topic {_topic}，共 {len(_value)} 条数据")
-        
-        if not _value:
-            logger.info(f"topic {_topic} 没有数据需要发送")
-            continue
+        sent_counts[_topic] = 0
+        logger.info(f"处理topic {_topic}")
         
         # 分批发送
-        for i in range(0, len(_value), max_batch_size):
-            batch = _value[i:i+max_batch_size]
-            batch_start = i + 1
-            batch_end = min(i + max_batch_size, len(_value))
+        batch_start = 1
+        for batch in iter_batches(_value, max_batch_size):
+            batch_end = batch_start + len(batch) - 1
             logger.info(f"发送topic {_topic} 的第 {batch_start}-{batch_end} 条数据")
             
             try:
                 # KafkaProducer.send不支持批量发送，需要循环发送单条消息
                 for message in batch:
-                    kafka_producer.send(_topic, message)
+                    send_with_backpressure(kafka_producer, _topic, message)
                 
                 # 调用flush确保消息被立即发送，避免消息积压
                 kafka_producer.flush()
                 
+                sent_counts[_topic] += len(batch)
                 logger.info(f"成功发送topic {_topic} 的第 {batch_start}-{batch_end} 条数据")
             except Exception as e:
                 logger.error(f"发送topic {_topic} 的第 {batch_start}-{batch_end} 条数据失败: {str(e)}")
+            batch_start = batch_end + 1
+        
+        if batch_start == 1:
+            logger.info(f"topic {_topic} 没有数据需要发送")
+        else:
+            logger.info(f"topic {_topic} 共发送 {sent_counts[_topic]}/{batch_start - 1} 条数据")
+    
+    return sent_counts
 
 
 # 模拟Kafka生产者类，用于测试
@@ -71,14 +122,29 @@ class MockKafkaProducer:
     """
     模拟Kafka生产者，用于测试批量发送功能
     """
-    def __init__(self):
+    def __init__(self, max_buffer: int = 0, keep_messages: bool = True):
+        """
+        参数:
+            max_buffer: 模拟本地缓冲区容量（条），未flush的消息超过该值时send抛出BufferError，0表示不限制
+            keep_messages: 是否保存发送的消息，大数据量测试时设为False只计数
+        """
         self.sent_messages = {}
+        self.sent_counts = {}
         self.flushed_topics = []
+        self.max_buffer = max_buffer
+        self.keep_messages = keep_messages
+        self.buffered = 0
         
     def send(self, topic, message):
         """
         模拟发送消息到Kafka
         """
+        if self.max_buffer and self.buffered >= self.max_buffer:
+            raise BufferError("Local: Queue full")
+        self.buffered += 1
+        self.sent_counts[topic] = self.sent_counts.get(topic, 0) + 1
+        if not self.keep_messages:
+            return
         if topic not in self.sent_messages:
             self.sent_messages[topic] = []
         self.sent_messages[topic].append(message)
@@ -88,7 +154,8 @@ class MockKafkaProducer:
         """
         模拟刷新消息，确保所有消息被发送
         """
-        current_topics = list(self.sent_messages.keys())
+        self.buffered = 0
+        current_topics = list(self.sent_counts.keys())
         self.flushed_topics.extend(current_topics)
         logger.debug(f"Mock刷新topic: {', '.join(current_topics)}")
         
@@ -96,7 +163,7 @@ class MockKafkaProducer:
         """
         获取发送统计信息
         """
-        stats = {topic: len(messages) for topic, messages in self.sent_messages.items()}
+        stats = dict(self.sent_counts)
         return {
             'sent_messages': stats,
             'flushed_count': len(self.flushed_topics),
@@ -145,4 +212,16 @@ if __name__ == "__main__":
     print(f"总刷新次数: {stats['flushed_count']}")
     print("各Topic发送消息数:")
     for topic, count in stats['sent_messages'].items():
-        print(f"  - {topic}: {count} 条")
\ No newline at end of file
+        print(f"  - {topic}: {count} 条")
+    
+    print("\n=== 测试生成器输入（流式读取，内存占用恒定） ===")
+    
+    def stream_rows(count):
+        """模拟从数据库游标或文件中逐行读取数据"""
+        for i in range(count):
+            yield {'row_id': i, 'value': f'row_{i}'}
+    
+    # 缓冲区只能容纳50条，批次大小为100，发送过程中会触发背压
+    kafka_producer = MockKafkaProducer(max_buffer=50, keep_messages=False)
+    sent = batch_send_to_kafka({"export": stream_rows(1000)}, kafka_producer, max_batch_size=100)
+    print(f"生成器输入发送结果: {sent}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+apps/apps_0107.py 加解密吞吐量基准测试（记录数/秒）
+
+- serial: 逐条调用encrypt_data，关闭派生密钥缓存（原来的行为，每条记录都执行PBKDF2）
+- cached: 逐条调用encrypt_data，开启派生密钥缓存
+- bulk: encrypt_many / decrypt_many 多进程批量处理（每轮前清空缓存）
+- distinct: 每条记录的用户名都不同（缓存无法命中），对比逐条处理和多进程批量处理
+
+serial每条记录约0.1秒，只对前sample条计时后换算吞吐量
+
+另外按数据大小对比XOR阶段的吞吐量（MB/秒）：
+- legacy: 原来的逐字节Python循环
+- block: _xor_keystream 整块异或
+- encrypt/decrypt: 完整的encrypt_data/decrypt_data（派生密钥已缓存，包含HMAC和base64）
+
+用法：
+python encryption_bench.py [记录数] [用户数] [进程数]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_0107 import (_xor_keystream, configure_derived_key_cache, decrypt_data, decrypt_many, encrypt_data,
+                       encrypt_many)
+
+MASTER_KEY = "my_secret_master_key_2024"
+
+
+def generate_records(count, users):
+    """每个用户多条记录（如同一用户的多个字段）"""
+    return [(f"password-{i}-{'x' * (i % 40)}", f"user{i % users}") for i in range(count)]
+
+
+def _rate(func, records):
+    start = time.perf_counter()
+    results = func(records)
+    elapsed = time.perf_counter() - start
+    assert all(result['status'] for result in results), "存在处理失败的记录"
+    return len(records) / elapsed, results
+
+
+def run_benchmark(count=10000, users=100, processes=None, sample=20):
+    """
+    返回:
+        dict: {场景: 每秒处理的记录数}
+    """
+    processes = processes or os.cpu_count() or 1
+    records = generate_records(count, users)
+    results = {}
+
+    configure_derived_key_cache(0)
+    results['serial encrypt'], _ = _rate(
+        lambda items: [encrypt_data(data, salt, MASTER_KEY) for data, salt in items], records[:sample])
+
+    configure_derived_key_cache()
+    results['cached encrypt'], encrypted = _rate(
+        lambda items: [encrypt_data(data, salt, MASTER_KEY) for data, salt in items], records)
+    configure_derived_key_cache()
+    results['cached decrypt'], _ = _rate(
+        lambda items: [decrypt_data(data, salt, MASTER_KEY) for data, salt in items],
+        [(item['data'], salt) for item, (_, salt) in zip(encrypted, records)])
+
+    configure_derived_key_cache()
+    results['bulk encrypt'], encrypted = _rate(
+        lambda items: encrypt_many(items, MASTER_KEY, processes=processes), records)
+    configure_derived_key_cache()
+    results['bulk decrypt'], _ = _rate(
+        lambda items: decrypt_many(items, MASTER_KEY, processes=processes),
+        [(item['data'], salt) for item, (_, salt) in zip(encrypted, records)])
+
+    # 每条记录一个用户：缓存无效，只有多进程能提速
+    distinct = [(data, f"distinct-{i}") for i, (data, _) in enumerate(records[:sample * processes])]
+    configure_derived_key_cache()
+    results['distinct serial'], _ = _rate(
+        lambda items: [encrypt_data(data, salt, MASTER_KEY) for data, salt in items], distinct[:sample])
+    configure_derived_key_cache()
+    results['distinct bulk'], _ = _rate(
+        lambda items: encrypt_many(items, MASTER_KEY, processes=processes, chunk_size=max(1, sample // 4)),
+        distinct)
+    configure_derived_key_cache()
+    return results
+
+
+def legacy_xor(data, enc_key, iv):
+    """原实现：逐字节异或"""
+    encrypted_bytes = bytearray()
+    for i, byte in enumerate(data):
+        key_byte = enc_key[i % len(enc_key)] ^ iv[i % len(iv)]
+        encrypted_bytes.append(byte ^ key_byte)
+    return bytes(encrypted_bytes)
+
+
+def _mb_per_sec(func, size, min_time=0.2):
+    """重复执行直到累计min_time秒，返回MB/秒"""
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return size * runs / elapsed / 1024 / 1024
+
+
+def run_payload_benchmark(sizes=(1024, 64 * 1024, 1024 * 1024)):
+    """
+    返回:
+        dict: {(数据大小, 实现): MB/秒}
+    """
+    enc_key, iv = os.urandom(32), os.urandom(16)
+    configure_derived_key_cache()
+    results = {}
+    for size in sizes:
+        data = os.urandom(size)
+        text = 'x' * size
+        encrypted = encrypt_data(text, 'payload-user', MASTER_KEY)['data']
+        results[(size, 'legacy')] = _mb_per_sec(lambda: legacy_xor(data, enc_key, iv), size)
+        results[(size, 'block')] = _mb_per_sec(lambda: _xor_keystream(data, enc_key, iv), size)
+        results[(size, 'encrypt')] = _mb_per_sec(lambda: encrypt_data(text, 'payload-user', MASTER_KEY), size)
+        results[(size, 'decrypt')] = _mb_per_sec(lambda: decrypt_data(encrypted, 'payload-user', MASTER_KEY), size)
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+    print(f"记录数: {count}, 用户数: {users}, 进程数: {processes}")
+    results = run_benchmark(count, users, processes)
+    baseline = results['serial encrypt']
+    for name, rate in results.items():
+        print(f"{name:<18}{rate:>12,.1f} 条/秒{rate / baseline:>10.1f}x")
+
+    print("\nXOR吞吐量:")
+    payload_results = run_payload_benchmark()
+    for size in sorted({size for size, _ in payload_results}):
+        legacy = payload_results[(size, 'legacy')]
+        for impl in ('legacy', 'block', 'encrypt', 'decrypt'):
+            rate = payload_results[(size, impl)]
+            print(f"{size // 1024:>6} KB  {impl:<10}{rate:>10,.1f} MB/秒{rate / legacy:>10.1f}x")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IMAP修改版UTF-7文件夹名编解码基准测试
+
+对比原来逐字符处理的实现与 apps/apps_0114_email.py 中基于正则+LRU缓存的实现，
+模拟反复解码/编码同一份大型文件夹列表（如每次同步都重新LIST）：
+- legacy: 原实现（逐字符编码、split解码）
+- regex: 正则实现，每轮前清空缓存（只有同一轮内重复的"&...-"段命中段缓存）
+- cached: 正则实现 + 文件夹名LRU缓存
+
+用法：
+python imap_utf7_bench.py [文件夹数] [轮数]
+"""
+
+import base64
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_0114_email import (_decode_segment_text, _encode_segment_text, decode_modified_utf7,
+                             encode_modified_utf7)
+
+
+def legacy_decode(s):
+    """原实现：按&分割后逐段解码"""
+    parts = s.split('&')
+    result = [parts[0]]
+    for part in parts[1:]:
+        if '-' in part:
+            encoded, rest = part.split('-', 1)
+            if encoded:
+                try:
+                    encoded = encoded.replace(',', '+')
+                    padding = 4 - len(encoded) % 4
+                    if padding < 4:
+                        encoded += '=' * padding
+                    decoded = base64.b64decode(encoded).decode('utf-16be')
+                    result.extend([decoded, rest])
+                except Exception:
+                    result.append(f"&{part}")
+            else:
+                result.extend(['&', rest])
+        else:
+            result.append(f"&{part}")
+    return ''.join(result)
+
+
+def legacy_encode(s):
+    """原实现：逐字符编码"""
+    result = []
+    for c in s:
+        if 0x20 <= ord(c) <= 0x7e and c != '&':
+            result.append(c)
+        else:
+            try:
+                utf16 = c.encode('utf-16be')
+                b64 = base64.b64encode(utf16).decode('ascii').rstrip('=').replace('+', ',')
+                result.append(f"&{b64}-")
+            except Exception:
+                result.append(c)
+    return ''.join(result)
+
+
+def generate_folder_names(count):
+    """生成中英文混合的文件夹名，模拟大型企业邮箱"""
+    departments = ['研发中心', '市场部', 'Sales', '财务&审计', '客户服务', 'HR']
+    return [
+        f"INBOX/{departments[i % len(departments)]}/项目{i}/{'归档' if i % 3 else 'Archive'} 2024"
+        for i in range(count)
+    ]
+
+
+def clear_segment_caches():
+    _decode_segment_text.cache_clear()
+    _encode_segment_text.cache_clear()
+
+
+def _time(func, names, rounds, clear_cache=None):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if clear_cache is not None:
+            clear_cache()
+        for name in names:
+            func(name)
+    return time.perf_counter() - start
+
+
+def run_benchmark(count=5000, rounds=20):
+    """
+    返回:
+        dict: {(操作, 实现): 每秒处理的文件夹名数}
+    """
+    names = generate_folder_names(count)
+    encoded = [encode_modified_utf7(name) for name in names]
+    total = count * rounds
+    results = {}
+    for op, plain_func, legacy_func, inputs in (
+        ('decode', decode_modified_utf7, legacy_decode, encoded),
+        ('encode', encode_modified_utf7, legacy_encode, names),
+    ):
+        results[(op, 'legacy')] = total / _time(legacy_func, inputs, rounds)
+        results[(op, 'regex')] = total / _time(plain_func.__wrapped__, inputs, rounds, clear_segment_caches)
+        plain_func.cache_clear()
+        results[(op, 'cached')] = total / _time(plain_func, inputs, rounds)
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"文件夹数: {count}, 轮数: {rounds}")
+    results = run_benchmark(count, rounds)
+    for op in ('decode', 'encode'):
+        legacy = results[(op, 'legacy')]
+        for impl in ('legacy', 'regex', 'cached'):
+            ops = results[(op, impl)]
+            print(f"{op:<8}{impl:<8}{ops:>14,.0f} 个/秒{ops / legacy:>8.1f}x")
@@ -1,17 +1,47 @@
+import json
 import logging
-from typing import Dict, List, Any, Optional
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Iterable, Iterator, Tuple
+
+from kafka_retry_spool import RetrySpool, SpoolFullError
+from kafka_serializers import resolve_serializer
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def default_message_size(message: Any) -> int:
+    """
+    估算消息序列化后的字节数
+
+    bytes直接取长度，str按UTF-8编码，其他对象按JSON序列化后计算
+    """
+    if isinstance(message, (bytes, bytearray)):
+        return len(message)
+    if isinstance(message, str):
+        return len(message.encode('utf-8'))
+    return len(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+
 class KafkaBatchPusher:
     """
     Kafka批量推送器，支持按配置的批量大小推送消息到不同的topic
+
+    每个批次同时受消息条数(batch_size)和序列化后总字节数(max_batch_bytes)限制，
+    单条就超过max_batch_bytes的消息不会发送，记录在oversized_messages中
+
+    配置serializer后，消息在切分批次时序列化一次，序列化结果既用于计算字节数也用于发送
     """
     
-    def __init__(self, kafka_producer, batch_size: int = 100, max_retries: int = 3):
+    def __init__(self, kafka_producer, batch_size: int = 100, max_retries: int = 3,
+                 max_batch_bytes: int = 1048576, max_workers: int = 1,
+                 size_func: Optional[Callable[[Any], int]] = None,
+                 serializer: Any = None, buffer_full_wait: float = 30.0,
+                 spool: Optional[RetrySpool] = None, metrics: Any = None):
         """
         初始化Kafka批量推送器
         
@@ -19,66 +49,166 @@ class KafkaBatchPusher:
             kafka_producer: Kafka生产者实例，需要实现send方法
             batch_size: 每批次推送的最大消息数，默认100
             max_retries: 推送失败时的最大重试次数，默认3
+            max_batch_bytes: 每批次序列化后的最大字节数，默认1MB（与Kafka默认max_request_size一致）
+            max_workers: 同时推送的topic数，默认1（按topic顺序推送）
+            size_func: 计算单条消息字节数的函数，默认default_message_size（配置serializer时不使用）
+            serializer: 序列化器名称（json/orjson/msgpack）或自定义序列化函数，
+                默认None表示原样把消息交给kafka_producer
+            buffer_full_wait: 生产者缓冲区满（send抛出BufferError）时最多等待的秒数，
+                等待期间不消耗重试次数，默认30秒
+            spool: 可选的本地重试队列，重试耗尽的批次写入spool而不是丢弃，
+                在下次push_messages开始时或由后台线程(start_spool_drainer)按顺序重放
+            metrics: 可选的KafkaMetrics（见 kafka_metrics.py），按批次记录推送条数、字节数、耗时和错误数
         """
         self.kafka_producer = kafka_producer
         self.batch_size = batch_size
         self.max_retries = max_retries
+        self.max_batch_bytes = max_batch_bytes
+        self.max_workers = max_workers
+        self.size_func = size_func or default_message_size
+        self.serializer = resolve_serializer(serializer) if serializer is not None else None
+        self.buffer_full_wait = buffer_full_wait
+        self.spool = spool
+        self.metrics = metrics
+        # 最近一次push_messages中写入spool的批次数
+        self.spooled_batches = 0
+        self._spooled_lock = threading.Lock()
+        # 最近一次push_messages中超过max_batch_bytes而未发送的消息，key为topic
+        self.oversized_messages: Dict[str, List[Any]] = {}
+        self._oversized_lock = threading.Lock()
     
-    def push_messages(self, message_dict: Dict[str, List[Any]]) -> bool:
+    def push_messages(self, message_dict: Dict[str, Iterable[Any]]) -> bool:
         """
         推送消息到Kafka
         
         参数:
-            message_dict: 消息字典，key为topic后缀，value为消息列表
+            message_dict: 消息字典，key为topic后缀，value为消息列表，
+                也可以是生成器等任意可迭代对象（按批次惰性读取，内存中只保留当前批次）
             
         返回:
-            bool: 所有消息是否都成功推送
+            bool: 所有消息是否都成功推送（存在超大消息时同样返回False）
         """
-        all_success = True
+        self.oversized_messages = {}
+        self.spooled_batches = 0
         
-        for _key, _value in message_dict.items():
-            _topic = f"topic_{_key}"
-            logger.info(f"准备推送topic {_topic} 的 {len(_value)} 条消息")
-            
-            if not _value:
-                logger.info(f"topic {_topic} 没有消息需要推送")
-                continue
+        # 先重放上次遗留的失败批次，保证消息顺序
+        if self.spool is not None and self.spool.has_pending():
+            self.replay_spool()
+        
+        if self.max_workers > 1 and len(message_dict) > 1:
+            # 多个topic并行推送，每个topic内部仍按批次顺序推送
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(message_dict))) as executor:
+                results = list(executor.map(lambda item: self._push_topic(*item), message_dict.items()))
+        else:
+            results = [self._push_topic(_key, _value) for _key, _value in message_dict.items()]
+        
+        return all(results)
+    
+    def _push_topic(self, _key: str, _value: Iterable[Any]) -> bool:
+        """
+        按批次推送单个topic的消息
+        
+        返回:
+            bool: 该topic的消息是否都成功推送
+        """
+        _topic = f"topic_{_key}"
+        logger.info(f"准备推送topic {_topic} 的消息")
+        
+        all_success = True
+        total = 0
+        for batch, batch_start, batch_end, batch_bytes in self._iter_batches(_topic, _value):
+            total = batch_end
+            if self.metrics is not None:
+                self.metrics.maybe_report()
+            logger.info(f"推送topic {_topic} 的第 {batch_start}-{batch_end} 条消息 ({len(batch)} 条, {batch_bytes} 字节)")
             
-            # 按批次推送
-            for i in range(0, len(_value), self.batch_size):
-                batch = _value[i:i+self.batch_size]
-                batch_start = i + 1
-                batch_end = min(i + self.batch_size, len(_value))
-                logger.info(f"推送topic {_topic} 的第 {batch_start}-{batch_end} 条消息")
-                
+            if self.spool is not None and self.spool.has_pending():
+                # spool中还有未重放的批次，新批次排在其后，保证顺序
+                success = self._spool_batch(_topic, batch)
+            else:
                 # 尝试推送，支持重试
-                success = self._send_with_retry(_topic, batch)
-                if not success:
-                    logger.error(f"topic {_topic} 的第 {batch_start}-{batch_end} 条消息推送失败")
-                    all_success = False
+                success = self._send_with_retry(_topic, batch, batch_bytes)
+                if not success and self.spool is not None:
+                    success = self._spool_batch(_topic, batch)
+            if not success:
+                logger.error(f"topic {_topic} 的第 {batch_start}-{batch_end} 条消息推送失败")
+                all_success = False
+        
+        if total == 0 and _topic not in self.oversized_messages:
+            logger.info(f"topic {_topic} 没有消息需要推送")
+            return True
+        
+        oversized = self.oversized_messages.get(_topic)
+        if oversized:
+            logger.error(f"topic {_topic} 有 {len(oversized)} 条消息超过 {self.max_batch_bytes} 字节，未推送")
+            all_success = False
         
         return all_success
     
-    def _send_with_retry(self, topic: str, messages: List[Any]) -> bool:
+    def _iter_batches(self, topic: str, messages: Iterable[Any]) -> Iterator[Tuple[List[Any], int, int, int]]:
+        """
+        按条数和字节数切分批次
+        
+        返回:
+            迭代器，每项为 (批次消息, 起始序号, 结束序号, 批次字节数)，序号从1开始
+        """
+        batch: List[Any] = []
+        batch_bytes = 0
+        batch_start = 1
+        index = 0
+        for index, message in enumerate(messages, start=1):
+            if self.serializer is not None:
+                message = self.serializer(message)
+                size = len(message)
+            else:
+                size = self.size_func(message)
+            if size > self.max_batch_bytes:
+                # 单条消息超限，单独记录，不影响同批次其他消息
+                with self._oversized_lock:
+                    self.oversized_messages.setdefault(topic, []).append(message)
+                continue
+            
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.max_batch_bytes):
+                yield batch, batch_start, index - 1, batch_bytes
+                batch, batch_bytes = [], 0
+            
+            if not batch:
+                batch_start = index
+            batch.append(message)
+            batch_bytes += size
+        
+        if batch:
+            yield batch, batch_start, index, batch_bytes
+    
+    def _send_with_retry(self, topic: str, messages: List[Any], nbytes: Optional[int] = None) -> bool:
         """
         尝试发送消息，支持重试
         
         参数:
             topic: Kafka topic
             messages: 消息列表
+            nbytes: 批次字节数（_iter_batches已计算），用于指标；
+                为None时（重放spool的批次）按消息重新计算
             
         返回:
             bool: 是否成功发送
         """
         for retry in range(self.max_retries):
+            start_time = time.monotonic()
             try:
                 # 调用kafka生产者的send方法
                 # 注意：这里假设kafka_producer.send支持批量发送
                 # 如果不支持，需要循环发送单条消息
-                self.kafka_producer.send(topic, messages)
+                self._send_with_backpressure(topic, messages)
                 logger.info(f"topic {topic} 的 {len(messages)} 条消息推送成功 (重试 {retry})")
+                if self.metrics is not None:
+                    if nbytes is None:
+                        nbytes = self._batch_bytes(messages)
+                    self.metrics.record_batch('produced', len(messages), nbytes, time.monotonic() - start_time)
                 return True
             except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.record_error('produced')
                 logger.error(f"topic {topic} 的消息推送失败 (重试 {retry}): {str(e)}")
                 
                 # 如果是最后一次重试，返回失败
@@ -89,6 +219,75 @@ class KafkaBatchPusher:
                 # time.sleep(1)  # 延迟1秒后重试
         
         return False
+    
+    def _batch_bytes(self, messages: List[Any]) -> int:
+        """批次字节数，与_iter_batches的计算方式一致（配置serializer时消息已经是bytes）"""
+        if self.serializer is not None:
+            return sum(len(message) for message in messages)
+        return sum(self.size_func(message) for message in messages)
+    
+    def _spool_batch(self, topic: str, messages: List[Any]) -> bool:
+        """
+        把批次写入本地spool，等待之后重放
+        
+        返回:
+            bool: 是否写入成功（spool已满、消息无法编码或写入文件出错时返回False）
+        """
+        try:
+            self.spool.append(topic, messages)
+        except SpoolFullError as e:
+            logger.error(str(e))
+            return False
+        except (TypeError, ValueError, OSError) as e:
+            logger.error(f"topic {topic} 的 {len(messages)} 条消息写入本地spool失败: {str(e)}")
+            return False
+        with self._spooled_lock:
+            self.spooled_batches += 1
+        logger.warning(f"topic {topic} 的 {len(messages)} 条消息已写入本地spool，等待重放")
+        return True
+    
+    def replay_spool(self) -> bool:
+        """
+        按顺序重放spool中的批次，遇到失败即停止
+        
+        返回:
+            bool: spool是否已全部重放完毕
+        """
+        if self.spool is None:
+            return True
+        drained = self.spool.replay(self._send_with_retry)
+        logger.info(f"spool重放{'完成' if drained else '未完成'}: {self.spool.get_metrics()}")
+        return drained
+    
+    def start_spool_drainer(self, interval: float = 30.0) -> None:
+        """启动后台线程，每隔interval秒重放一次spool"""
+        if self.spool is None:
+            raise ValueError("未配置spool")
+        self.spool.start_drainer(self._send_with_retry, interval=interval)
+    
+    def _send_with_backpressure(self, topic: str, messages: List[Any]) -> None:
+        """
+        发送一个批次；生产者缓冲区满时先flush并等待，而不是立即判定失败
+        
+        这样上游生成器会随之暂停读取，内存占用不会随输入规模增长
+        
+        异常:
+            BufferError: 等待超过buffer_full_wait秒后缓冲区仍然是满的
+        """
+        deadline = time.monotonic() + self.buffer_full_wait
+        backoff = 0.01
+        while True:
+            try:
+                self.kafka_producer.send(topic, messages)
+                return
+            except BufferError:
+                if time.monotonic() >= deadline:
+                    raise
+                logger.debug(f"topic {topic} 生产者缓冲区已满，等待 {backoff:.2f} 秒")
+                if hasattr(self.kafka_producer, 'flush'):
+                    self.kafka_producer.flush()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 1.0)
 
 
 # 使用示例
@@ -120,3 +319,52 @@ if __name__ == "__main__":
         logger.info("所有消息推送成功")
     else:
         logger.error("部分消息推送失败")
+    
+    # 按字节数限制批次，多个topic并行推送
+    large_messages = {
+        "big": ["x" * 3000 for _ in range(20)] + ["y" * 20000],  # 最后一条超过单批次上限
+        "small": [f"s{i}" for i in range(300)]
+    }
+    pusher = KafkaBatchPusher(kafka_producer, batch_size=100, max_batch_bytes=10000, max_workers=2)
+    success = pusher.push_messages(large_messages)
+    for topic, oversized in pusher.oversized_messages.items():
+        logger.warning(f"{topic} 有 {len(oversized)} 条超大消息未推送")
+    
+    # 生成器输入：逐条产生消息，内存中只保留当前批次
+    def stream_messages(count):
+        for i in range(count):
+            yield f"stream_message_{i}"
+    
+    pusher = KafkaBatchPusher(kafka_producer, batch_size=100)
+    success = pusher.push_messages({"stream": stream_messages(1000)})
+    logger.info(f"生成器输入推送{'成功' if success else '失败'}")
+    
+    # broker不可用时失败批次写入本地spool，恢复后按顺序重放
+    import tempfile
+    
+    class FlakyKafkaProducer(MockKafkaProducer):
+        def __init__(self):
+            self.available = False
+        
+        def send(self, topic: str, messages: List[Any]):
+            if not self.available:
+                raise Exception("模拟broker不可用")
+            return super().send(topic, messages)
+    
+    flaky_producer = FlakyKafkaProducer()
+    spool = RetrySpool(os.path.join(tempfile.gettempdir(), "kafka_batch_pusher_spool"), fsync=False)
+    pusher = KafkaBatchPusher(flaky_producer, batch_size=100, max_retries=2, spool=spool)
+    pusher.push_messages({"cr": [f"cr_message_{i}" for i in range(250)]})
+    logger.info(f"写入spool的批次数: {pusher.spooled_batches}, spool状态: {spool.get_metrics()}")
+    
+    flaky_producer.available = True
+    pusher.replay_spool()
+    spool.close()
+    
+    # 吞吐量/耗时指标：每批记录一次，结束时上报
+    from kafka_metrics import KafkaMetrics
+    
+    metrics = KafkaMetrics('pusher_demo', interval=60)
+    pusher = KafkaBatchPusher(kafka_producer, batch_size=100, metrics=metrics)
+    pusher.push_messages(messages)
+    metrics.report()
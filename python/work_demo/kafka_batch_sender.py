@@ -1,10 +1,14 @@
 import logging
-from typing import Dict, List, Any
+import sys
+import threading
+from functools import partial
+from typing import Dict, List, Any, Optional
 from kafka import KafkaProducer
-from kafka.errors import KafkaError
-import json
+from kafka.errors import KafkaError, KafkaTimeoutError
 import time
 
+from kafka_serializers import check_compression, resolve_key_serializer, resolve_serializer
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,7 +20,9 @@ def send_to_kafka_in_batches(
     kafka_producer: KafkaProducer,
     max_batch_size: int = 100,
     retry_count: int = 3,
-    retry_delay: float = 1.0
+    retry_delay: float = 1.0,
+    value_serializer: Any = 'json',
+    metrics: Any = None
 ) -> Dict[str, Dict[str, int]]:
     """
     将数据字典中的每个列表分批发送到对应的Kafka主题
@@ -27,11 +33,14 @@ def send_to_kafka_in_batches(
         max_batch_size: 每批次最大发送条数，默认为100
         retry_count: 发送失败重试次数，默认为3
         retry_delay: 重试间隔（秒），默认为1.0
+        value_serializer: 序列化器名称（json/orjson/msgpack）或自定义序列化函数，默认json
+        metrics: 可选的KafkaMetrics（见 kafka_metrics.py），按批次记录发送条数、字节数、耗时和错误数
     
     返回:
         Dict: 统计信息，包含每个主题的发送成功数和失败数
     """
     statistics = {}
+    serialize = resolve_serializer(value_serializer)
     
     # 遍历数据字典
     for key, value_list in data_dict.items():
@@ -58,15 +67,14 @@ def send_to_kafka_in_batches(
             # 发送当前批次
             success = False
             for retry in range(retry_count):
+                batch_start_time = time.monotonic()
+                batch_bytes = 0
                 try:
                     # 发送批次中的每个数据项
                     for item in batch_items:
-                        # 将数据转换为JSON（如果不是字符串）
-                        if not isinstance(item, str):
-                            item = json.dumps(item, ensure_ascii=False)
-                        
-                        # 发送到Kafka
-                        kafka_producer.send(topic, value=item.encode('utf-8'))
+                        value = serialize(item)
+                        batch_bytes += len(value)
+                        kafka_producer.send(topic, value=value)
                     
                     # 确认所有消息已发送
                     kafka_producer.flush()
@@ -74,9 +82,14 @@ def send_to_kafka_in_batches(
                     # 发送成功
                     success = True
                     statistics[topic]["success"] += len(batch_items)
+                    if metrics is not None:
+                        metrics.record_batch('produced', len(batch_items), batch_bytes,
+                                             time.monotonic() - batch_start_time)
                     logger.debug(f"Topic {topic} 第 {i//max_batch_size + 1} 批次发送成功，共 {len(batch_items)} 条")
                     break
                 except KafkaError as e:
+                    if metrics is not None:
+                        metrics.record_error('produced')
                     logger.error(f"Topic {topic} 第 {i//max_batch_size + 1} 批次发送失败（重试 {retry+1}/{retry_count}）: {str(e)}")
                     if retry < retry_count - 1:
                         time.sleep(retry_delay)
@@ -85,16 +98,143 @@ def send_to_kafka_in_batches(
             if not success:
                 statistics[topic]["failed"] += len(batch_items)
                 logger.error(f"Topic {topic} 第 {i//max_batch_size + 1} 批次发送失败，已达到最大重试次数")
+            
+            if metrics is not None:
+                metrics.maybe_report()
     
     return statistics
 
 
-def create_kafka_producer(bootstrap_servers: List[str], **kwargs) -> KafkaProducer:
+def send_to_kafka_pipelined(
+    data_dict: Dict[str, List[Any]],
+    kafka_producer: KafkaProducer,
+    max_in_flight: int = 10000,
+    flush_timeout: Optional[float] = None,
+    value_serializer: Any = 'json',
+    metrics: Any = None,
+    metrics_batch_size: int = 1000
+) -> Dict[str, Dict[str, int]]:
+    """
+    异步流水线方式发送数据：不在每个批次后flush，消息在各批次之间持续发送，
+    通过每条消息的future回调统计成功/失败，只在最后flush一次
+
+    重试交给KafkaProducer自身的retries配置处理，回调中的失败即为最终失败
+
+    参数:
+        data_dict: 数据字典，键为主题后缀，值为需要发送的数据列表
+        kafka_producer: KafkaProducer实例
+        max_in_flight: 最多同时未确认的消息数，达到上限时send会等待回调释放，默认10000
+        flush_timeout: 最后flush的超时时间（秒），默认不超时
+        value_serializer: 序列化器名称（json/orjson/msgpack）或自定义序列化函数，默认json
+        metrics: 可选的KafkaMetrics，每metrics_batch_size条消息记录一次提交的条数、字节数和耗时，
+            发送失败的回调计入错误数
+        metrics_batch_size: 记录指标的消息粒度，默认1000条
+
+    返回:
+        Dict: 统计信息，包含每个主题的发送成功数和失败数；
+            flush超时仍未确认的消息计入失败
+    """
+    statistics = {}
+    serialize = resolve_serializer(value_serializer)
+    # 每个主题已提交给producer的消息数，以及已回调的消息数
+    sent_counts = {}
+    done_counts = {}
+    stats_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    # flush结束后置位，之后才到达的回调不再计入统计
+    finished = threading.Event()
+
+    def on_success(topic, _record_metadata):
+        with stats_lock:
+            if not finished.is_set():
+                statistics[topic]["success"] += 1
+                done_counts[topic] += 1
+        in_flight.release()
+
+    def on_error(topic, exc):
+        with stats_lock:
+            if not finished.is_set():
+                statistics[topic]["failed"] += 1
+                done_counts[topic] += 1
+        in_flight.release()
+        if metrics is not None:
+            metrics.record_error('produced')
+        logger.error(f"Topic {topic} 消息发送失败: {str(exc)}")
+
+    for key, value_list in data_dict.items():
+        topic = f"topic_{key}"
+        statistics[topic] = {"success": 0, "failed": 0}
+        sent_counts[topic] = 0
+        done_counts[topic] = 0
+
+        if not value_list:
+            logger.info(f"Topic {topic} 没有需要发送的数据")
+            continue
+
+        logger.info(f"Topic {topic} 开始异步发送 {len(value_list)} 条数据")
+        chunk_start_time = time.monotonic()
+        chunk_count = chunk_bytes = 0
+        for item in value_list:
+            value = serialize(item)
+            if metrics is not None:
+                chunk_count += 1
+                chunk_bytes += len(value)
+                if chunk_count >= metrics_batch_size:
+                    now = time.monotonic()
+                    metrics.record_batch('produced', chunk_count, chunk_bytes, now - chunk_start_time)
+                    metrics.maybe_report()
+                    chunk_start_time, chunk_count, chunk_bytes = now, 0, 0
+
+            in_flight.acquire()
+            submitted = False
+            try:
+                future = kafka_producer.send(topic, value=value)
+                submitted = True
+            except Exception as e:
+                # 缓冲区满等待超时（KafkaError）、消息类型错误等同步错误，只计入该条消息失败
+                with stats_lock:
+                    statistics[topic]["failed"] += 1
+                if metrics is not None:
+                    metrics.record_error('produced')
+                logger.error(f"Topic {topic} 消息提交失败: {str(e)}")
+                continue
+            finally:
+                # 没有提交成功的消息不会有回调，立即释放占用的名额
+                if not submitted:
+                    in_flight.release()
+
+            sent_counts[topic] += 1
+            future.add_callback(partial(on_success, topic))
+            future.add_errback(partial(on_error, topic))
+
+        if metrics is not None and chunk_count:
+            metrics.record_batch('produced', chunk_count, chunk_bytes, time.monotonic() - chunk_start_time)
+
+    # 只在最后flush一次，等待所有消息确认
+    try:
+        kafka_producer.flush(timeout=flush_timeout)
+    except KafkaTimeoutError as e:
+        logger.error(f"flush超时，部分消息未确认: {str(e)}")
+
+    # flush超时仍未回调的消息计入失败
+    with stats_lock:
+        finished.set()
+        for topic, stats in statistics.items():
+            stats["failed"] += sent_counts[topic] - done_counts[topic]
+            logger.info(f"Topic {topic} 发送完成: 成功 {stats['success']} 条, 失败 {stats['failed']} 条")
+
+    return statistics
+
+
+def create_kafka_producer(bootstrap_servers: List[str], compression_type: Optional[str] = None,
+                          key_serializer: Any = 'str', **kwargs) -> KafkaProducer:
     """
     创建KafkaProducer实例
     
     参数:
         bootstrap_servers: Kafka服务器列表
+        compression_type: 压缩算法，gzip/lz4/zstd/snappy，默认不压缩
+        key_serializer: key序列化器，'str'（默认）、json/orjson/msgpack或自定义序列化函数
         **kwargs: 其他KafkaProducer参数
     
     返回:
@@ -108,7 +248,8 @@ def create_kafka_producer(bootstrap_servers: List[str], **kwargs) -> KafkaProduc
         'batch_size': 16384,  # 16KB
         'linger_ms': 1,
         'buffer_memory': 33554432,  # 32MB
-        'key_serializer': lambda x: x.encode('utf-8') if x else None,
+        'compression_type': check_compression(compression_type),
+        'key_serializer': resolve_key_serializer(key_serializer),
         'value_serializer': lambda x: x  # 我们在send_to_kafka_in_batches中处理序列化
     }
     
@@ -118,7 +259,122 @@ def create_kafka_producer(bootstrap_servers: List[str], **kwargs) -> KafkaProduc
     return KafkaProducer(**config)
 
 
+class _MockFuture:
+    """模拟kafka-python的FutureRecordMetadata，支持add_callback/add_errback"""
+
+    def __init__(self):
+        self._callbacks = []
+        self._errbacks = []
+        self._done = False
+        self._value = None
+        self._exception = None
+        self._lock = threading.Lock()
+
+    def add_callback(self, fn):
+        with self._lock:
+            if not self._done:
+                self._callbacks.append(fn)
+                return self
+        if self._exception is None:
+            fn(self._value)
+        return self
+
+    def add_errback(self, fn):
+        with self._lock:
+            if not self._done:
+                self._errbacks.append(fn)
+                return self
+        if self._exception is not None:
+            fn(self._exception)
+        return self
+
+    def _complete(self, value=None, exception=None):
+        with self._lock:
+            self._done = True
+            self._value = value
+            self._exception = exception
+            callbacks = self._errbacks if exception is not None else self._callbacks
+        for fn in callbacks:
+            fn(exception if exception is not None else value)
+
+
+class LatencyMockProducer:
+    """
+    模拟有网络延迟的Kafka broker，用于对比两种发送模式的吞吐量
+
+    后台线程模拟producer的I/O线程：每次把缓冲区中最多request_size条消息
+    作为一个请求发出，每个请求耗时latency秒
+    """
+
+    def __init__(self, latency: float = 0.005, request_size: int = 500):
+        self.latency = latency
+        self.request_size = request_size
+        self.sent_count = 0
+        self._pending = []
+        self._in_progress = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._io_loop, daemon=True)
+        self._thread.start()
+
+    def send(self, topic, value=None, key=None):
+        future = _MockFuture()
+        with self._cond:
+            self._pending.append(future)
+            self._cond.notify_all()
+        return future
+
+    def _io_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                request = self._pending[:self.request_size]
+                del self._pending[:self.request_size]
+                self._in_progress += len(request)
+            time.sleep(self.latency)
+            for future in request:
+                future._complete(value=True)
+            with self._cond:
+                self._in_progress -= len(request)
+                self.sent_count += len(request)
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._pending and not self._in_progress, timeout=timeout):
+                raise KafkaTimeoutError("flush超时")
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def benchmark_send_modes(total: int = 20000, latency: float = 0.005):
+    """对比逐批flush和异步流水线两种模式在模拟broker上的吞吐量（条/秒）"""
+    data = {"bench": [{"id": i, "payload": "x" * 100} for i in range(total)]}
+    results = {}
+    for name, func in (("逐批flush", send_to_kafka_in_batches), ("异步流水线", send_to_kafka_pipelined)):
+        producer = LatencyMockProducer(latency=latency)
+        start = time.perf_counter()
+        stats = func(data, producer)
+        elapsed = time.perf_counter() - start
+        producer.close()
+        results[name] = total / elapsed
+        print(f"{name}: {stats['topic_bench']}, 耗时 {elapsed:.3f}秒, 吞吐量 {total / elapsed:,.0f} 条/秒")
+    print(f"提升倍数: {results['异步流水线'] / results['逐批flush']:.1f}x")
+    return results
+
+
 if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        # 使用模拟broker对比吞吐量: python kafka_batch_sender.py --bench
+        benchmark_send_modes()
+        sys.exit(0)
+    
     # 示例用法
     try:
         # 创建KafkaProducer实例
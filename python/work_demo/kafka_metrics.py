@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kafka生产/消费指标统计
+
+按批次累加计数（消息数、字节数、错误数、批次耗时），到达上报间隔时计算：
+- 每秒消息数、每秒字节数
+- 批次耗时的p50/p95/p99（基于最近latency_samples个批次）
+- 各分区消费延迟(lag) = 分区末尾offset - 已提交offset
+然后输出一行日志，并调用注册的sink（任意接收指标字典的函数）。
+
+热路径上每个批次只有一次加锁累加，上报检查只是一次时间比较，开销可以忽略。
+
+用法:
+    metrics = KafkaMetrics('orders', interval=10)
+    metrics.add_sink(lambda snapshot: push_to_dashboard(snapshot))
+    for records, commit in consume_kafka_batches(..., metrics=metrics):
+        ...
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Sink = Callable[[Dict], None]
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(percent / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class KafkaMetrics:
+    """
+    Kafka指标统计器，可以同时被生产者和消费者使用（按kind区分，如'produced'、'consumed'）
+    """
+
+    def __init__(self, name: str = 'kafka', interval: float = 10.0, latency_samples: int = 1024,
+                 log_level: int = logging.INFO):
+        """
+        参数:
+            name: 指标名称，出现在日志和sink数据中
+            interval: 上报间隔（秒），默认10秒
+            latency_samples: 计算耗时分位数时保留的最近批次数，默认1024
+            log_level: 指标日志级别，默认INFO
+        """
+        self.name = name
+        self.interval = interval
+        self.log_level = log_level
+        self._lock = threading.Lock()
+        self._sinks: List[Sink] = []
+        self._lag_provider: Optional[Callable[[], Dict]] = None
+        self._latency_samples = latency_samples
+
+        # kind -> 计数
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._window: Dict[str, Dict[str, float]] = {}
+        self._latencies: Dict[str, deque] = {}
+        self._window_start = time.monotonic()
+        self._next_report = self._window_start + interval
+
+    # ===== 配置 =====
+
+    def add_sink(self, sink: Sink) -> None:
+        """注册sink，每次上报时以指标字典调用"""
+        self._sinks.append(sink)
+
+    def set_lag_provider(self, provider: Optional[Callable[[], Dict]]) -> None:
+        """
+        设置lag计算函数，返回 {分区标识: lag}，例如 apps/apps_1219.py 中的 compute_consumer_lag
+
+        lag计算需要访问broker，只在上报时调用，且在调用maybe_report的线程中执行
+        （KafkaConsumer不是线程安全的，需要在消费线程中调用）
+        """
+        self._lag_provider = provider
+
+    # ===== 热路径 =====
+
+    def _counters(self, table: Dict[str, Dict[str, float]], kind: str) -> Dict[str, float]:
+        counters = table.get(kind)
+        if counters is None:
+            counters = table[kind] = {'messages': 0, 'bytes': 0, 'batches': 0, 'errors': 0}
+        return counters
+
+    def record_batch(self, kind: str, messages: int, nbytes: int = 0, latency: Optional[float] = None) -> None:
+        """记录一个批次：消息数、字节数和耗时（秒）"""
+        with self._lock:
+            for table in (self._totals, self._window):
+                counters = self._counters(table, kind)
+                counters['messages'] += messages
+                counters['bytes'] += nbytes
+                counters['batches'] += 1
+            if latency is not None:
+                samples = self._latencies.get(kind)
+                if samples is None:
+                    samples = self._latencies[kind] = deque(maxlen=self._latency_samples)
+                samples.append(latency)
+
+    def record_error(self, kind: str, count: int = 1) -> None:
+        """记录错误数"""
+        with self._lock:
+            self._counters(self._totals, kind)['errors'] += count
+            self._counters(self._window, kind)['errors'] += count
+
+    def maybe_report(self) -> Optional[Dict]:
+        """到达上报间隔时上报一次并返回指标字典，否则返回None"""
+        if time.monotonic() < self._next_report:
+            return None
+        return self.report()
+
+    # ===== 上报 =====
+
+    def snapshot(self) -> Dict:
+        """计算当前窗口的指标并开始新窗口"""
+        now = time.monotonic()
+        with self._lock:
+            elapsed = max(now - self._window_start, 1e-9)
+            window, self._window = self._window, {}
+            latencies = {kind: sorted(samples) for kind, samples in self._latencies.items()}
+            totals = {kind: dict(counters) for kind, counters in self._totals.items()}
+            self._window_start = now
+            self._next_report = now + self.interval
+
+        snapshot = {'name': self.name, 'timestamp': time.time(), 'interval': round(elapsed, 3)}
+        for kind in sorted(set(totals) | set(window)):
+            counters = window.get(kind, {'messages': 0, 'bytes': 0, 'batches': 0, 'errors': 0})
+            samples = latencies.get(kind, [])
+            snapshot[kind] = {
+                'messages_per_sec': round(counters['messages'] / elapsed, 1),
+                'bytes_per_sec': round(counters['bytes'] / elapsed, 1),
+                'batches': counters['batches'],
+                'errors': counters['errors'],
+                'total_messages': totals.get(kind, {}).get('messages', 0),
+                'total_errors': totals.get(kind, {}).get('errors', 0),
+                'latency_p50_ms': round(_percentile(samples, 50) * 1000, 2),
+                'latency_p95_ms': round(_percentile(samples, 95) * 1000, 2),
+                'latency_p99_ms': round(_percentile(samples, 99) * 1000, 2),
+            }
+
+        if self._lag_provider is not None:
+            try:
+                lag = self._lag_provider()
+                snapshot['lag'] = lag
+                snapshot['total_lag'] = sum(lag.values())
+            except Exception as e:
+                logger.warning(f"计算lag失败: {str(e)}")
+        return snapshot
+
+    def report(self) -> Dict:
+        """立即上报一次：输出日志并调用所有sink"""
+        snapshot = self.snapshot()
+        logger.log(self.log_level, f"Kafka指标 {json.dumps(snapshot, ensure_ascii=False, default=str)}")
+        for sink in self._sinks:
+            try:
+                sink(snapshot)
+            except Exception as e:
+                logger.warning(f"指标sink执行失败: {str(e)}")
+        return snapshot
+
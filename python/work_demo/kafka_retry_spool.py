@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kafka失败批次的本地磁盘重试队列（spool）
+
+broker长时间不可用时，KafkaBatchPusher重试耗尽的批次追加写入本地分段文件，
+在下次运行或由后台线程按写入顺序重新推送，避免数据丢失。
+
+文件格式：
+- 目录下按序号命名的分段文件 spool-000000000001.log，写满segment_max_bytes后切换到下一个
+- 每条记录为 [4字节长度][4字节CRC32][载荷]，载荷为JSON：{"topic": ..., "messages": [...]}，
+  bytes消息以 {"$b64": base64编码} 的形式保存
+- checkpoint文件记录已重放到的 (分段序号, 偏移量)，重放完的分段文件会被删除
+
+投递语义为至少一次：重放成功但checkpoint未落盘时崩溃，重启后该批次会再发送一次。
+"""
+
+import base64
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>II')
+_SEGMENT_PREFIX = 'spool-'
+_SEGMENT_SUFFIX = '.log'
+_CHECKPOINT_FILE = 'checkpoint'
+# bytes消息在JSON中的表示: {"$b64": "..."}
+_BYTES_KEY = '$b64'
+
+
+class SpoolFullError(Exception):
+    """spool已达到max_total_bytes上限"""
+
+
+class RetrySpool:
+    """
+    基于分段文件的本地重试队列
+
+    写入和重放可以在不同线程中同时进行；同一时间只允许一个线程重放
+    """
+
+    def __init__(self, spool_dir: str, segment_max_bytes: int = 64 * 1024 * 1024,
+                 max_total_bytes: int = 1024 * 1024 * 1024, fsync: bool = True):
+        """
+        初始化重试队列
+
+        参数:
+            spool_dir: spool目录，不存在时自动创建
+            segment_max_bytes: 单个分段文件的最大字节数，默认64MB
+            max_total_bytes: spool总大小上限，超过后拒绝写入，默认1GB
+            fsync: 每次写入/更新checkpoint后是否fsync，默认True；
+                关闭后吞吐更高，但机器掉电时可能丢失最近写入的批次
+        """
+        self.spool_dir = spool_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.fsync = fsync
+        os.makedirs(spool_dir, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._writer = None
+        self._drainer = None
+        self._stop_event = threading.Event()
+
+        self.metrics: Dict[str, int] = {
+            'appended_batches': 0,
+            'appended_bytes': 0,
+            'rejected_batches': 0,
+            'replayed_batches': 0,
+            'replay_failures': 0,
+            'corrupt_records': 0,
+        }
+
+    # ===== 文件与checkpoint =====
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.spool_dir, f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}")
+
+    def _segments(self) -> List[int]:
+        """按序号升序返回现有分段"""
+        seqs = []
+        for name in os.listdir(self.spool_dir):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                seqs.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+        return sorted(seqs)
+
+    def _read_checkpoint(self) -> Tuple[int, int]:
+        path = os.path.join(self.spool_dir, _CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path, 'r') as f:
+            seq, offset = f.read().split()
+        return int(seq), int(offset)
+
+    def _write_checkpoint(self, seq: int, offset: int) -> None:
+        """先写临时文件再rename，保证checkpoint不会出现半写状态"""
+        path = os.path.join(self.spool_dir, _CHECKPOINT_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{seq} {offset}")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def pending_bytes(self) -> int:
+        """尚未重放的数据字节数（近似值，包含未删除分段中已重放的部分）"""
+        total = 0
+        for seq in self._segments():
+            try:
+                total += os.path.getsize(self._segment_path(seq))
+            except FileNotFoundError:
+                continue
+        return total
+
+    def get_metrics(self) -> Dict[str, int]:
+        """返回计数器以及当前的分段数和待重放字节数"""
+        return {**self.metrics, 'segments': len(self._segments()), 'pending_bytes': self.pending_bytes()}
+
+    # ===== 写入 =====
+
+    @staticmethod
+    def _encode(topic: str, messages: List[Any]) -> bytes:
+        encoded = [
+            {_BYTES_KEY: base64.b64encode(m).decode('ascii')} if isinstance(m, (bytes, bytearray)) else m
+            for m in messages
+        ]
+        return json.dumps({'topic': topic, 'messages': encoded}, ensure_ascii=False).encode('utf-8')
+
+    @staticmethod
+    def _decode(payload: bytes) -> Tuple[str, List[Any]]:
+        record = json.loads(payload.decode('utf-8'))
+        messages = [
+            base64.b64decode(m[_BYTES_KEY]) if isinstance(m, dict) and list(m) == [_BYTES_KEY] else m
+            for m in record['messages']
+        ]
+        return record['topic'], messages
+
+    def append(self, topic: str, messages: List[Any]) -> None:
+        """
+        追加一个失败批次
+
+        异常:
+            SpoolFullError: spool总大小已达到max_total_bytes
+            TypeError/ValueError: 消息无法编码为JSON
+            OSError: 写入分段文件失败
+        """
+        payload = self._encode(topic, messages)
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._write_lock:
+            if self.pending_bytes() + len(record) > self.max_total_bytes:
+                self.metrics['rejected_batches'] += 1
+                raise SpoolFullError(f"spool已满 ({self.max_total_bytes} 字节)，拒绝写入topic {topic} 的 {len(messages)} 条消息")
+
+            if self._writer is None or self._writer.tell() + len(record) > self.segment_max_bytes:
+                self._rotate()
+            try:
+                self._writer.write(record)
+                self._writer.flush()
+                if self.fsync:
+                    os.fsync(self._writer.fileno())
+            except OSError:
+                # 可能只写入了半条记录：放弃当前分段，之后的记录写入新分段，
+                # 旧分段末尾的半条记录在重放时丢弃
+                self._abandon_writer()
+                raise
+
+            self.metrics['appended_batches'] += 1
+            self.metrics['appended_bytes'] += len(record)
+
+    def _rotate(self) -> None:
+        """关闭当前分段，打开下一个序号的新分段"""
+        if self._writer is not None:
+            self._writer.close()
+        segments = self._segments()
+        checkpoint_seq, _ = self._read_checkpoint()
+        next_seq = max(segments[-1] if segments else 0, checkpoint_seq) + 1
+        self._writer = open(self._segment_path(next_seq), 'ab')
+
+    def _abandon_writer(self) -> None:
+        try:
+            self._writer.close()
+        except OSError:
+            pass
+        self._writer = None
+
+    def _active_segment(self) -> Optional[int]:
+        if self._writer is None:
+            return None
+        name = os.path.basename(self._writer.name)
+        return int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+    # ===== 重放 =====
+
+    def has_pending(self) -> bool:
+        """是否还有未重放的批次"""
+        checkpoint_seq, checkpoint_offset = self._read_checkpoint()
+        for seq in self._segments():
+            if seq > checkpoint_seq:
+                return True
+            try:
+                if seq == checkpoint_seq and os.path.getsize(self._segment_path(seq)) > checkpoint_offset:
+                    return True
+            except FileNotFoundError:
+                continue
+        return False
+
+    def replay(self, send_func: Callable[[str, List[Any]], bool]) -> bool:
+        """
+        按写入顺序重放批次，遇到发送失败立即停止（保证顺序）
+
+        参数:
+            send_func: 发送函数，参数为(topic, messages)，返回是否成功
+
+        返回:
+            bool: 是否已全部重放完毕
+        """
+        with self._replay_lock:
+            checkpoint_seq, checkpoint_offset = self._read_checkpoint()
+            for seq in self._segments():
+                if seq < checkpoint_seq:
+                    # 已经重放完但删除失败的分段
+                    self._remove_segment(seq)
+                    continue
+                offset = checkpoint_offset if seq == checkpoint_seq else 0
+                while True:
+                    start_offset = offset
+                    offset, drained = self._replay_segment(seq, offset, send_func)
+                    if not drained:
+                        return False
+                    with self._write_lock:
+                        active = seq == self._active_segment()
+                        if os.path.getsize(self._segment_path(seq)) != offset:
+                            if active or offset != start_offset:
+                                # 重放期间又有新记录写入该分段，继续重放
+                                continue
+                            # 非当前分段末尾的半条记录（写入时进程崩溃），丢弃
+                            logger.error(f"spool分段 {seq} 末尾存在不完整的记录，已丢弃")
+                            self.metrics['corrupt_records'] += 1
+                        if active:
+                            # 当前写入的分段已全部重放，关闭后下次写入会新建分段
+                            self._writer.close()
+                            self._writer = None
+                        # 先推进checkpoint再删除分段，避免崩溃后重复重放整个分段
+                        self._write_checkpoint(seq + 1, 0)
+                        self._remove_segment(seq)
+                        break
+            return True
+
+    def _replay_segment(self, seq: int, offset: int,
+                        send_func: Callable[[str, List[Any]], bool]) -> Tuple[int, bool]:
+        """
+        从offset开始重放一个分段
+
+        返回:
+            tuple: (重放到的偏移量, 是否已读到分段末尾)
+        """
+        with open(self._segment_path(seq), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    # 分段末尾（或写入中的半条记录）
+                    return offset, True
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return offset, True
+
+                next_offset = offset + _HEADER.size + length
+                if zlib.crc32(payload) != crc:
+                    # 损坏的记录无法恢复，跳过并计数
+                    logger.error(f"spool分段 {seq} 偏移量 {offset} 处的记录校验失败，已跳过")
+                    self.metrics['corrupt_records'] += 1
+                else:
+                    topic, messages = self._decode(payload)
+                    if not send_func(topic, messages):
+                        self.metrics['replay_failures'] += 1
+                        self._write_checkpoint(seq, offset)
+                        return offset, False
+                    self.metrics['replayed_batches'] += 1
+
+                offset = next_offset
+                self._write_checkpoint(seq, offset)
+
+    def _remove_segment(self, seq: int) -> None:
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+
+    # ===== 后台重放 =====
+
+    def start_drainer(self, send_func: Callable[[str, List[Any]], bool], interval: float = 30.0) -> None:
+        """启动后台线程，每隔interval秒尝试重放一次"""
+        if self._drainer is not None and self._drainer.is_alive():
+            return
+        self._stop_event.clear()
+
+        def drain_loop():
+            while not self._stop_event.wait(interval):
+                if not self.has_pending():
+                    continue
+                try:
+                    if self.replay(send_func):
+                        logger.info(f"spool已全部重放完毕: {self.get_metrics()}")
+                except Exception as e:
+                    logger.error(f"spool重放出错: {str(e)}")
+
+        self._drainer = threading.Thread(target=drain_loop, name='spool-drainer', daemon=True)
+        self._drainer.start()
+
+    def stop_drainer(self) -> None:
+        self._stop_event.set()
+        if self._drainer is not None:
+            self._drainer.join()
+            self._drainer = None
+
+    def close(self) -> None:
+        """停止后台线程并关闭当前分段"""
+        self.stop_drainer()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
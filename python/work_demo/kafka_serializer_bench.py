@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kafka序列化器与压缩算法基准测试
+
+使用 apps/apps_1222.py 中的 MockKafkaProducer 作为broker替身，
+通过 KafkaBatchPusher 按批次推送，对每种 序列化器 x 压缩算法 组合统计：
+- 吞吐量（条/秒，包含序列化和压缩耗时）
+- 传输字节数（每个批次拼接后按压缩算法压缩的大小，近似producer的批次压缩）
+
+未安装依赖的序列化器/压缩算法会自动跳过。
+
+用法：
+python kafka_serializer_bench.py [消息条数]
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1222 import MockKafkaProducer
+from kafka_batch_pusher import KafkaBatchPusher
+from kafka_serializers import available_compressions, available_serializers, compress
+
+
+class CompressingMockProducer(MockKafkaProducer):
+    """在MockKafkaProducer基础上按批次压缩，统计实际传输字节数"""
+
+    def __init__(self, compression_type=None):
+        super().__init__()
+        self.compression_type = compression_type
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def send(self, topic, message):
+        payload = b''.join(message)
+        self.raw_bytes += len(payload)
+        self.wire_bytes += len(compress(payload, self.compression_type))
+        super().send(topic, message)
+
+
+def generate_events(count):
+    """生成与 apps_1222.generate_test_data 结构类似的事件数据"""
+    return [
+        {
+            'user_id': i,
+            'event_type': 'login' if i % 3 else 'logout',
+            'timestamp': f'2024-01-01 12:{(i // 60) % 60:02d}:{i % 60:02d}',
+            'device': {'os': 'linux', 'version': '1.2.3', 'ip': f'10.0.{i % 256}.{i % 200}'},
+            'tags': ['web', 'cn-north', '用户事件'],
+        }
+        for i in range(count)
+    ]
+
+
+def run_benchmark(count=100000, batch_size=500):
+    """
+    运行基准测试
+
+    返回:
+        list: 每种组合的结果字典
+    """
+    events = {'user_event': generate_events(count)}
+    results = []
+    for serializer in available_serializers():
+        for compression_type in available_compressions():
+            producer = CompressingMockProducer(compression_type)
+            pusher = KafkaBatchPusher(producer, batch_size=batch_size, serializer=serializer)
+            start = time.perf_counter()
+            pusher.push_messages(events)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'serializer': serializer,
+                'compression': compression_type or 'none',
+                'msgs_per_sec': count / elapsed,
+                'raw_bytes': producer.raw_bytes,
+                'wire_bytes': producer.wire_bytes,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    # 屏蔽推送过程中的逐批日志
+    logging.getLogger().setLevel(logging.WARNING)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"消息条数: {count}")
+    print(f"{'序列化器':<10}{'压缩':<10}{'吞吐量(条/秒)':>16}{'序列化字节':>14}{'传输字节':>14}")
+    for row in run_benchmark(count):
+        print(f"{row['serializer']:<12}{row['compression']:<12}{row['msgs_per_sec']:>16,.0f}"
+              f"{row['raw_bytes']:>16,}{row['wire_bytes']:>16,}")
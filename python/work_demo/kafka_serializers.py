@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kafka消息序列化与压缩
+
+提供可插拔的value/key序列化器（key默认按字符串编码，可通过resolve_key_serializer替换），供 kafka_batch_sender.py 和 kafka_batch_pusher.py 使用：
+- json: 标准库json（默认，无额外依赖）
+- orjson: 需要 pip install orjson，序列化速度通常是标准库的数倍
+- msgpack: 需要 pip install msgpack，二进制格式，体积更小
+
+json/orjson序列化器对str消息直接按UTF-8编码发送，与原有行为一致；
+msgpack序列化器对所有消息（包括str）都按msgpack格式打包，消费端需用msgpack解码。
+
+压缩由KafkaProducer的compression_type参数完成，这里只负责检查依赖是否可用，
+并提供compress函数供基准测试估算实际传输字节数。
+"""
+
+import gzip
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 可选依赖，未安装时对应的序列化器/压缩算法不可用
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+
+Serializer = Callable[[Any], bytes]
+
+
+def _json_serializer(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _orjson_serializer(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return orjson.dumps(value)
+
+
+def _msgpack_serializer(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+# 序列化器名称 -> (序列化函数, 依赖模块)
+SERIALIZERS: Dict[str, tuple] = {
+    'json': (_json_serializer, json),
+    'orjson': (_orjson_serializer, orjson),
+    'msgpack': (_msgpack_serializer, msgpack),
+}
+
+# KafkaProducer支持的compression_type -> 依赖模块（None表示不压缩）
+COMPRESSION_TYPES: Dict[Optional[str], Any] = {
+    None: True,
+    'gzip': gzip,
+    'lz4': lz4_frame,
+    'zstd': zstandard,
+    'snappy': snappy,
+}
+
+
+def available_serializers() -> list:
+    """返回当前环境中可用的序列化器名称"""
+    return [name for name, (_, module) in SERIALIZERS.items() if module is not None]
+
+
+def available_compressions() -> list:
+    """返回当前环境中可用的压缩算法（None表示不压缩）"""
+    return [name for name, module in COMPRESSION_TYPES.items() if module is not None]
+
+
+def get_serializer(name: str = 'json') -> Serializer:
+    """
+    获取value序列化器
+
+    参数:
+        name: 序列化器名称，json/orjson/msgpack
+
+    返回:
+        Callable: 将消息转换为bytes的函数
+
+    异常:
+        ValueError: 序列化器不存在或依赖未安装
+    """
+    if name not in SERIALIZERS:
+        raise ValueError(f"不支持的序列化器: {name}，可选: {', '.join(SERIALIZERS)}")
+    serializer, module = SERIALIZERS[name]
+    if module is None:
+        raise ValueError(f"序列化器 {name} 的依赖未安装，请运行: pip install {name}")
+    return serializer
+
+
+def resolve_serializer(serializer: Any = 'json') -> Serializer:
+    """序列化器参数既可以是名称，也可以是自定义的序列化函数"""
+    if callable(serializer):
+        return serializer
+    return get_serializer(serializer)
+
+
+def serialize_key(key: Any) -> Optional[bytes]:
+    """key序列化器：None保持None，bytes原样返回，其他转为字符串后按UTF-8编码"""
+    if key is None:
+        return None
+    if isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def resolve_key_serializer(key_serializer: Any = 'str') -> Callable[[Any], Optional[bytes]]:
+    """
+    获取key序列化器
+
+    参数:
+        key_serializer: 'str'（默认，转为字符串后按UTF-8编码，见serialize_key）、
+            value序列化器名称（json/orjson/msgpack）或自定义序列化函数
+
+    返回:
+        Callable: 将key转换为bytes的函数，None始终保持None（不指定key时按分区策略分配）
+
+    异常:
+        ValueError: 序列化器不存在或依赖未安装
+    """
+    if key_serializer == 'str':
+        return serialize_key
+    serializer = resolve_serializer(key_serializer)
+
+    def _serialize(key: Any) -> Optional[bytes]:
+        return None if key is None else serializer(key)
+
+    return _serialize
+
+
+def check_compression(compression_type: Optional[str]) -> Optional[str]:
+    """
+    检查压缩算法是否可用
+
+    异常:
+        ValueError: 压缩算法不存在或依赖未安装
+    """
+    if compression_type not in COMPRESSION_TYPES:
+        raise ValueError(f"不支持的压缩算法: {compression_type}，可选: gzip, lz4, zstd, snappy")
+    if COMPRESSION_TYPES[compression_type] is None:
+        package = {'lz4': 'lz4', 'zstd': 'zstandard', 'snappy': 'python-snappy'}[compression_type]
+        raise ValueError(f"压缩算法 {compression_type} 的依赖未安装，请运行: pip install {package}")
+    return compression_type
+
+
+def compress(data: bytes, compression_type: Optional[str]) -> bytes:
+    """按指定算法压缩数据（用于估算压缩后的传输字节数）"""
+    check_compression(compression_type)
+    if compression_type is None:
+        return data
+    if compression_type == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if compression_type == 'lz4':
+        return lz4_frame.compress(data)
+    if compression_type == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return snappy.compress(data)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""测试流式附件提取：内容与parse_email一致、按哈希去重、类型/大小过滤、分段FETCH读取"""
+
+import hashlib
+import io
+import os
+import sys
+import tempfile
+from email import encoders
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1208 import AttachmentSink, IMAPBodyStream, extract_attachments, parse_email
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+
+def create_test_email(pdf_bytes):
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = '测试附件'
+    msg['From'] = 'test@example.com'
+
+    body = MIMEMultipart('alternative')
+    body.attach(MIMEText('纯文本正文', 'plain', 'utf-8'))
+    body.attach(MIMEText('<p>HTML正文</p>', 'html', 'utf-8'))
+    msg.attach(body)
+
+    pdf = MIMEApplication(pdf_bytes, _subtype='pdf')
+    pdf.add_header('Content-Disposition', 'attachment', filename=('utf-8', '', '季度报告.pdf'))
+    msg.attach(pdf)
+
+    image = MIMEImage(PNG, _subtype='png')
+    image.add_header('Content-Disposition', 'attachment', filename='chart.png')
+    msg.attach(image)
+
+    text = MIMEApplication(b'a=b\r\n' * 50 + b'\xe4\xb8\xad', _subtype='octet-stream', _encoder=encoders.encode_quopri)
+    text.add_header('Content-Disposition', 'attachment', filename='data.bin')
+    msg.attach(text)
+    return msg.as_bytes()
+
+
+class MemorySink(AttachmentSink):
+    def __init__(self):
+        self.files = {}
+        self._current = None
+
+    def open(self, info):
+        self._current = io.BytesIO()
+
+    def write(self, data):
+        self._current.write(data)
+
+    def close(self, info):
+        self.files[info['filename']] = self._current.getvalue()
+        return f"memory://{info['filename']}"
+
+
+def test_stream_matches_parse_email():
+    raw = create_test_email(os.urandom(200000))
+    expected = {a['filename']: a['payload'] for a in parse_email(raw)['attachments']}
+
+    sink = MemorySink()
+    # 小的chunk_size，覆盖长行被截断的情况
+    attachments = extract_attachments(raw, sink=sink, chunk_size=37)
+
+    assert [a['filename'] for a in attachments] == ['季度报告.pdf', 'chart.png', 'data.bin']
+    assert sink.files == expected
+    for info in attachments:
+        assert info['sha256'] == hashlib.sha256(expected[info['filename']]).hexdigest()
+        assert info['size'] == len(expected[info['filename']])
+
+
+def test_dedup_and_filters():
+    pdf_bytes = os.urandom(50000)
+    with tempfile.TemporaryDirectory() as output_dir:
+        first = extract_attachments(create_test_email(pdf_bytes), output_dir)
+        second = extract_attachments(create_test_email(pdf_bytes), output_dir)
+        assert not any(a['duplicate'] for a in first)
+        assert all(a['duplicate'] for a in second)
+        assert [a['path'] for a in first] == [a['path'] for a in second]
+        with open(first[0]['path'], 'rb') as f:
+            assert f.read() == pdf_bytes
+        # 每个不同内容只保存一份，没有残留的临时文件
+        stored = [name for _, _, files in os.walk(output_dir) for name in files]
+        assert len(stored) == 3
+
+        filtered = extract_attachments(create_test_email(pdf_bytes), output_dir,
+                                       allowed_types=['application/*'], skip_types=['application/octet-stream'],
+                                       max_size=40000)
+        assert [a['skipped'] for a in filtered] == ['too_large', 'type_not_allowed', 'type_skipped']
+        assert all(a['path'] is None for a in filtered)
+
+
+class PartialFetchIMAP:
+    """模拟支持 BODY.PEEK[]<偏移.长度> 的IMAP服务器"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.fetches = 0
+
+    def uid(self, command, uid, items):
+        start, length = map(int, items[items.index('<') + 1:items.index('>')].split('.'))
+        self.fetches += 1
+        chunk = self.raw[start:start + length]
+        return 'OK', [(f'1 (UID {uid} BODY[]<{start}> {{{len(chunk)}}}'.encode(), chunk), b')']
+
+
+def test_imap_partial_fetch_stream():
+    raw = create_test_email(os.urandom(100000))
+    mail = PartialFetchIMAP(raw)
+    stream = io.BufferedReader(IMAPBodyStream(mail, 7, chunk_size=16384), 16384)
+    sink = MemorySink()
+    extract_attachments(stream, sink=sink)
+
+    assert sink.files == {a['filename']: a['payload'] for a in parse_email(raw)['attachments']}
+    assert mail.fetches >= len(raw) // 16384
+
+
+if __name__ == '__main__':
+    test_stream_matches_parse_email()
+    test_dedup_and_filters()
+    test_imap_partial_fetch_stream()
+    print("全部测试通过")
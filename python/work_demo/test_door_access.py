@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""测试门禁时间合并脚本（fakeredis[lua]执行真实的Lua脚本）、批量接口和共享连接池"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+import fakeredis
+
+import apps_1030
+from apps_1030 import (CACHE_KEY_PREFIX, TIME_FORMAT, MERGE_ACCESS_SCRIPT, get_door_access_time,
+                       get_door_access_times, get_redis_client, query_door_access_times)
+
+
+def make_client():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+
+def future(days=1, hour=18):
+    """相对今天的时间字符串，保证缓存不会在测试中过期"""
+    day = datetime.now().replace(hour=hour, minute=0, second=0, microsecond=0) + timedelta(days=days)
+    return day.strftime(TIME_FORMAT)
+
+
+def run_merge(r, username, start_time, end_time, expire_at):
+    value = r.eval(MERGE_ACCESS_SCRIPT, 1, f"{CACHE_KEY_PREFIX}{username}", username, start_time, end_time, expire_at)
+    return json.loads(value)
+
+
+def test_merge_keeps_earliest_start_and_latest_end():
+    """按字符串比较合并：取最早开始时间、最晚结束时间和最晚过期时间"""
+    r = make_client()
+    later = int(time.time()) + 7200
+    first = run_merge(r, 'u', '2099-01-02 18:00:00', '2099-01-03 09:00:00', later)
+    assert (first['start_time'], first['end_time']) == ('2099-01-02 18:00:00', '2099-01-03 09:00:00')
+
+    # 更早的开始、更早的结束：只更新开始时间
+    merged = run_merge(r, 'u', '2099-01-02 08:00:00', '2099-01-02 09:00:00', later - 3600)
+    assert (merged['start_time'], merged['end_time']) == ('2099-01-02 08:00:00', '2099-01-03 09:00:00')
+    assert merged['expire_at'] == later
+
+    # 更晚的开始、更晚的结束：只更新结束时间
+    merged = run_merge(r, 'u', '2099-01-03 10:00:00', '2099-01-04 09:00:00', later + 3600)
+    assert (merged['start_time'], merged['end_time']) == ('2099-01-02 08:00:00', '2099-01-04 09:00:00')
+    assert json.loads(r.get(f"{CACHE_KEY_PREFIX}u")) == merged
+    assert r.expiretime(f"{CACHE_KEY_PREFIX}u") == later + 3600
+
+
+def test_merge_ignores_malformed_cache():
+    """缓存内容无法解析时按新记录处理"""
+    r = make_client()
+    r.set(f"{CACHE_KEY_PREFIX}u", 'not json')
+    merged = run_merge(r, 'u', '2099-01-02 18:00:00', '2099-01-03 09:00:00', int(time.time()) + 60)
+    assert merged['start_time'] == '2099-01-02 18:00:00'
+
+
+def test_expiry_at_end_time():
+    """过期时间为结束时间（Redis的TIME）；结束时间已过的记录直接删除，未过期时设置EXPIREAT"""
+    r = make_client()
+    key = f"{CACHE_KEY_PREFIX}u"
+    now = int(r.time()[0])
+
+    run_merge(r, 'u', '2000-01-01 18:00:00', '2000-01-02 09:00:00', now)
+    assert not r.exists(key), "过期时间等于当前时间时应删除"
+
+    run_merge(r, 'u', '2000-01-01 18:00:00', '2000-01-02 09:00:00', now + 100)
+    assert r.expiretime(key) == now + 100
+    assert 0 < r.ttl(key) <= 100
+
+    # 已存在的缓存也已过期：合并后仍然过期，删除键
+    r.set(key, json.dumps({'username': 'u', 'start_time': '2000-01-01 18:00:00',
+                           'end_time': '2000-01-02 09:00:00', 'expire_at': now - 10}))
+    run_merge(r, 'u', '2000-01-01 20:00:00', '2000-01-02 09:00:00', now - 5)
+    assert not r.exists(key)
+
+    # 通过get_door_access_time：过期时间为结束时间的时间戳
+    result = get_door_access_time('v', future(hour=18), start_offset_hours=0, end_offset_hours=0, redis_client=r)
+    end = datetime.strptime(result['end_time'], TIME_FORMAT)
+    assert end.hour == 9
+    assert r.expiretime(f"{CACHE_KEY_PREFIX}v") == int(end.timestamp()) + apps_1030.DOOR_ACCESS_GRACE_SECONDS
+
+
+def test_concurrent_events_on_one_key():
+    """同一用户并发刷卡不会丢失更新：最终结果是所有请求的最早开始和最晚结束"""
+    r = make_client()
+    starts = [future(days=1 + i % 5, hour=10 + i % 12) for i in range(40)]
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def worker(chunk):
+        try:
+            barrier.wait()
+            for start in chunk:
+                get_door_access_time('u', start, start_offset_hours=0, end_offset_hours=0, redis_client=r)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(starts[i::8],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    cached = json.loads(r.get(f"{CACHE_KEY_PREFIX}u"))
+    ends = [(datetime.strptime(s, TIME_FORMAT).replace(hour=9) + timedelta(days=1)).strftime(TIME_FORMAT)
+            for s in starts]
+    assert cached['start_time'] == min(starts)
+    assert cached['end_time'] == max(ends)
+
+
+def test_bulk_results_follow_input_order():
+    """批量接口在一个pipeline中执行，结果与输入顺序一致，同一用户的请求依次合并"""
+    r = make_client()
+    requests_list = [
+        {'username': 'b', 'planned_start_time': future(days=2, hour=20)},
+        {'username': 'a', 'planned_start_time': future(days=1, hour=10), 'start_offset_hours': 0},
+        {'username': 'b', 'planned_start_time': future(days=1, hour=12), 'end_offset_hours': 0},
+    ]
+    results = get_door_access_times(requests_list, redis_client=r)
+
+    assert [result['username'] for result in results] == ['b', 'a', 'b']
+    assert results[1]['start_time'] == future(days=1, hour=10)
+    # 第二个b请求与第一个合并：开始时间取更早的，结束时间保留第一个请求的第二天09:00
+    assert results[2]['start_time'] == future(days=1, hour=13)
+    assert results[2]['end_time'] == future(days=3, hour=9)
+    assert get_door_access_times([], redis_client=r) == []
+
+    # 参数无效时整批不写入
+    try:
+        get_door_access_times([{'username': 'c', 'planned_start_time': future()},
+                               {'username': 'd', 'planned_start_time': 'bad'}], redis_client=r)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("参数无效时应该抛出ValueError")
+    assert not r.exists(f"{CACHE_KEY_PREFIX}c")
+
+
+def test_query_handles_missing_and_malformed_keys():
+    """MGET结果按输入顺序对应用户，没有缓存或缓存无法解析的用户为None"""
+    r = make_client()
+    get_door_access_time('a', future(), redis_client=r)
+    r.set(f"{CACHE_KEY_PREFIX}broken", '{')
+
+    result = query_door_access_times(['nobody', 'a', 'broken'], redis_client=r)
+    assert list(result) == ['nobody', 'a', 'broken']
+    assert result['nobody'] is None and result['broken'] is None
+    assert result['a']['username'] == 'a'
+    assert query_door_access_times([], redis_client=r) == {}
+
+
+def test_shared_connection_pool():
+    """所有线程拿到的客户端共享同一个连接池，连接池只创建一次"""
+    apps_1030._redis_pool = None
+    try:
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(get_redis_client())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        pools = {id(client.connection_pool) for client in clients}
+        assert len(pools) == 1
+        pool = clients[0].connection_pool
+        assert pool is apps_1030._redis_pool
+        assert pool.max_connections == apps_1030.REDIS_MAX_CONNECTIONS
+        assert pool.connection_kwargs['decode_responses'] is True
+        assert get_redis_client().connection_pool is pool
+    finally:
+        if apps_1030._redis_pool is not None:
+            apps_1030._redis_pool.disconnect()
+        apps_1030._redis_pool = None
+
+
+if __name__ == '__main__':
+    test_merge_keeps_earliest_start_and_latest_end()
+    test_merge_ignores_malformed_cache()
+    test_expiry_at_end_time()
+    test_concurrent_events_on_one_key()
+    test_bulk_results_follow_input_order()
+    test_query_handles_missing_and_malformed_keys()
+    test_shared_connection_pool()
+    print("全部测试通过")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""测试邮件批量分类流水线和结果缓存（使用本地分类器和本地HTTP接口，不需要Dify服务）"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from email.header import Header
+from email.mime.text import MIMEText
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1208 import LazyEmail
+from apps_1210 import (ClassificationCache, DifyMailClassifier, LocalStubClassifier, classify_emails,
+                       email_uid_from_headers, normalize_body)
+from apps_1215 import generate_email_uid
+
+TITLES = ['报销申请', '周会通知', '工资明细', '采购审批', '项目进度']
+
+
+def make_mails(count, start=0):
+    return [{'title': f'{TITLES[i % len(TITLES)]} {i}', 'sender': f'user{i} <user{i}@example.com>',
+             'content': f'第{i}封邮件的正文', 'sent_time': f'2024-06-15 10:{i % 60:02d}:00'}
+            for i in range(start, start + count)]
+
+
+def test_batches_concurrency_and_cache():
+    """按批次并发分类，重新运行时只分类新邮件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ClassificationCache(os.path.join(tmp, 'cache.db'))
+        classifier = LocalStubClassifier(delay=0.05)
+        results = classify_emails(make_mails(25), classifier, cache, batch_size=10, max_workers=2)
+
+        print(f"批次: {classifier.batches}, 最大并发: {classifier.max_active}")
+        assert sorted(classifier.batches) == [5, 10, 10]
+        assert classifier.max_active == 2
+        assert [result['title'] for result in results] == [mail['title'] for mail in make_mails(25)]
+        assert [result['analysis_type'] for result in results[:5]] == ['审批建议', '关注', '不处理', '审批建议', '关注']
+        assert results[0]['uid'] == generate_email_uid('user0 <user0@example.com>', '报销申请 0', '2024-06-15 10:00:00')
+        assert not any(result['cached'] for result in results)
+
+        rerun = LocalStubClassifier()
+        results = classify_emails(make_mails(30), rerun, cache, batch_size=10)
+        cache.close()
+
+    print(f"重新运行的批次: {rerun.batches}")
+    assert rerun.batches == [5]
+    assert sum(result['cached'] for result in results) == 25
+
+
+def test_failures_are_not_cached():
+    """分类失败或结果无效的邮件单独报告错误，下次运行重新分类"""
+    def flaky(mails):
+        if any('周会' in mail['title'] for mail in mails):
+            raise ConnectionError('接口超时')
+        results = [LocalStubClassifier().classify(mail) for mail in mails]
+        for result in results:
+            if '项目' in result['title']:
+                result['analysis_type'] = '其他'
+        return results
+
+    cache = ClassificationCache(':memory:')
+    results = classify_emails(make_mails(5), flaky, cache, batch_size=1)
+    errors = {result['title']: result.get('error') for result in results}
+    print(f"错误: {errors}")
+    assert '接口超时' in errors['周会通知 1']
+    assert '未知的分析类型' in errors['项目进度 4']
+    assert sum(error is None for error in errors.values()) == 3
+
+    classifier = LocalStubClassifier()
+    results = classify_emails(make_mails(5), classifier, cache, batch_size=10)
+    assert classifier.batches == [2]
+    assert all('error' not in result for result in results)
+    cache.close()
+
+
+class _ChatCompletionsHandler(BaseHTTPRequestHandler):
+    """模拟Dify的chat/completions接口，用本地分类器生成结果"""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        _ChatCompletionsHandler.requests.append((self.headers['Authorization'], body))
+        prompt = body['messages'][1]['content']
+        mails = []
+        for section in prompt.split('### ')[1:]:
+            fields = dict(line.split('：', 1) for line in section.splitlines()[1:] if '：' in line)
+            mails.append({'title': fields['邮件标题'], 'sender': fields['发送人'],
+                          'content': fields['邮件正文'], 'uid': fields['邮件UID']})
+        content = json.dumps({'results': [LocalStubClassifier().classify(mail) for mail in mails]},
+                             ensure_ascii=False)
+        response = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': content}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_classifier_with_normalized_bodies():
+    """通过HTTP接口批量分类，请求中的正文已去掉引用内容并截断"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ChatCompletionsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _ChatCompletionsHandler.requests = []
+    mails = make_mails(7)
+    mails[0]['content'] = '请审批本次报销。\n\n\n' + '明细' * 100 + '\n--- 原始邮件 ---\n> 旧内容'
+    try:
+        classifier = DifyMailClassifier('test-key', url=f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions')
+        results = classify_emails(mails, classifier, batch_size=3, max_body_chars=50)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    prompts = '\n'.join(body['messages'][1]['content'] for _, body in _ChatCompletionsHandler.requests)
+    print(f"请求数: {len(_ChatCompletionsHandler.requests)}, 第一封正文: {results[0]['content_summary'][:30]}...")
+    assert len(_ChatCompletionsHandler.requests) == 3
+    assert all(auth == 'Bearer test-key' for auth, _ in _ChatCompletionsHandler.requests)
+    assert '原始邮件' not in prompts and '旧内容' not in prompts
+    normalized = normalize_body(mails[0]['content'], 50)
+    assert normalized.startswith('请审批本次报销。\n明细') and normalized.endswith('…')
+    assert len(normalized) == 51
+    assert f'邮件正文：{normalized}\n' in prompts
+    assert results[0]['analysis_type'] == '审批建议'
+    assert all('error' not in result for result in results)
+
+
+class FakeIMAP:
+    def __init__(self, raw_emails):
+        self.raw_emails = raw_emails
+        self.body_fetches = 0
+
+    def uid(self, command, uid, items):
+        self.body_fetches += 1
+        return 'OK', [(b'1 (UID %s BODY[] {0}' % uid.encode(), self.raw_emails[int(uid)]), b')']
+
+
+def test_lazy_emails_skip_body_download_when_cached():
+    """邮件UID与apps_1215一致；已缓存的邮件不下载正文"""
+    raw_emails = {}
+    for uid in range(1, 4):
+        msg = MIMEText(f'请审批第{uid}份采购单', 'plain', 'utf-8')
+        msg['Subject'] = Header(f'采购申请{uid}', 'utf-8')
+        msg['From'] = f'Buyer {uid} <buyer{uid}@example.com>'
+        msg['Date'] = 'Sat, 15 Jun 2024 10:00:00 +0800'
+        raw_emails[uid] = msg.as_bytes()
+    mail = FakeIMAP(raw_emails)
+    header_end = {uid: raw.index(b'\n\n') + 2 for uid, raw in raw_emails.items()}
+    emails = [LazyEmail(mail, uid, len(raw), [], raw[:header_end[uid]]) for uid, raw in raw_emails.items()]
+
+    headers = emails[0].headers
+    assert email_uid_from_headers(headers) == generate_email_uid(headers['From'], headers['Subject'], '2024-06-15 10:00:00')
+
+    cache = ClassificationCache(':memory:')
+    results = classify_emails(emails, LocalStubClassifier(), cache)
+    assert mail.body_fetches == 3
+    assert [result['analysis_type'] for result in results] == ['审批建议'] * 3
+    assert results[0]['title'] == '采购申请1'
+
+    fresh = [LazyEmail(mail, uid, len(raw), [], raw[:header_end[uid]]) for uid, raw in raw_emails.items()]
+    results = classify_emails(fresh, LocalStubClassifier(), cache)
+    cache.close()
+    print(f"正文下载次数: {mail.body_fetches}")
+    assert mail.body_fetches == 3
+    assert all(result['cached'] for result in results)
+
+
+if __name__ == '__main__':
+    test_batches_concurrency_and_cache()
+    test_failures_are_not_cached()
+    test_http_classifier_with_normalized_bodies()
+    test_lazy_emails_skip_body_download_when_cached()
+    print("全部测试通过")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""测试派生密钥缓存和批量加解密接口"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_0107 import (DerivedKeyCache, _bulk_chunks, configure_derived_key_cache, decrypt_data, decrypt_many,
+                       encrypt_data, encrypt_many, verify_data, verify_many)
+
+MASTER_KEY = "test_master_key"
+
+
+def test_cache_skips_repeated_derivation():
+    """同一主密钥和用户名只派生一次密钥，缓存前后的密文可以互相解密"""
+    cache = configure_derived_key_cache(0)
+    uncached = encrypt_data('secret-1', 'alice', MASTER_KEY)['data']
+
+    cache = configure_derived_key_cache()
+    encrypted = [encrypt_data(f'secret-{i}', 'alice', MASTER_KEY)['data'] for i in range(5)]
+    print(f"命中: {cache.hits}, 未命中: {cache.misses}")
+    assert (cache.hits, cache.misses) == (4, 1)
+
+    assert decrypt_data(uncached, 'alice', MASTER_KEY)['data'] == 'secret-1'
+    assert [decrypt_data(data, 'alice', MASTER_KEY)['data'] for data in encrypted] == \
+        [f'secret-{i}' for i in range(5)]
+    assert verify_data(encrypted[2], 'alice', MASTER_KEY, 'secret-2')
+    assert cache.misses == 1
+
+
+def test_wrong_key_is_not_cached():
+    """错误的主密钥解密失败，且不会放入缓存"""
+    encrypted = encrypt_data('secret', 'bob', MASTER_KEY)['data']
+    cache = configure_derived_key_cache()
+    for _ in range(2):
+        result = decrypt_data(encrypted, 'bob', 'wrong_key')
+        assert not result['status'] and 'HMAC' in result['message']
+    assert len(cache) == 0 and cache.misses == 2
+
+    assert decrypt_data(encrypted, 'bob', MASTER_KEY)['status']
+    assert len(cache) == 1
+
+
+def test_eviction_wipes_keys():
+    """超过容量时淘汰最久未使用的条目，并用0覆盖其中的密钥"""
+    cache = DerivedKeyCache(maxsize=2)
+    cache.put(MASTER_KEY, 'a', b'\x01' * 64)
+    cache.put(MASTER_KEY, 'b', b'\x02' * 64)
+    stored = list(cache._entries.values())
+    assert cache.get(MASTER_KEY, 'a') == b'\x01' * 64
+
+    cache.put(MASTER_KEY, 'c', b'\x03' * 64)
+    assert len(cache) == 2
+    assert cache.get(MASTER_KEY, 'b') is None
+    assert stored[1] == bytearray(64)
+    assert cache.get(MASTER_KEY, 'a') == b'\x01' * 64
+
+    cache.clear()
+    assert len(cache) == 0 and stored[0] == bytearray(64)
+
+
+def test_bulk_roundtrip_across_processes():
+    """多进程批量加解密，结果顺序与输入一致，单条记录的错误不影响其他记录"""
+    configure_derived_key_cache()
+    records = [(f'密码{i}', f'user{i % 4}') for i in range(40)]
+    records.append(('', 'user0'))
+    encrypted = encrypt_many(records, MASTER_KEY, processes=2, chunk_size=10)
+
+    assert [result['status'] for result in encrypted] == [True] * 40 + [False]
+    decrypted = decrypt_many([(result['data'], salt) for result, (_, salt) in zip(encrypted[:40], records)],
+                             MASTER_KEY, processes=2, chunk_size=10)
+    print(f"批量解密 {len(decrypted)} 条")
+    assert [result['data'] for result in decrypted] == [data for data, _ in records[:40]]
+
+    checks = verify_many([(encrypted[0]['data'], 'user0', '密码0'), (encrypted[1]['data'], 'user1', '错误')],
+                         MASTER_KEY, processes=1)
+    assert checks == [True, False]
+
+
+def test_single_user_bulk_uses_multiple_chunks():
+    """单个用户的大量记录拆到多个进程任务中，少量记录的用户仍然整组放在同一个任务中"""
+    records = [(f'密码{i}', 'admin') for i in range(25)] + [('a', 'u1'), ('b', 'u2'), ('c', 'u1')]
+    chunks = _bulk_chunks(records, 10)
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 8]
+    assert sorted(index for chunk in chunks for index, _ in chunk) == list(range(28))
+    # 最后一个任务：admin剩余的5条和u1、u2的全部记录
+    assert {record[1] for _, record in chunks[2]} == {'admin', 'u1', 'u2'}
+
+    encrypted = encrypt_many(records[:25], MASTER_KEY, processes=2, chunk_size=10)
+    decrypted = decrypt_many([(result['data'], 'admin') for result in encrypted], MASTER_KEY,
+                             processes=2, chunk_size=10)
+    assert [result['data'] for result in decrypted] == [data for data, _ in records[:25]]
+
+
+if __name__ == '__main__':
+    test_cache_skips_repeated_derivation()
+    test_wrong_key_is_not_cached()
+    test_eviction_wipes_keys()
+    test_bulk_roundtrip_across_processes()
+    test_single_user_bulk_uses_multiple_chunks()
+    print("全部测试通过")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""测试IMAP连接池和多文件夹并行扫描（使用模拟IMAP连接，不需要邮件服务器）"""
+
+import imaplib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_0114_email import IMAPConnectionPool, encode_modified_utf7, scan_email_folders
+
+FOLDERS = ['INBOX', 'Sent', encode_modified_utf7('中文收件箱'), 'Archive/2024'] + [f'Project {i}' for i in range(20)]
+
+
+class FakeIMAP:
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def list(self):
+        lines = [f'(\\HasNoChildren) "/" "{name}"'.encode() for name in FOLDERS]
+        lines.append(b'(\\Noselect \\HasChildren) "/" "Archive"')
+        return 'OK', lines
+
+    def status(self, folder, items):
+        with FakeIMAP.lock:
+            FakeIMAP.active += 1
+            FakeIMAP.max_active = max(FakeIMAP.max_active, FakeIMAP.active)
+        time.sleep(0.01)
+        with FakeIMAP.lock:
+            FakeIMAP.active -= 1
+        if folder == '"Project 7"':
+            return 'NO', [b'folder busy']
+        return 'OK', [f'{folder} (MESSAGES {len(folder)} UNSEEN 1)'.encode()]
+
+    def logout(self):
+        pass
+
+
+def test_parallel_scan_bounded_and_ordered():
+    connections = []
+
+    def connect():
+        mail = FakeIMAP()
+        connections.append(mail)
+        return mail
+
+    pool = IMAPConnectionPool(connect, max_connections=3)
+    results = scan_email_folders(pool)
+    pool.close()
+
+    print(f"创建连接数: {len(connections)}, 最大并发: {FakeIMAP.max_active}")
+    assert [r['raw_name'] for r in results] == FOLDERS
+    assert results[2]['folder'] == '中文收件箱'
+    assert results[0]['messages'] == len('"INBOX"') and results[0]['unseen'] == 1
+    assert 'error' in results[FOLDERS.index('Project 7')]
+    assert len(connections) <= 3
+    assert FakeIMAP.max_active <= 3
+
+
+def test_pool_discards_broken_connections():
+    created = []
+
+    def connect():
+        created.append(1)
+        return FakeIMAP()
+
+    pool = IMAPConnectionPool(connect, max_connections=1)
+    try:
+        with pool.connection():
+            raise imaplib.IMAP4.abort('连接断开')
+    except imaplib.IMAP4.abort:
+        pass
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+    assert len(created) == 2
+
+
+def test_waiters_wake_when_connection_aborts():
+    """线程数多于连接数，持有的连接断开后等待的线程新建连接继续执行，不会一直阻塞"""
+    created = []
+
+    def connect():
+        created.append(1)
+        return FakeIMAP()
+
+    pool = IMAPConnectionPool(connect, max_connections=2)
+    finished = []
+
+    def holder():
+        try:
+            with pool.connection():
+                holding.wait()
+                time.sleep(0.1)
+                raise imaplib.IMAP4.abort('连接断开')
+        except imaplib.IMAP4.abort:
+            pass
+
+    def waiter(i):
+        holding.wait()
+        with pool.connection():
+            time.sleep(0.01)
+        finished.append(i)
+
+    threads = [threading.Thread(target=holder) for _ in range(2)]
+    threads += [threading.Thread(target=waiter, args=(i,), daemon=True) for i in range(5)]
+    holding = threading.Barrier(len(threads))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    print(f"完成的等待线程: {len(finished)}, 创建连接数: {len(created)}")
+    assert sorted(finished) == list(range(5))
+    assert len(created) <= 4
+    assert pool._created <= 2
+    pool.close()
+    try:
+        pool._take(timeout=0.1)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("连接池关闭后仍可借用连接")
+
+
+def test_take_timeout():
+    """连接数已满时按timeout超时"""
+    pool = IMAPConnectionPool(FakeIMAP, max_connections=1)
+    with pool.connection():
+        start = time.monotonic()
+        try:
+            with pool.connection(timeout=0.1):
+                pass
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("应该等待超时")
+        assert time.monotonic() - start >= 0.1
+
+
+if __name__ == '__main__':
+    test_parallel_scan_bounded_and_ordered()
+    test_pool_discards_broken_connections()
+    test_waiters_wake_when_connection_aborts()
+    test_take_timeout()
+    print("全部测试通过")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""测试只获取邮件头的批量UID FETCH和正文懒加载（使用模拟IMAP连接，不需要邮件服务器）"""
+
+import os
+import sys
+from email.header import Header
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1208 import compress_uid_set, fetch_email_headers
+
+
+def make_raw_email(uid):
+    msg = MIMEText(f'正文内容 {uid}', 'plain', 'utf-8')
+    msg['Subject'] = Header(f'测试主题{uid}', 'utf-8')
+    msg['From'] = f'User {uid} <user{uid}@example.com>'
+    return msg.as_bytes()
+
+
+class FakeIMAP:
+    """按imaplib的响应格式返回头字段，记录执行过的命令"""
+
+    def __init__(self, uids):
+        self.messages = {uid: make_raw_email(uid) for uid in uids}
+        self.commands = []
+
+    def uid(self, command, message_set, items):
+        self.commands.append((command, message_set, items))
+        if items == '(BODY.PEEK[])':
+            uid = int(message_set)
+            return 'OK', [(f'1 (UID {uid} BODY[] {{{len(self.messages[uid])}}}'.encode(), self.messages[uid]), b')']
+        data = []
+        for uid in sorted(self.messages):
+            header = self.messages[uid].split(b'\n\n')[0] + b'\r\n\r\n'
+            if uid % 2:
+                # 部分服务器把FLAGS放在头字段之后
+                data.append((f'{uid} (UID {uid} RFC822.SIZE {len(self.messages[uid])} BODY[HEADER.FIELDS (SUBJECT FROM)] {{{len(header)}}}'.encode(), header))
+                data.append(b' FLAGS (\\Seen))')
+            else:
+                data.append((f'{uid} (UID {uid} RFC822.SIZE {len(self.messages[uid])} FLAGS () BODY[HEADER.FIELDS (SUBJECT FROM)] {{{len(header)}}}'.encode(), header))
+                data.append(b')')
+        return 'OK', data
+
+
+def test_compress_uid_set():
+    assert compress_uid_set([5, 1, 2, 3, 7, 8, 8]) == '1:3,5,7:8'
+    assert compress_uid_set([]) == ''
+
+
+def test_headers_in_one_fetch_and_lazy_body():
+    mail = FakeIMAP(range(1, 1001))
+    emails = fetch_email_headers(mail, range(1, 1001))
+
+    assert len(mail.commands) == 1
+    assert mail.commands[0][1] == '1:1000'
+    assert 'BODY.PEEK[HEADER.FIELDS' in mail.commands[0][2]
+    assert len(emails) == 1000
+    assert emails[0].subject == '测试主题1' and emails[0].from_ == 'user1@example.com'
+    assert emails[0].seen and not emails[1].seen
+
+    # 正文只在parse()时下载一次
+    body = emails[41].parse()['body']
+    emails[41].parse()
+    assert body == '正文内容 42'
+    assert len(mail.commands) == 2
+
+
+def test_fetch_is_chunked():
+    mail = FakeIMAP(range(1, 11))
+    fetch_email_headers(mail, range(1, 11), chunk_size=4)
+    assert [c[1] for c in mail.commands] == ['1:4', '5:8', '9:10']
+
+
+if __name__ == '__main__':
+    test_compress_uid_set()
+    test_headers_in_one_fetch_and_lazy_body()
+    test_fetch_is_chunked()
+    print("全部测试通过")
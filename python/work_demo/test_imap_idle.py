@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""测试IMAP IDLE新邮件监听（使用本地的简易IMAP服务器，不需要真实邮件服务器）"""
+
+import imaplib
+import os
+import queue
+import select
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1208 import FolderIdleWatcher, IMAPIdleWatcher
+
+
+class LocalIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    只实现CAPABILITY/LOGIN/EXAMINE/UID SEARCH/NOOP/IDLE/LOGOUT的IMAP服务器
+
+    append()向文件夹添加一封邮件，正在IDLE的连接会收到"* n EXISTS"通知；
+    drop_connections()断开所有连接，模拟网络中断
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, folders, idle=True):
+        super().__init__(('127.0.0.1', 0), _IMAPHandler)
+        self.capabilities = 'IMAP4rev1 IDLE' if idle else 'IMAP4rev1'
+        self.folders = {name: list(uids) for name, uids in folders.items()}
+        self.next_uid = max((uid for uids in self.folders.values() for uid in uids), default=0) + 1
+        self.idle_commands = 0
+        self.noops = 0
+        self.logins = 0
+        self.sockets = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def append(self, folder):
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.folders[folder].append(uid)
+        return uid
+
+    def drop_connections(self):
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.shutdown()
+        self.drop_connections()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # drop_connections()断开的连接在服务端抛出的异常不需要打印
+        pass
+
+
+class _IMAPHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.buffer = b''
+        self.folder = None
+        self.announced = 0
+        with self.server.lock:
+            self.server.sockets.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.sockets.discard(self.request)
+
+    def send(self, line):
+        self.request.sendall(line.encode() + b'\r\n')
+
+    def readline(self, timeout=None):
+        """读取一行；timeout到期时返回None，连接关闭时返回b''"""
+        while b'\r\n' not in self.buffer:
+            readable, _, _ = select.select([self.request], [], [], timeout)
+            if not readable:
+                return None
+            data = self.request.recv(4096)
+            if not data:
+                return b''
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+        return line
+
+    def count(self):
+        with self.server.lock:
+            return len(self.server.folders[self.folder])
+
+    def announce(self):
+        """和真实服务器一样，在命令响应中附带尚未通知的EXISTS"""
+        current = self.count()
+        if current != self.announced:
+            self.announced = current
+            self.send(f'* {current} EXISTS')
+
+    def handle(self):
+        server = self.server
+        self.send('* OK IMAP4rev1 test server ready')
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            tag, command = line.decode().split(' ', 1)
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'CAPABILITY':
+                self.send(f'* CAPABILITY {server.capabilities}')
+                self.send(f'{tag} OK CAPABILITY completed')
+            elif verb == 'LOGIN':
+                with server.lock:
+                    server.logins += 1
+                self.send(f'{tag} OK LOGIN completed')
+            elif verb in ('EXAMINE', 'SELECT'):
+                self.folder = command.split(' ', 1)[1].strip('"')
+                with server.lock:
+                    uids = list(server.folders[self.folder])
+                    next_uid = server.next_uid
+                self.announced = len(uids)
+                self.send(f'* {len(uids)} EXISTS')
+                self.send('* OK [UIDVALIDITY 1] UIDs valid')
+                self.send(f'* OK [UIDNEXT {next_uid}] Predicted next UID')
+                self.send(f'{tag} OK [READ-ONLY] EXAMINE completed')
+            elif command.upper().startswith('UID SEARCH UID '):
+                self.send(f'* SEARCH {" ".join(map(str, self.search(command.split()[-1])))}'.rstrip())
+                self.announce()
+                self.send(f'{tag} OK SEARCH completed')
+            elif verb == 'NOOP':
+                with server.lock:
+                    server.noops += 1
+                self.announce()
+                self.send(f'{tag} OK NOOP completed')
+            elif verb == 'IDLE' and 'IDLE' in server.capabilities:
+                with server.lock:
+                    server.idle_commands += 1
+                if not self.idle(tag):
+                    return
+            elif verb == 'LOGOUT':
+                self.send('* BYE logging out')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            else:
+                self.send(f'{tag} BAD unknown command')
+
+    def search(self, uid_set):
+        with self.server.lock:
+            uids = list(self.server.folders[self.folder])
+        if uid_set == '*':
+            return uids[-1:]
+        start, end = uid_set.split(':')
+        matched = [uid for uid in uids if uid >= int(start)]
+        # "n:*"至少返回最大的UID
+        return matched or uids[-1:]
+
+    def idle(self, tag):
+        self.send('+ idling')
+        while True:
+            line = self.readline(timeout=0.02)
+            if line == b'':
+                return False
+            if line is not None:
+                if line.upper() == b'DONE':
+                    self.send(f'{tag} OK IDLE terminated')
+                    return True
+                self.send(f'{tag} BAD expected DONE')
+                return True
+            self.announce()
+
+
+def make_connect(server):
+    def connect():
+        mail = imaplib.IMAP4('127.0.0.1', server.port, timeout=5)
+        mail.login('user', 'password')
+        return mail
+    return connect
+
+
+def collect_uids(events, expected_count, timeout=5):
+    uids = []
+    deadline = time.monotonic() + timeout
+    while len(uids) < expected_count and time.monotonic() < deadline:
+        try:
+            event = events.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        uids.extend(event['uids'])
+    return uids
+
+
+def test_idle_delivers_new_mail():
+    """IDLE收到EXISTS通知后秒级报告新UID，启动前已有的邮件不报告"""
+    server = LocalIMAPServer({'INBOX': [1, 2, 3]})
+    events = queue.Queue()
+    watcher = IMAPIdleWatcher(make_connect(server), ['INBOX'], events.put)
+    try:
+        watcher.start()
+        time.sleep(0.3)
+        start = time.monotonic()
+        server.append('INBOX')
+        first = collect_uids(events, 1)
+        latency = time.monotonic() - start
+        server.append('INBOX')
+        second = collect_uids(events, 1)
+    finally:
+        watcher.stop()
+        server.stop()
+
+    print(f"新邮件: {first + second}, 延迟 {latency * 1000:.0f}ms, IDLE命令 {server.idle_commands} 次")
+    assert first + second == [4, 5]
+    assert latency < 2
+    assert server.idle_commands >= 2
+    assert server.noops == 0
+
+
+def test_idle_renewed_before_timeout():
+    """到达idle_timeout时结束并重新发起IDLE"""
+    server = LocalIMAPServer({'INBOX': [1]})
+    watcher = FolderIdleWatcher(make_connect(server), 'INBOX', lambda event: None, idle_timeout=0.1)
+    thread = threading.Thread(target=watcher.run)
+    try:
+        thread.start()
+        time.sleep(0.8)
+    finally:
+        watcher.stop()
+        thread.join(5)
+        server.stop()
+
+    print(f"0.8秒内IDLE命令 {server.idle_commands} 次")
+    assert not thread.is_alive()
+    assert server.idle_commands >= 4
+
+
+def test_noop_fallback_without_idle():
+    """服务器不支持IDLE时用NOOP轮询"""
+    server = LocalIMAPServer({'INBOX': [1, 2]}, idle=False)
+    events = queue.Queue()
+    watcher = IMAPIdleWatcher(make_connect(server), ['INBOX'], events.put, poll_interval=0.05)
+    try:
+        watcher.start()
+        time.sleep(0.2)
+        server.append('INBOX')
+        uids = collect_uids(events, 1)
+    finally:
+        watcher.stop()
+        server.stop()
+
+    print(f"新邮件: {uids}, NOOP {server.noops} 次")
+    assert uids == [3]
+    assert server.idle_commands == 0
+    assert server.noops > 0
+
+
+def test_reconnect_catches_up_per_folder():
+    """每个文件夹一个连接；断线重连后补报断开期间的邮件，且不重复报告"""
+    server = LocalIMAPServer({'INBOX': [1, 2], 'Support': [3]})
+    events = queue.Queue()
+    watcher = IMAPIdleWatcher(make_connect(server), ['INBOX', 'Support'], events.put,
+                              since_uid=0, reconnect_delay=0.2)
+    try:
+        watcher.start()
+        initial = collect_uids(events, 3)
+        server.drop_connections()
+        server.append('INBOX')
+        server.append('Support')
+        caught_up = collect_uids(events, 2)
+        server.append('Support')
+        later = collect_uids(events, 1)
+    finally:
+        watcher.stop()
+        server.stop()
+
+    print(f"启动: {sorted(initial)}, 重连后: {sorted(caught_up)}, 之后: {later}, 登录 {server.logins} 次")
+    assert sorted(initial) == [1, 2, 3]
+    assert sorted(caught_up) == [4, 5]
+    assert later == [6]
+    assert server.logins == 4
+
+
+def test_failed_callback_is_retried():
+    """callback抛出异常时不跳过这些UID，retry_delay后重新报告（没有新邮件也会重试）"""
+    server = LocalIMAPServer({'INBOX': [1]})
+    events = queue.Queue()
+    calls = []
+
+    def callback(event):
+        calls.append(list(event['uids']))
+        if len(calls) <= 2:
+            raise RuntimeError('处理失败')
+        events.put(event)
+
+    watcher = FolderIdleWatcher(make_connect(server), 'INBOX', callback, retry_delay=0.1)
+    thread = threading.Thread(target=watcher.run)
+    try:
+        thread.start()
+        time.sleep(0.3)
+        server.append('INBOX')
+        server.append('INBOX')
+        first = collect_uids(events, 2)
+        server.append('INBOX')
+        later = collect_uids(events, 1)
+    finally:
+        watcher.stop()
+        thread.join(5)
+        server.stop()
+
+    print(f"callback调用: {calls}, 成功报告: {first} {later}")
+    assert not thread.is_alive()
+    assert first == [2, 3]
+    assert later == [4]
+    assert len(calls) == 4
+    assert all(uids[0] == 2 for uids in calls[:3])
+    assert watcher.last_uid == 4
+
+
+if __name__ == '__main__':
+    test_idle_delivers_new_mail()
+    test_idle_renewed_before_timeout()
+    test_noop_fallback_without_idle()
+    test_reconnect_catches_up_per_folder()
+    test_failed_callback_is_retried()
+    print("全部测试通过")
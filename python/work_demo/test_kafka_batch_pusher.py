@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""测试KafkaBatchPusher的批次切分和推送指标（使用内存模拟生产者，不需要Kafka服务）"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from kafka_batch_pusher import KafkaBatchPusher, default_message_size
+from kafka_metrics import KafkaMetrics
+
+
+class RecordingProducer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, topic, messages):
+        self.sent.append((topic, list(messages)))
+
+
+def test_batches_bounded_by_count_and_bytes():
+    """批次同时受条数和字节数限制，消息顺序不变"""
+    producer = RecordingProducer()
+    pusher = KafkaBatchPusher(producer, batch_size=4, max_batch_bytes=25)
+    messages = ['x' * 10, 'y' * 10, 'z' * 10] + [f'{i:02d}' for i in range(10)]
+    assert pusher.push_messages({'cr': messages})
+
+    sizes = [[default_message_size(message) for message in batch] for _, batch in producer.sent]
+    print(f"批次字节数: {sizes}")
+    assert [message for _, batch in producer.sent for message in batch] == messages
+    assert all(topic == 'topic_cr' for topic, _ in producer.sent)
+    assert all(len(batch) <= 4 and sum(batch_sizes) <= 25 for batch, batch_sizes in zip(
+        (batch for _, batch in producer.sent), sizes))
+    # 第三条10字节会使第一批超过25字节；之后受每批4条限制
+    assert [len(batch) for _, batch in producer.sent] == [2, 4, 4, 3]
+
+
+def test_oversized_messages_are_skipped():
+    """单条超过max_batch_bytes的消息单独记录，不影响同批次其他消息，推送结果为失败"""
+    producer = RecordingProducer()
+    pusher = KafkaBatchPusher(producer, batch_size=10, max_batch_bytes=100, max_workers=2)
+    big = 'x' * 101
+    result = pusher.push_messages({'cr': ['a', big, 'b', 'c' * 100], 'pr': ['ok'], 'in': [big]})
+
+    print(f"超大消息: { {topic: len(items) for topic, items in pusher.oversized_messages.items()} }")
+    assert result is False
+    assert pusher.oversized_messages == {'topic_cr': [big], 'topic_in': [big]}
+    sent = {}
+    for topic, batch in producer.sent:
+        sent.setdefault(topic, []).append(batch)
+    # 刚好100字节的消息不算超大，但放不进前一批
+    assert sent['topic_cr'] == [['a', 'b'], ['c' * 100]]
+    assert sent['topic_pr'] == [['ok']]
+    assert 'topic_in' not in sent
+
+    # 每次推送重新统计
+    assert pusher.push_messages({'pr': ['ok']})
+    assert pusher.oversized_messages == {}
+
+
+def test_produced_bytes_without_serializer():
+    """未配置serializer时按size_func统计推送字节数，与切分批次时的计算一致"""
+    messages = [f"消息-{i}" for i in range(25)] + [{'id': i, 'name': f'用户{i}'} for i in range(5)]
+    metrics = KafkaMetrics('pusher_test', interval=3600)
+    producer = RecordingProducer()
+    pusher = KafkaBatchPusher(producer, batch_size=10, metrics=metrics)
+    assert pusher.push_messages({'cr': messages})
+
+    produced = metrics._totals['produced']
+    expected = sum(default_message_size(message) for message in messages)
+    print(f"批次: {produced['batches']}, 消息: {produced['messages']}, 字节: {produced['bytes']}")
+    assert produced['messages'] == 30 and produced['batches'] == 3
+    assert produced['bytes'] == expected > 0
+    assert metrics.snapshot()['produced']['bytes_per_sec'] > 0
+
+
+def test_produced_bytes_with_size_func_and_serializer():
+    """自定义size_func和serializer时同样统计实际的字节数"""
+    metrics = KafkaMetrics('pusher_test', interval=3600)
+    pusher = KafkaBatchPusher(RecordingProducer(), batch_size=4, metrics=metrics, size_func=lambda message: 100)
+    assert pusher.push_messages({'cr': list(range(10))})
+    assert metrics._totals['produced']['bytes'] == 1000
+
+    metrics = KafkaMetrics('pusher_test', interval=3600)
+    producer = RecordingProducer()
+    pusher = KafkaBatchPusher(producer, batch_size=4, metrics=metrics, serializer='json')
+    assert pusher.push_messages({'cr': [{'id': i} for i in range(10)]})
+    assert metrics._totals['produced']['bytes'] == sum(len(m) for _, batch in producer.sent for m in batch)
+
+
+if __name__ == '__main__':
+    test_batches_bounded_by_count_and_bytes()
+    test_oversized_messages_are_skipped()
+    test_produced_bytes_without_serializer()
+    test_produced_bytes_with_size_func_and_serializer()
+    print("全部测试通过")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""测试分批发送：生成器输入按批次惰性读取，缓冲区满（BufferError）时背压重试"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1222 import MockKafkaProducer, batch_send_to_kafka, iter_batches, send_with_backpressure
+
+
+def test_iter_batches_reads_generator_lazily():
+    """生成器输入每次只读取一个批次"""
+    consumed = []
+
+    def rows(count):
+        for i in range(count):
+            consumed.append(i)
+            yield i
+
+    batches = iter_batches(rows(25), 10)
+    assert next(batches) == list(range(10))
+    assert len(consumed) == 10
+    assert [len(batch) for batch in batches] == [10, 5]
+    assert list(iter_batches(iter([]), 10)) == []
+
+
+def test_generator_input_with_backpressure():
+    """缓冲区小于批次大小时，send遇到BufferError先flush再重试，消息不丢失且保持顺序"""
+    producer = MockKafkaProducer(max_buffer=30)
+    sent = batch_send_to_kafka(
+        {'export': ({'row_id': i} for i in range(250)), 'empty': iter([])},
+        producer, max_batch_size=100)
+
+    assert sent == {'topic_export': 250, 'topic_empty': 0}
+    assert producer.sent_messages['topic_export'] == [{'row_id': i} for i in range(250)]
+    assert 'topic_empty' not in producer.sent_counts
+    assert producer.buffered == 0
+
+
+class StuckProducer(MockKafkaProducer):
+    """flush不能释放缓冲区的生产者"""
+
+    def __init__(self):
+        super().__init__(max_buffer=1)
+        self.flush_calls = 0
+
+    def flush(self):
+        self.flush_calls += 1
+
+
+def test_backpressure_gives_up_after_max_wait():
+    """缓冲区一直是满的，超过max_wait后抛出BufferError，期间多次flush重试"""
+    producer = StuckProducer()
+    send_with_backpressure(producer, 't', 'first')
+    try:
+        send_with_backpressure(producer, 't', 'second', max_wait=0.1, backoff=0.01)
+    except BufferError:
+        pass
+    else:
+        raise AssertionError("缓冲区一直满时应该抛出BufferError")
+    assert producer.flush_calls > 1
+    assert producer.sent_messages['t'] == ['first']
+
+
+if __name__ == '__main__':
+    test_iter_batches_reads_generator_lazily()
+    test_generator_input_with_backpressure()
+    test_backpressure_gives_up_after_max_wait()
+    print("全部测试通过")
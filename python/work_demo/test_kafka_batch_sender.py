@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""测试异步流水线发送的统计（使用模拟生产者，不需要Kafka服务）"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from kafka.errors import KafkaTimeoutError, KafkaError
+
+from kafka_batch_sender import _MockFuture, send_to_kafka_pipelined
+from kafka_metrics import KafkaMetrics
+
+
+class ScriptedProducer:
+    """
+    按消息内容决定结果：ok-立即确认，err-确认失败，hang-始终不确认（flush超时），
+    bad-send抛出TypeError，full-send抛出KafkaTimeoutError（缓冲区满）
+    """
+
+    def __init__(self):
+        self.flush_timeouts = []
+
+    def send(self, topic, value=None, key=None):
+        kind = value.decode().split('-')[0]
+        if kind == 'bad':
+            raise TypeError('value必须为bytes')
+        if kind == 'full':
+            raise KafkaTimeoutError('缓冲区已满')
+        future = _MockFuture()
+        if kind == 'ok':
+            future._complete(value={'topic': topic})
+        elif kind == 'err':
+            future._complete(exception=KafkaError('NotLeaderForPartition'))
+        return future
+
+    def flush(self, timeout=None):
+        self.flush_timeouts.append(timeout)
+        raise KafkaTimeoutError('flush超时')
+
+
+def run_with_timeout(func, timeout=5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "发送被阻塞（in_flight名额未释放）"
+    return result['value']
+
+
+def test_pipelined_stats_for_acked_failed_and_timed_out():
+    """确认、回调失败、提交失败和flush超时未确认的消息分别计入统计；提交失败不占用in_flight名额"""
+    metrics = KafkaMetrics('sender_test', interval=3600)
+    producer = ScriptedProducer()
+    data = {
+        'a': ['ok-1', 'bad-1', 'bad-2', 'bad-3', 'full-1', 'ok-2', 'err-1'],
+        'b': ['ok-3', 'hang-1', 'hang-2'],
+        'empty': [],
+    }
+    stats = run_with_timeout(lambda: send_to_kafka_pipelined(
+        data, producer, max_in_flight=3, flush_timeout=0.1, metrics=metrics))
+
+    print(f"统计: {stats}")
+    assert stats == {
+        'topic_a': {'success': 2, 'failed': 5},
+        'topic_b': {'success': 1, 'failed': 2},
+        'topic_empty': {'success': 0, 'failed': 0},
+    }
+    assert producer.flush_timeouts == [0.1]
+    assert metrics._totals['produced']['errors'] == 5
+    assert metrics._totals['produced']['messages'] == 10
+
+
+def test_late_callbacks_not_counted():
+    """flush超时之后才到达的回调不再改变统计"""
+    futures = []
+
+    class SlowProducer:
+        def send(self, topic, value=None, key=None):
+            future = _MockFuture()
+            futures.append(future)
+            return future
+
+        def flush(self, timeout=None):
+            raise KafkaTimeoutError('flush超时')
+
+    stats = run_with_timeout(lambda: send_to_kafka_pipelined({'a': ['x', 'y']}, SlowProducer()))
+    futures[0]._complete(value={})
+    futures[1]._complete(exception=KafkaError('late'))
+    assert stats == {'topic_a': {'success': 0, 'failed': 2}}
+
+
+if __name__ == '__main__':
+    test_pipelined_stats_for_acked_failed_and_timed_out()
+    test_late_callbacks_not_counted()
+    print("全部测试通过")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""测试按分区并行消费与偏移量提交（使用内存模拟消费者，不需要Kafka服务）"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1219 import (InMemoryKafkaConsumer, compute_consumer_lag, consume_kafka_batches, consume_kafka_parallel,
+                       consume_kafka_topic)
+from kafka_metrics import KafkaMetrics
+
+
+def test_batches_stop_at_end():
+    """批量拉取在分区末尾停止，手动提交的是每批最后一条的下一个位置"""
+    consumer = InMemoryKafkaConsumer('t', {0: list(range(7)), 1: list(range(3))})
+    batch_sizes = []
+    for records, commit in consume_kafka_batches(None, 't', consumer=consumer, max_records=4, stop_at_end=True):
+        batch_sizes.append(len(records))
+        commit()
+
+    print(f"批次大小: {batch_sizes}, 已提交: {consumer.committed_offsets}")
+    assert sum(batch_sizes) == 10
+    assert max(batch_sizes) <= 4
+    assert sorted(consumer.committed_offsets.values()) == [3, 7]
+
+
+def test_parallel_preserves_partition_order():
+    """同一分区内按offset顺序处理，不同分区并行处理"""
+    consumer = InMemoryKafkaConsumer('t', {p: list(range(300)) for p in range(4)})
+    seen = {}
+    lock = threading.Lock()
+    running = set()
+    max_concurrency = [0]
+
+    def handler(record):
+        partition = record['partition']
+        with lock:
+            assert partition not in running, "同一分区被并发处理"
+            running.add(partition)
+            max_concurrency[0] = max(max_concurrency[0], len(running))
+        time.sleep(0.0002)
+        with lock:
+            seen.setdefault(partition, []).append(record['offset'])
+            running.discard(partition)
+
+    result = consume_kafka_parallel(None, 't', handler, max_workers=4, consumer=consumer,
+                                    stop_at_end=True, max_records=50)
+
+    print(f"处理条数: {result['processed']}, 最大并发分区数: {max_concurrency[0]}")
+    assert result['processed'] == 1200
+    assert all(offsets == list(range(300)) for offsets in seen.values())
+    assert all(offset == 300 for offset in consumer.committed_offsets.values())
+    assert max_concurrency[0] > 1
+
+
+def test_parallel_commits_only_processed_prefix():
+    """处理失败时，失败分区只提交失败消息之前的位置"""
+    consumer = InMemoryKafkaConsumer('t', {0: list(range(50)), 1: list(range(50))})
+
+    def handler(record):
+        if record['partition'] == 1 and record['offset'] == 20:
+            raise ValueError("模拟处理失败")
+
+    try:
+        consume_kafka_parallel(None, 't', handler, max_workers=2, consumer=consumer,
+                               stop_at_end=True, max_records=10)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("处理失败时应重新抛出异常")
+
+    committed = {tp.partition: offset for tp, offset in consumer.committed_offsets.items()}
+    print(f"失败后已提交: {committed}")
+    assert committed[1] == 20
+    assert committed.get(0, 0) <= 50
+
+
+def test_parallel_pauses_busy_partitions_instead_of_blocking_poll():
+    """积压超过max_pending时暂停有积压的分区并继续poll，处理完后恢复，消息不丢失且保持顺序"""
+
+    class RecordingConsumer(InMemoryKafkaConsumer):
+        def __init__(self, *args):
+            super().__init__(*args)
+            self.pause_calls = []
+            self.polls_while_paused = 0
+
+        def pause(self, *partitions):
+            self.pause_calls.append({tp.partition for tp in partitions})
+            super().pause(*partitions)
+
+        def poll(self, timeout_ms=0, max_records=500):
+            if self.paused_partitions:
+                self.polls_while_paused += 1
+            return super().poll(timeout_ms, max_records)
+
+    consumer = RecordingConsumer('t', {0: list(range(60)), 1: list(range(60))})
+    seen = {}
+
+    def handler(record):
+        # 分区0处理较慢，积压主要在分区0
+        time.sleep(0.002 if record['partition'] == 0 else 0.0002)
+        seen.setdefault(record['partition'], []).append(record['offset'])
+
+    result = consume_kafka_parallel(None, 't', handler, max_workers=2, consumer=consumer,
+                                    stop_at_end=True, max_records=10, max_pending=15)
+
+    print(f"暂停: {consumer.pause_calls[:5]}, 暂停期间poll次数: {consumer.polls_while_paused}")
+    assert result['processed'] == 120
+    assert seen == {0: list(range(60)), 1: list(range(60))}
+    assert consumer.pause_calls and consumer.polls_while_paused > 0
+
+
+def test_batches_report_metrics_and_lag():
+    """批量消费记录消费条数，结束上报时lag为剩余未提交的消息数"""
+    consumer = InMemoryKafkaConsumer('t', {0: list(range(30)), 1: list(range(10))})
+    metrics = KafkaMetrics('test', interval=3600)
+    snapshots = []
+    metrics.add_sink(snapshots.append)
+
+    for records, commit in consume_kafka_batches(None, 't', consumer=consumer, max_records=10,
+                                                 stop_at_end=True, metrics=metrics):
+        # 分区0只提交第一批，剩余20条计入lag
+        if records[0]['partition'] == 1 or records[0]['offset'] == 0:
+            commit()
+
+    print(f"指标: {snapshots[-1]}")
+    assert snapshots[-1]['consumed']['total_messages'] == 40
+    assert snapshots[-1]['total_lag'] == 20
+
+
+def test_lag_without_group_uses_position():
+    """不使用group的消费者不能查询已提交偏移量，lag按当前位置计算，commit为空操作"""
+    consumer = InMemoryKafkaConsumer('t', {0: list(range(30)), 1: list(range(10))}, group_id=None)
+    batches = consume_kafka_batches(None, 't', consumer=consumer, max_records=10)
+    records, commit = next(batches)
+    commit()
+    batches.close()
+
+    lag = compute_consumer_lag(consumer)
+    print(f"无group的lag: {lag}")
+    assert lag == {'t[0]': 20, 't[1]': 10}
+    assert consumer.commit_history == []
+
+
+def test_consume_topic_reports_metrics():
+    """consume_kafka_topic记录消费条数，结束时上报lag（不使用group时按当前位置计算）"""
+    consumer = InMemoryKafkaConsumer('t', {0: list(range(5)), 1: list(range(3))}, group_id=None)
+    metrics = KafkaMetrics('topic', interval=3600)
+    snapshots = []
+    metrics.add_sink(snapshots.append)
+
+    messages = consume_kafka_topic(None, 't', consumer=consumer, print_messages=False, metrics=metrics)
+    assert [(m['partition'], m['offset']) for m in messages] == \
+        [(0, i) for i in range(5)] + [(1, i) for i in range(3)]
+    assert snapshots[-1]['consumed']['total_messages'] == 8
+    assert snapshots[-1]['total_lag'] == 0
+    assert metrics._lag_provider is None
+
+
+if __name__ == '__main__':
+    test_batches_stop_at_end()
+    test_parallel_preserves_partition_order()
+    test_parallel_commits_only_processed_prefix()
+    test_parallel_pauses_busy_partitions_instead_of_blocking_poll()
+    test_batches_report_metrics_and_lag()
+    test_lag_without_group_uses_position()
+    test_consume_topic_reports_metrics()
+    print("全部测试通过")
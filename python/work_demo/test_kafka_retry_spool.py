@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""测试Kafka失败批次的本地重试队列（spool）与KafkaBatchPusher的写入和重放（不需要Kafka服务）"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from kafka_batch_pusher import KafkaBatchPusher
+from kafka_retry_spool import RetrySpool, SpoolFullError
+
+
+def collect(spool, fail_after=None):
+    """重放spool，返回发送的批次；fail_after为成功发送的批次数，之后发送失败"""
+    sent = []
+
+    def send(topic, messages):
+        if fail_after is not None and len(sent) >= fail_after:
+            return False
+        sent.append((topic, messages))
+        return True
+
+    return spool.replay(send), sent
+
+
+def segment_files(spool_dir):
+    return sorted(name for name in os.listdir(spool_dir) if name.endswith('.log'))
+
+
+def test_replay_order_across_segments():
+    """跨多个分段按写入顺序重放，bytes消息原样还原，重放完的分段被删除"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, segment_max_bytes=200, fsync=False)
+        batches = [(f'topic_{i % 3}', [f'消息-{i}-{j}' for j in range(3)]) for i in range(10)]
+        batches.append(('topic_b', [b'\x00\xffraw', 'text']))
+        for topic, messages in batches:
+            spool.append(topic, messages)
+        print(f"分段数: {len(segment_files(tmp))}")
+        assert len(segment_files(tmp)) > 1
+        assert spool.has_pending()
+
+        drained, sent = collect(spool)
+        assert drained and sent == batches
+        assert not spool.has_pending() and segment_files(tmp) == []
+        assert spool.metrics['replayed_batches'] == 11
+
+        # 重放完后继续写入和重放
+        spool.append('topic_x', ['after'])
+        assert collect(spool) == (True, [('topic_x', ['after'])])
+        spool.close()
+
+
+def test_truncated_and_corrupt_records():
+    """末尾的半条记录（写入时崩溃）被丢弃，CRC校验失败的记录被跳过，其余记录正常重放"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, fsync=False)
+        for i in range(3):
+            spool.append('t', [f'batch-{i}'])
+        spool.close()
+
+        path = os.path.join(tmp, segment_files(tmp)[0])
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        # 修改第二条记录载荷中的一个字节
+        record_size = len(data) // 3
+        data[record_size + record_size - 3] ^= 0xff
+        # 模拟写到一半崩溃的第四条记录
+        data += data[:record_size // 2]
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        restarted = RetrySpool(tmp, fsync=False)
+        drained, sent = collect(restarted)
+        print(f"重放: {sent}, 指标: {restarted.get_metrics()}")
+        assert drained
+        assert sent == [('t', ['batch-0']), ('t', ['batch-2'])]
+        assert restarted.metrics['corrupt_records'] == 2
+        assert not restarted.has_pending()
+        restarted.close()
+
+
+def test_failed_write_does_not_corrupt_later_records():
+    """写入分段文件出错时放弃该分段，之后的记录写入新分段，重放时丢弃半条记录"""
+    class BrokenWriter:
+        def __init__(self, writer):
+            self.writer = writer
+            self.name = writer.name
+
+        def tell(self):
+            return self.writer.tell()
+
+        def write(self, data):
+            self.writer.write(data[:len(data) // 2])
+            self.writer.flush()
+            raise OSError(28, 'No space left on device')
+
+        def close(self):
+            self.writer.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, fsync=False)
+        spool.append('t', ['first'])
+        spool._writer = BrokenWriter(spool._writer)
+        try:
+            spool.append('t', ['lost'])
+        except OSError:
+            pass
+        else:
+            raise AssertionError("写入失败时应该抛出OSError")
+        spool.append('t', ['third'])
+
+        drained, sent = collect(spool)
+        assert drained and sent == [('t', ['first']), ('t', ['third'])]
+        assert spool.metrics['corrupt_records'] == 1
+        spool.close()
+
+
+def test_resume_from_checkpoint_after_restart():
+    """重放中途失败后重启，从checkpoint继续，已发送的批次不重复发送"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, segment_max_bytes=120, fsync=False)
+        batches = [('t', [f'batch-{i}']) for i in range(8)]
+        for topic, messages in batches:
+            spool.append(topic, messages)
+
+        drained, first = collect(spool, fail_after=3)
+        assert not drained and first == batches[:3]
+        assert spool.metrics['replay_failures'] == 1
+        spool.close()
+
+        restarted = RetrySpool(tmp, segment_max_bytes=120, fsync=False)
+        assert restarted.has_pending()
+        drained, rest = collect(restarted)
+        print(f"第一次重放 {len(first)} 批, 重启后重放 {len(rest)} 批")
+        assert drained and rest == batches[3:]
+
+        # 重启后新写入的分段序号接在checkpoint之后
+        restarted.append('t', ['new'])
+        assert collect(restarted) == (True, [('t', ['new'])])
+        restarted.close()
+
+
+def test_spool_full():
+    """超过max_total_bytes时拒绝写入，重放后腾出空间"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, max_total_bytes=200, fsync=False)
+        spool.append('t', ['x' * 50])
+        spool.append('t', ['x' * 50])
+        try:
+            spool.append('t', ['x' * 50])
+        except SpoolFullError as e:
+            print(f"拒绝写入: {e}")
+        else:
+            raise AssertionError("spool已满时应该抛出SpoolFullError")
+        assert spool.metrics['rejected_batches'] == 1
+
+        assert collect(spool)[0]
+        spool.append('t', ['x' * 50])
+        spool.close()
+
+
+class FlakyProducer:
+    def __init__(self):
+        self.available = False
+        self.sent = []
+
+    def send(self, topic, messages):
+        if not self.available:
+            raise ConnectionError('broker不可用')
+        self.sent.append((topic, list(messages)))
+
+
+def test_pusher_spools_and_replays_in_order():
+    """生产者不可用时批次写入spool，恢复后先重放spool中的批次，再推送新批次"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, fsync=False)
+        producer = FlakyProducer()
+        pusher = KafkaBatchPusher(producer, batch_size=10, max_retries=2, spool=spool)
+
+        # 写入spool的批次视为已处理，推送结果为成功
+        assert pusher.push_messages({'cr': [f'cr-{i}' for i in range(25)]})
+        assert pusher.spooled_batches == 3 and producer.sent == []
+
+        producer.available = True
+        assert pusher.push_messages({'cr': [f'cr-{i}' for i in range(25, 30)]})
+        print(f"发送批次: {[len(messages) for _, messages in producer.sent]}")
+        assert [message for _, messages in producer.sent for message in messages] == [f'cr-{i}' for i in range(30)]
+        assert pusher.spooled_batches == 0 and not spool.has_pending()
+        spool.close()
+
+
+def test_pusher_spool_errors_fail_the_batch():
+    """无法编码的消息或写入spool出错时只标记该批次失败，不抛出异常"""
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = RetrySpool(tmp, fsync=False)
+        producer = FlakyProducer()
+        pusher = KafkaBatchPusher(producer, batch_size=2, max_retries=1, spool=spool, max_workers=2,
+                                  size_func=lambda message: 1)
+        assert not pusher.push_messages({'ok': ['a', 'b', 'c'], 'bad': ['a', object()]})
+        assert pusher.spooled_batches == 2
+
+        def broken_append(topic, messages):
+            raise OSError(28, 'No space left on device')
+
+        spool.append = broken_append
+        assert not pusher.push_messages({'cr': ['a']})
+        assert pusher.spooled_batches == 0
+        spool.close()
+
+
+if __name__ == '__main__':
+    test_replay_order_across_segments()
+    test_truncated_and_corrupt_records()
+    test_failed_write_does_not_corrupt_later_records()
+    test_resume_from_checkpoint_after_restart()
+    test_spool_full()
+    test_pusher_spools_and_replays_in_order()
+    test_pusher_spool_errors_fail_the_batch()
+    print("全部测试通过")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""测试序列化器往返、key序列化器和压缩依赖检查"""
+
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import kafka_serializers
+from kafka_serializers import (available_compressions, available_serializers, check_compression,
+                               compress, get_serializer, resolve_key_serializer, resolve_serializer)
+
+MESSAGES = [
+    {'id': 1, 'name': '张三', 'tags': ['a', 'b'], 'score': 9.5, 'active': True, 'extra': None},
+    [1, 2, 3],
+    42,
+]
+
+DECODERS = {
+    'json': lambda data: json.loads(data.decode('utf-8')),
+    'orjson': lambda data: kafka_serializers.orjson.loads(data),
+    'msgpack': lambda data: kafka_serializers.msgpack.unpackb(data, raw=False),
+}
+
+
+def test_serializer_round_trip():
+    """每个可用的序列化器都能无损往返；json/orjson对str/bytes保持原有行为"""
+    for name in available_serializers():
+        serializer = get_serializer(name)
+        for message in MESSAGES:
+            data = serializer(message)
+            assert isinstance(data, bytes)
+            assert DECODERS[name](data) == message, name
+        if name == 'msgpack':
+            assert DECODERS[name](serializer('你好')) == '你好'
+        else:
+            assert serializer('你好') == '你好'.encode('utf-8')
+            assert serializer(b'raw') == b'raw'
+    print(f"可用序列化器: {available_serializers()}")
+
+
+def test_unknown_or_missing_serializer():
+    """未知名称和依赖未安装都抛出ValueError；自定义函数原样使用"""
+    for name in ['xml'] + [n for n in kafka_serializers.SERIALIZERS if n not in available_serializers()]:
+        try:
+            get_serializer(name)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{name} 应该不可用")
+    custom = lambda value: b'x'
+    assert resolve_serializer(custom) is custom
+
+
+def test_key_serializer():
+    """默认key按字符串编码；可以替换为value序列化器或自定义函数，None始终保持None"""
+    default = resolve_key_serializer()
+    assert default(None) is None
+    assert default(123) == b'123'
+    assert default('用户') == '用户'.encode('utf-8')
+    assert default(b'k') == b'k'
+
+    as_json = resolve_key_serializer('json')
+    assert as_json(None) is None
+    assert json.loads(as_json({'user': 1})) == {'user': 1}
+
+    custom = resolve_key_serializer(lambda key: key.to_bytes(4, 'big'))
+    assert custom(None) is None
+    assert custom(1) == b'\x00\x00\x00\x01'
+
+    try:
+        resolve_key_serializer('xml')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("未知的key序列化器应该抛出ValueError")
+
+
+def test_compression_check_and_round_trip():
+    """可用的压缩算法能正确压缩，未安装/未知的算法在检查时报错并给出安装包名"""
+    data = json.dumps(MESSAGES * 50).encode('utf-8')
+    decompressors = {
+        None: lambda d: d,
+        'gzip': gzip.decompress,
+        'lz4': lambda d: kafka_serializers.lz4_frame.decompress(d),
+        'zstd': lambda d: kafka_serializers.zstandard.ZstdDecompressor().decompress(d),
+        'snappy': lambda d: kafka_serializers.snappy.decompress(d),
+    }
+    for compression_type in available_compressions():
+        assert check_compression(compression_type) == compression_type
+        compressed = compress(data, compression_type)
+        assert decompressors[compression_type](compressed) == data
+        if compression_type is not None:
+            assert len(compressed) < len(data)
+
+    packages = {'lz4': 'lz4', 'zstd': 'zstandard', 'snappy': 'python-snappy'}
+    for compression_type in set(kafka_serializers.COMPRESSION_TYPES) - set(available_compressions()):
+        try:
+            check_compression(compression_type)
+        except ValueError as e:
+            assert packages[compression_type] in str(e)
+        else:
+            raise AssertionError(f"{compression_type} 应该不可用")
+    try:
+        check_compression('brotli')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("未知的压缩算法应该抛出ValueError")
+    print(f"可用压缩算法: {available_compressions()}")
+
+
+if __name__ == '__main__':
+    test_serializer_round_trip()
+    test_unknown_or_missing_serializer()
+    test_key_serializer()
+    test_compression_check_and_round_trip()
+    print("全部测试通过")
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""测试本地邮箱索引的增量同步和按MD5 UID查找（使用模拟IMAP连接，不需要邮件服务器）"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+from email.header import Header
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+import apps_1215
+from apps_1209 import MailboxIndex, find_email_by_md5_uid
+from apps_1215 import generate_email_uid
+
+
+def make_raw_email(uid):
+    msg = MIMEText(f'正文{uid}', 'plain', 'utf-8')
+    # 偶数邮件使用中文标题（编码后的头字段），MD5 UID按未解码的原始头计算
+    msg['Subject'] = Header(f'主题 {uid}', 'utf-8').encode() if uid % 2 == 0 else f'subject {uid}'
+    msg['From'] = f'sender{uid}@example.com'
+    msg['Date'] = f'Mon, 09 Dec 2024 10:{uid % 60:02d}:00 +0800'
+    return msg.as_bytes()
+
+
+def md5_uid_of(uid):
+    """与apps_1215回复时相同的计算方式：原始From、原始Subject和格式化后的Date"""
+    subject = Header(f'主题 {uid}', 'utf-8').encode() if uid % 2 == 0 else f'subject {uid}'
+    return generate_email_uid(f'sender{uid}@example.com', subject, f'2024-12-09 10:{uid % 60:02d}:00')
+
+
+class FakeIMAP:
+    """模拟单个文件夹的IMAP服务器，记录执行过的命令"""
+
+    def __init__(self, uids, uidvalidity=1):
+        self.messages = {uid: make_raw_email(uid) for uid in uids}
+        self.uidvalidity = uidvalidity
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def login(self, username, password):
+        self.commands.append('LOGIN')
+
+    def search(self, charset, criteria):
+        self.commands.append('SEARCH')
+        return 'OK', [' '.join(map(str, sorted(self.messages))).encode()]
+
+    def fetch(self, message_id, items):
+        self.commands.append('FETCH')
+        raw = self.messages[int(message_id)]
+        return 'OK', [(f'{int(message_id)} (RFC822 {{{len(raw)}}}'.encode(), raw), b')']
+
+    def status(self, folder, items):
+        self.commands.append('STATUS')
+        uidnext = max(self.messages, default=0) + 1
+        return 'OK', [f'{folder} (UIDVALIDITY {self.uidvalidity} UIDNEXT {uidnext})'.encode()]
+
+    def select(self, folder, readonly=False):
+        self.commands.append('SELECT')
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def uid(self, command, *args):
+        self.commands.append(f'UID {command}')
+        if command == 'SEARCH':
+            start = int(args[1].split()[1].split(':')[0])
+            uids = [uid for uid in sorted(self.messages) if uid >= start] or [max(self.messages)]
+            return 'OK', [' '.join(map(str, uids)).encode()]
+        message_set, items = args
+        if items == '(BODY.PEEK[])':
+            raw = self.messages[int(message_set)]
+            return 'OK', [(f'1 (UID {message_set} BODY[] {{{len(raw)}}}'.encode(), raw), b')']
+        if items == '(FLAGS)':
+            return 'OK', [f'{uid} (UID {uid} FLAGS (\\Seen))'.encode() for uid in sorted(self.messages)]
+        wanted = set()
+        for part in message_set.split(','):
+            low, _, high = part.partition(':')
+            wanted.update(range(int(low), int(high or low) + 1))
+        data = []
+        for uid in sorted(wanted & set(self.messages)):
+            header = self.messages[uid].split(b'\n\n')[0] + b'\r\n\r\n'
+            data.append((f'{uid} (UID {uid} RFC822.SIZE 100 FLAGS () BODY[HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID)] {{{len(header)}}}'.encode(), header))
+            data.append(b')')
+        return 'OK', data
+
+
+def test_incremental_sync_and_lookup():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MailboxIndex(os.path.join(tmp, 'index.db'))
+        mail = FakeIMAP(range(1, 201))
+
+        assert index.sync_folder(mail, 'INBOX') == 200
+
+        # 没有新邮件：只有一次STATUS
+        mail.commands.clear()
+        assert index.sync_folder(mail, 'INBOX') == 0
+        assert mail.commands == ['STATUS']
+
+        # 新邮件：只获取新增部分
+        mail.messages.update({uid: make_raw_email(uid) for uid in range(201, 206)})
+        assert index.sync_folder(mail, 'INBOX') == 5
+        assert index.get_folder_state('INBOX')['last_uid'] == 205
+
+        md5_uid = md5_uid_of(42)
+        mail.commands.clear()
+        found = find_email_by_md5_uid(index, mail, md5_uid)
+        assert found['imap_uid'] == 42
+        assert found['email']['body'] == '正文42'
+        assert mail.commands == ['SELECT', 'UID FETCH']
+
+        assert index.find_by_md5_uid('0' * 32) is None
+        index.close()
+
+
+def test_uidvalidity_change_rebuilds_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MailboxIndex(os.path.join(tmp, 'index.db'))
+        index.sync_folder(FakeIMAP(range(1, 51)), 'INBOX')
+
+        rebuilt = FakeIMAP(range(1, 11), uidvalidity=2)
+        assert index.sync_folder(rebuilt, 'INBOX') == 10
+        assert index.get_folder_state('INBOX')['uidvalidity'] == 2
+        md5_uid = md5_uid_of(30)
+        assert index.find_by_md5_uid(md5_uid) is None
+        index.close()
+
+
+def test_refresh_flags_removes_expunged():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = MailboxIndex(os.path.join(tmp, 'index.db'))
+        mail = FakeIMAP(range(1, 21))
+        index.sync_folder(mail, 'INBOX')
+
+        del mail.messages[5]
+        index.sync_folder(mail, 'INBOX', refresh_flags=True)
+        md5_uid = md5_uid_of(5)
+        assert index.find_by_md5_uid(md5_uid) is None
+        md5_uid = md5_uid_of(6)
+        assert index.find_by_md5_uid(md5_uid)['flags'] == '\\Seen'
+        index.close()
+
+
+def test_old_index_version_is_rebuilt():
+    """旧版本索引（MD5 UID计算方式不同）打开时被清空，下次同步全量重建"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.db')
+        index = MailboxIndex(path)
+        index.sync_folder(FakeIMAP(range(1, 11)), 'INBOX')
+        index.close()
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA user_version = 0")
+        conn.close()
+
+        index = MailboxIndex(path)
+        assert index.get_folder_state('INBOX') is None
+        assert index.sync_folder(FakeIMAP(range(1, 11)), 'INBOX') == 10
+        index.close()
+
+
+class RecordingPool:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+        return {}
+
+
+def test_reply_uses_index_with_same_uid_as_scan():
+    """apps_1215的回复通过索引找到的邮件与逐封扫描找到的相同，且不下载其他邮件"""
+    original_imap = apps_1215.imaplib.IMAP4
+    mail = FakeIMAP(range(1, 31))
+    apps_1215.imaplib.IMAP4 = lambda host, port: mail
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = MailboxIndex(os.path.join(tmp, 'index.db'))
+            replies = {}
+            for name, kwargs in [('scan', {}), ('index', {'mailbox_index': index})]:
+                pool = RecordingPool()
+                mail.commands.clear()
+                assert apps_1215.reply_to_email_by_md5_uid(
+                    None, None, 'me@example.com', None, 'imap', 143, 'me', 'pw',
+                    target_from_email='sender12@example.com',
+                    target_subject=Header('主题 12', 'utf-8').encode(),
+                    target_sent_time='2024-12-09 10:12:00',
+                    reply_body='收到', smtp_pool=pool, **kwargs)
+                replies[name] = (pool.sent[0], list(mail.commands))
+            index.close()
+    finally:
+        apps_1215.imaplib.IMAP4 = original_imap
+
+    scan_reply, scan_commands = replies['scan']
+    index_reply, index_commands = replies['index']
+    assert scan_reply['To'] == index_reply['To'] == 'sender12@example.com'
+    assert str(scan_reply['Subject']) == str(index_reply['Subject'])
+    assert scan_commands.count('FETCH') == 12
+    assert 'FETCH' not in index_commands
+    assert index_commands.count('UID FETCH') == 2  # 同步头字段一次，下载目标邮件一次
+
+
+if __name__ == '__main__':
+    test_incremental_sync_and_lookup()
+    test_uidvalidity_change_rebuilds_index()
+    test_refresh_flags_removes_expunged()
+    test_old_index_version_is_rebuilt()
+    test_reply_uses_index_with_same_uid_as_scan()
+    print("全部测试通过")
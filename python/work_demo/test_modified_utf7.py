@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""测试IMAP修改版UTF-7文件夹名编解码（RFC 3501 5.1.3）"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_0114_email import decode_modified_utf7, encode_modified_utf7, process_email_folders
+
+# (原始名称, 编码后名称)
+CASES = [
+    ('INBOX', 'INBOX'),
+    ('&', '&-'),
+    ('A&B', 'A&-B'),
+    ('台北', '&U,BTFw-'),  # RFC 3501中的例子，base64中的"/"替换为","
+    ('~peter/mail/台北/日本語', '~peter/mail/&U,BTFw-/&ZeVnLIqe-'),
+    ('中文other_test', '&Ti1lhw-other_test'),
+    ('😀 emoji', '&2D3eAA- emoji'),  # 代理对作为一个整体编码
+    ('财务&审计', '&jSJSoQ-&-&W6GLoQ-'),
+    ('', ''),
+]
+
+
+def test_known_encodings():
+    for original, encoded in CASES:
+        assert encode_modified_utf7(original) == encoded, original
+        assert decode_modified_utf7(encoded) == original, encoded
+
+
+def test_round_trip():
+    names = ['收件箱/2024/项目 A&B', 'Ünïcödé', 'Ελληνικά', '日本語フォルダ', '𠀀𠀁 CJK扩展B', 'a+b,c/d-e', '\x7f']
+    for name in names:
+        encoded = encode_modified_utf7(name)
+        assert all(0x20 <= ord(c) <= 0x7e for c in encoded), encoded
+        assert decode_modified_utf7(encoded) == name
+
+
+def test_invalid_input_is_kept():
+    # 没有结束符的&、非法base64按原样保留
+    assert decode_modified_utf7('bad&xx') == 'bad&xx'
+    assert decode_modified_utf7('&!!-') == '&!!-'
+
+
+def test_process_email_folders():
+    assert process_email_folders(['INBOX', '&Ti1lhw-other_test', '&U,BTFw-']) == ['INBOX', '中文other_test', '台北']
+
+
+if __name__ == '__main__':
+    test_known_encodings()
+    test_round_trip()
+    test_invalid_input_is_kept()
+    test_process_email_folders()
+    print("全部测试通过")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""测试RedisLock的互斥、token校验释放、看门狗续期和阻塞获取（使用内存Redis替身，不需要Redis服务）"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1216 import InMemoryRedis, RedisLock, StripedRedisLock, get_lock, un_lock
+
+
+def test_mutual_exclusion():
+    """多个线程阻塞竞争同一把锁，临界区内同一时间只有一个持有者"""
+    client = InMemoryRedis()
+    counter = [0]
+    holders = [0]
+    max_holders = [0]
+    state_lock = threading.Lock()
+
+    def worker():
+        lock = RedisLock(client, failure_threshold=1000)
+        for _ in range(20):
+            assert lock.get_lock('job', blocking=True, timeout=10, retry_interval=0.001, max_retry_interval=0.01)
+            with state_lock:
+                holders[0] += 1
+                max_holders[0] = max(max_holders[0], holders[0])
+            # 非原子的读-改-写，没有互斥时会丢失更新
+            value = counter[0]
+            time.sleep(0.0005)
+            counter[0] = value + 1
+            with state_lock:
+                holders[0] -= 1
+            assert lock.un_lock('job')
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"计数: {counter[0]}, 最大同时持有数: {max_holders[0]}")
+    assert counter[0] == 160
+    assert max_holders[0] == 1
+
+
+def test_release_checks_owner_token():
+    """锁过期后被其他客户端获取，原持有者释放时不能删除别人的锁"""
+    client = InMemoryRedis()
+    lock_a = RedisLock(client, expire_time=0.05)
+    lock_b = RedisLock(client, expire_time=10)
+
+    assert lock_a.get_lock('job')
+    assert not lock_b.get_lock('job')
+    time.sleep(0.1)
+    assert lock_b.get_lock('job')
+
+    assert not lock_a.un_lock('job')
+    assert not lock_a.extend('job')
+    assert client.get('job') is not None
+    assert lock_b.un_lock('job')
+    assert client.get('job') is None
+
+
+def test_watchdog_renews_lease():
+    """看门狗在任务耗时超过过期时间时自动续期，释放后停止"""
+    client = InMemoryRedis()
+    lock = RedisLock(client, expire_time=0.15)
+    other = RedisLock(client, expire_time=10)
+
+    assert lock.get_lock('long_job', watchdog=True)
+    time.sleep(0.5)
+    assert not other.get_lock('long_job')
+    assert lock.un_lock('long_job')
+    assert other.get_lock('long_job')
+
+
+def test_blocking_timeout_counts_one_failure():
+    """阻塞获取超时返回False，且只计一次失败"""
+    client = InMemoryRedis()
+    holder = RedisLock(client)
+    assert holder.get_lock('busy')
+
+    waiter = RedisLock(client)
+    start = time.monotonic()
+    assert not waiter.get_lock('busy', blocking=True, timeout=0.2, retry_interval=0.01)
+    elapsed = time.monotonic() - start
+
+    print(f"阻塞等待耗时: {elapsed:.3f}秒")
+    assert 0.2 <= elapsed < 0.5
+    assert client.get('lock_failure_count:busy') == '1'
+
+
+def test_function_api_releases_own_lock():
+    """独立函数get_lock/un_lock之间共享owner token"""
+    client = InMemoryRedis()
+    assert get_lock(client, 'func_lock')
+    assert not get_lock(client, 'func_lock')
+    assert un_lock(client, 'func_lock')
+    assert not un_lock(client, 'func_lock')
+
+
+def test_function_api_other_thread_cannot_release():
+    """独立函数的锁属于获取它的线程，其他线程（或其他进程）调用un_lock返回False且不删除锁"""
+    client = InMemoryRedis()
+    assert get_lock(client, 'thread_lock')
+    results = []
+    worker = threading.Thread(target=lambda: results.append(
+        (un_lock(client, 'thread_lock'), get_lock(client, 'thread_lock'))))
+    worker.start()
+    worker.join()
+    assert results == [(False, False)]
+    assert un_lock(client, 'thread_lock')
+
+
+def test_multi_key_all_or_nothing():
+    """多键加锁：任一键被占用时一个都不加锁，并对被占用的键计失败次数"""
+    client = InMemoryRedis()
+    holder = RedisLock(client)
+    assert holder.get_lock('res:b')
+
+    lock = RedisLock(client)
+    assert not lock.get_locks(['res:c', 'res:a', 'res:b'])
+    assert client.get('res:a') is None and client.get('res:c') is None
+    assert client.get('lock_failure_count:res:b') == '1'
+
+    assert holder.un_lock('res:b')
+    assert lock.get_locks(['res:c', 'res:a', 'res:b'], watchdog=True)
+    assert lock.un_locks(['res:a', 'res:b', 'res:c'])
+    assert all(client.get(key) is None for key in ('res:a', 'res:b', 'res:c'))
+
+
+def test_multi_key_overlapping_sets_no_deadlock():
+    """多个线程以随机顺序竞争有重叠的键集合，不会死锁，同一键同一时间只有一个持有者"""
+    client = InMemoryRedis()
+    keys = [f"res:{i}" for i in range(6)]
+    owners = {}
+    state_lock = threading.Lock()
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        lock = RedisLock(client, failure_threshold=10 ** 6)
+        for _ in range(30):
+            wanted = rng.sample(keys, 3)
+            assert lock.get_locks(wanted, blocking=True, timeout=10, retry_interval=0.001, max_retry_interval=0.005)
+            with state_lock:
+                if any(key in owners for key in wanted):
+                    errors.append(wanted)
+                owners.update({key: seed for key in wanted})
+            time.sleep(0.0005)
+            with state_lock:
+                for key in wanted:
+                    owners.pop(key)
+            assert lock.un_locks(wanted)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+
+    assert not any(t.is_alive() for t in threads)
+    assert not errors
+
+
+def test_striped_lock_bounded_keys():
+    """分段锁：大量ID只映射到固定数量的锁键，同一ID总是同一个键"""
+    client = InMemoryRedis()
+    striped = StripedRedisLock(client, 'orders', stripes=16)
+
+    stripe_keys = {striped.stripe_key(order_id) for order_id in range(100000)}
+    assert len(stripe_keys) == 16
+    assert striped.stripe_key('A-1') == StripedRedisLock(client, 'orders', stripes=16).stripe_key('A-1')
+
+    assert striped.get_lock(42)
+    other = StripedRedisLock(client, 'orders', stripes=16)
+    assert not other.get_lock(42)
+    assert striped.un_lock(42)
+
+    # 多个ID（可能落在同一段上）一次获取
+    assert striped.get_locks([1, 2, 3, 17, 33])
+    assert striped.un_locks([1, 2, 3, 17, 33])
+
+
+if __name__ == '__main__':
+    test_mutual_exclusion()
+    test_release_checks_owner_token()
+    test_watchdog_renews_lease()
+    test_blocking_timeout_counts_one_failure()
+    test_function_api_releases_own_lock()
+    test_function_api_other_thread_cannot_release()
+    test_multi_key_all_or_nothing()
+    test_multi_key_overlapping_sets_no_deadlock()
+    test_striped_lock_bounded_keys()
+    print("全部测试通过")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""测试SMTP连接池与并发发送（使用本地的简易SMTP服务器，不需要真实邮件服务器）"""
+
+import os
+import socketserver
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+from apps_1215 import SMTPConnectionPool, SMTPDeliveryUnknown, send_messages_concurrently, smtp_connector
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    只实现EHLO/AUTH PLAIN/MAIL/RCPT/DATA/RSET/NOOP/QUIT的SMTP服务器
+
+    记录登录次数、收到的邮件和最大并发会话数；drop_after_messages可以让服务器
+    在每个会话收到指定封数的邮件后，于下一封的MAIL命令时断开连接，模拟服务端超时断开；
+    收件人为disconnect@的邮件总是在RCPT命令时断开连接；
+    收件人为vanish@的邮件在收下正文后不回复直接断开（邮件已接收但客户端不知道）
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after_messages=None, delay=0.0):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.drop_after_messages = drop_after_messages
+        self.delay = delay
+        self.logins = 0
+        self.messages = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self.session(server)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def session(self, server):
+        self.reply('220 localhost ESMTP test')
+        received = 0
+        rcpts = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250 AUTH PLAIN\r\n')
+            elif verb == 'AUTH':
+                with server.lock:
+                    server.logins += 1
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                if server.drop_after_messages is not None and received >= server.drop_after_messages:
+                    return
+                rcpts = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if 'rejected@' in command:
+                    self.reply('550 No such user')
+                elif 'disconnect@' in command:
+                    time.sleep(0.05)
+                    return
+                else:
+                    rcpts.append(command)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b''):
+                        break
+                    data.append(data_line)
+                time.sleep(server.delay)
+                received += 1
+                with server.lock:
+                    server.messages.append(b''.join(data))
+                if any('vanish@' in rcpt for rcpt in rcpts):
+                    return
+                self.reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def make_message(i, to='user@example.com'):
+    msg = MIMEText(f'工单 {i} 已处理', 'plain', 'utf-8')
+    msg['From'] = 'support@example.com'
+    msg['To'] = to
+    msg['Subject'] = f'Re: 工单 {i}'
+    return msg
+
+
+def test_concurrent_send_reuses_sessions():
+    """并发发送复用已登录的连接，同时连接数不超过上限"""
+    server = LocalSMTPServer(delay=0.005)
+    pool = SMTPConnectionPool(smtp_connector('127.0.0.1', server.port, 'support', 'secret'), max_connections=3)
+    try:
+        results = send_messages_concurrently([make_message(i) for i in range(60)], pool=pool)
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f"发送 {len(results)} 封, 登录 {server.logins} 次, 最大并发会话 {server.max_active}")
+    assert [result['index'] for result in results] == list(range(60))
+    assert all(result['success'] for result in results)
+    assert len(server.messages) == 60
+    assert server.logins <= 3
+    assert server.max_active <= 3
+
+
+def test_reconnect_on_server_disconnect():
+    """服务端断开连接后透明重连，邮件不丢失"""
+    server = LocalSMTPServer(drop_after_messages=5)
+    pool = SMTPConnectionPool(smtp_connector('127.0.0.1', server.port, 'support', 'secret'), max_connections=1)
+    try:
+        results = send_messages_concurrently([make_message(i) for i in range(12)], pool=pool)
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f"重连 {pool.reconnects} 次, 登录 {server.logins} 次")
+    assert all(result['success'] for result in results)
+    assert len(server.messages) == 12
+    assert pool.reconnects == 2
+    assert server.logins == 3
+
+
+def test_per_message_results():
+    """收件人被拒绝的邮件单独报告失败，其余邮件正常发送且连接继续复用"""
+    server = LocalSMTPServer()
+    pool = SMTPConnectionPool(smtp_connector('127.0.0.1', server.port, 'support', 'secret'), max_connections=1,
+                              max_messages_per_connection=3)
+    messages = [make_message(i, 'rejected@example.com' if i == 2 else 'user@example.com') for i in range(7)]
+    try:
+        results = send_messages_concurrently(messages, pool=pool)
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f"发送结果: {[(result['index'], result['success']) for result in results]}")
+    assert [result['success'] for result in results] == [True, True, False, True, True, True, True]
+    assert 'rejected@example.com' in results[2]['error']
+    assert len(server.messages) == 6
+    # 被拒绝后RSET继续复用连接；每个连接最多发送3封，6封成功的邮件需要两次登录
+    assert server.logins == 2
+
+
+def test_more_workers_than_connections_with_disconnects():
+    """线程数多于连接数，连接被服务端断开或达到邮件数上限关闭后，等待的线程能新建连接继续发送"""
+    server = LocalSMTPServer(drop_after_messages=3, delay=0.002)
+    pool = SMTPConnectionPool(smtp_connector('127.0.0.1', server.port, 'support', 'secret'), max_connections=2,
+                              max_messages_per_connection=2)
+    failed = []
+
+    def worker(n):
+        # 前两个线程的邮件重连后仍被断开，连接丢弃后不再归还
+        to = 'disconnect@example.com' if n < 2 else 'user@example.com'
+        for i in range(1 if n < 2 else 3):
+            try:
+                pool.send(make_message(n * 100 + i, to))
+            except Exception:
+                failed.append(n)
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(8)]
+    try:
+        for thread in threads[:2]:
+            thread.start()
+        time.sleep(0.02)
+        for thread in threads[2:]:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        alive = sum(thread.is_alive() for thread in threads)
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f"未结束线程 {alive}, 发送 {len(server.messages)} 封, 重连 {pool.reconnects} 次, 新建连接 {pool.connections_opened} 个")
+    assert alive == 0
+    assert sorted(failed) == [0, 1]
+    assert len(server.messages) == 18
+    assert pool.reconnects >= 2
+    # 丢弃和关闭的连接都已让出名额
+    assert pool._created == 0
+
+
+def test_no_resend_after_data():
+    """DATA之后连接断开时不重发（服务器可能已接收），报告为投递状态未知"""
+    server = LocalSMTPServer()
+    pool = SMTPConnectionPool(smtp_connector('127.0.0.1', server.port, 'support', 'secret'), max_connections=1)
+    try:
+        try:
+            pool.send(make_message(0, 'vanish@example.com'))
+        except SMTPDeliveryUnknown:
+            pass
+        else:
+            raise AssertionError("DATA之后断开应该抛出SMTPDeliveryUnknown")
+        results = send_messages_concurrently([make_message(1, 'vanish@example.com'), make_message(2)], pool=pool)
+    finally:
+        pool.close()
+        server.stop()
+
+    print(f"发送结果: {[(r['success'], r['delivery_unknown']) for r in results]}, 服务器收到 {len(server.messages)} 封")
+    assert len(server.messages) == 3
+    assert pool.reconnects == 0
+    assert [(r['success'], r['delivery_unknown']) for r in results] == [(False, True), (True, False)]
+
+
+if __name__ == '__main__':
+    test_concurrent_send_reuses_sessions()
+    test_reconnect_on_server_disconnect()
+    test_per_message_results()
+    test_more_workers_than_connections_with_disconnects()
+    test_no_resend_after_data()
+    print("全部测试通过")
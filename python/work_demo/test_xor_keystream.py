@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""测试整块异或的密钥流与原来逐字节实现的输出完全一致"""
+
+import base64
+import hashlib
+import hmac
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apps'))
+
+import apps_0107
+from apps_0107 import _derive_key, _xor_keystream, decrypt_data, encrypt_data
+
+MASTER_KEY = "test_master_key"
+
+
+def legacy_xor(data, enc_key, iv):
+    """原实现：逐字节异或"""
+    result = bytearray()
+    for i, byte in enumerate(data):
+        key_byte = enc_key[i % len(enc_key)] ^ iv[i % len(iv)]
+        result.append(byte ^ key_byte)
+    return bytes(result)
+
+
+def legacy_encrypt(data, salt, master_key, iv):
+    """按原实现的格式生成密文：base64(盐值长度 + 盐值 + IV + 密文 + HMAC)"""
+    derived_key = hashlib.pbkdf2_hmac('sha256', master_key.encode('utf-8'), salt.encode('utf-8'), 100000, dklen=64)
+    ciphertext = legacy_xor(data.encode('utf-8'), derived_key[:32], iv)
+    digest = hmac.new(derived_key[32:], iv + ciphertext, hashlib.sha256).digest()
+    salt_bytes = salt.encode('utf-8')
+    return base64.b64encode(struct.pack('>I', len(salt_bytes)) + salt_bytes + iv + ciphertext + digest).decode('utf-8')
+
+
+def test_keystream_matches_legacy():
+    """各种长度（含非整周期、空数据）和密钥/IV长度下与逐字节实现一致"""
+    rng = random.Random(0)
+    lengths = list(range(0, 70)) + [255, 256, 1000, 4097, 65536 + 7]
+    for length in lengths:
+        data = bytes(rng.getrandbits(8) for _ in range(length))
+        enc_key = bytes(rng.getrandbits(8) for _ in range(32))
+        iv = bytes(rng.getrandbits(8) for _ in range(16))
+        assert _xor_keystream(data, enc_key, iv) == legacy_xor(data, enc_key, iv), length
+    # 非16/32字节的组合（周期为最小公倍数）
+    for key_length, iv_length in ((24, 16), (7, 5), (1, 1)):
+        data = os.urandom(500)
+        enc_key, iv = os.urandom(key_length), os.urandom(iv_length)
+        assert _xor_keystream(data, enc_key, iv) == legacy_xor(data, enc_key, iv)
+    # 以0x00开头的数据和结果不会因为整数转换丢失前导字节
+    enc_key, iv = bytes(32), bytes(16)
+    assert _xor_keystream(b'\x00\x00abc', enc_key, iv) == b'\x00\x00abc'
+    print(f"测试长度数: {len(lengths)}")
+
+
+def test_encrypt_output_identical_to_legacy():
+    """固定IV时encrypt_data的输出与原实现逐字节相同，原实现的密文可以正常解密"""
+    iv = bytes(range(16))
+    original_urandom = apps_0107.os.urandom
+    apps_0107.os.urandom = lambda n: iv[:n]
+    try:
+        for data in ('a', 'hello world' * 3, '中文密码🔐' * 50, 'x' * 10000):
+            expected = legacy_encrypt(data, 'alice', MASTER_KEY, iv)
+            assert encrypt_data(data, 'alice', MASTER_KEY)['data'] == expected
+            assert decrypt_data(expected, 'alice', MASTER_KEY)['data'] == data
+    finally:
+        apps_0107.os.urandom = original_urandom
+
+
+def test_large_payload_roundtrip():
+    """1MB数据加解密往返"""
+    data = ''.join(random.Random(1).choices('abc中文字符123', k=1024 * 1024))
+    encrypted = encrypt_data(data, 'bob', MASTER_KEY)
+    assert encrypted['status']
+    assert decrypt_data(encrypted['data'], 'bob', MASTER_KEY)['data'] == data
+    # 派生密钥已缓存，密文部分与逐字节实现一致
+    derived_key = _derive_key(MASTER_KEY, 'bob')
+    combined = base64.b64decode(encrypted['data'])
+    iv, ciphertext = combined[4 + 3:4 + 3 + 16], combined[4 + 3 + 16:-32]
+    assert ciphertext[:4096] == legacy_xor(data.encode('utf-8')[:4096], derived_key[:32], iv)
+
+
+if __name__ == '__main__':
+    test_keystream_matches_legacy()
+    test_encrypt_output_identical_to_legacy()
+    test_large_payload_roundtrip()
+    print("全部测试通过")